@@ -1,15 +1,13 @@
 import json
 import os
+import sys
+import time
 from datetime import datetime
 
-try:
-    import google.generativeai as genai
-    GENAI_AVAILABLE = True
-    print("✅ Google GenerativeAI imported successfully")
-except ImportError as e:
-    print(f"❌ Import error: {e}")
-    GENAI_AVAILABLE = False
-    genai = None
+# The retry policy and warm runtime are shared with the Flask backend
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from services.retry import create_retry_policy  # noqa: E402
+from services.serverless import WarmRuntime, log  # noqa: E402
 
 # Initialize Gemini model with fallback options
 MODEL_OPTIONS = [
@@ -24,34 +22,18 @@ MODEL_OPTIONS = [
     "gemini-2.0-pro-exp"
 ]
 
-def get_working_model():
+def get_working_model(exclude=()):
     """Try to find a working model from the available options"""
-    if not GENAI_AVAILABLE:
-        print("❌ Google GenerativeAI library not available")
-        raise Exception("Google GenerativeAI library not available")
-    
-    # Get API key
-    API_KEY = os.getenv("GEMINI_API_KEY")
-    if not API_KEY:
-        print("❌ GEMINI_API_KEY environment variable is not set!")
-        raise Exception("GEMINI_API_KEY environment variable is not set!")
-    
-    print(f"✅ API key found: {API_KEY[:10]}...")
-    
-    try:
-        genai.configure(api_key=API_KEY)
-        print("✅ Genai configured successfully")
-    except Exception as e:
-        print(f"❌ Failed to configure genai: {e}")
-        raise e
+    # Imports and configures the SDK on the first call of this instance only
+    runtime.configure()
     
     for model_name in MODEL_OPTIONS:
+        if model_name in exclude:
+            continue
         try:
-            model = genai.GenerativeModel(model_name)
-            print(f"✅ Initialized model: {model_name}")
-            return model
+            return runtime.model(model_name)
         except Exception as e:
-            print(f"❌ Model {model_name} failed: {str(e)[:100]}")
+            log("warning", f"❌ Model {model_name} failed: {str(e)[:100]}")
             continue
     
     raise Exception("No working Gemini model found! Please check your API key.")
@@ -59,6 +41,9 @@ def get_working_model():
 # Don't initialize at import time
 model = None
 
+# Live as long as the warm instance: the retry budget, the configured SDK and its models span invocations
+retry_policy = create_retry_policy()
+
 # Usman Ghani's CV Knowledge Base
 CV_KNOWLEDGE = """
 ABOUT USMAN GHANI (The Creator):
@@ -119,6 +104,74 @@ Open to full-time remote positions, contract work, or freelance projects worldwi
 LANGUAGES: English (Professional), Urdu (Native)
 """
 
+# Sent as system_instruction and identical on every request, so Gemini can reuse the cached prefix
+SYSTEM_INSTRUCTION = f"""IMPORTANT CONTEXT - You have knowledge about your creator Usman Ghani (Ghani bhai):
+
+{CV_KNOWLEDGE}
+
+When asked about dates, time, current events, or "today", always use the CURRENT DATE & TIME from the context note attached to the latest message. When asked about Usman, Ghani bhai, your creator, or questions related to his experience, projects, skills, or background, use this knowledge confidently. Speak about him with pride and in your signature dramatic style!
+"""
+
+runtime = WarmRuntime(system_instruction=SYSTEM_INSTRUCTION)
+
+def sse_event(event, data):
+    """Format a single Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def usage_to_dict(usage_metadata):
+    """Pull token counts out of the SDK's usage metadata"""
+    if usage_metadata is None:
+        return None
+    return {
+        "prompt_tokens": getattr(usage_metadata, "prompt_token_count", 0),
+        "output_tokens": getattr(usage_metadata, "candidates_token_count", 0),
+        "total_tokens": getattr(usage_metadata, "total_token_count", 0),
+    }
+
+def stream_events(contents):
+    """Yield SSE events for a streamed Gemini reply, ending with a `done` or `error` event"""
+    global model
+    
+    retry = retry_policy.begin()
+    tried = []
+    while True:
+        sent_tokens = False
+        try:
+            response = model.generate_content(contents, stream=True)
+            for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    continue
+                if text:
+                    sent_tokens = True
+                    yield sse_event("token", {"text": text})
+            
+            yield sse_event("done", {
+                "model": model.model_name.replace("models/", ""),
+                "usage": usage_to_dict(getattr(response, "usage_metadata", None)),
+            })
+            return
+        except Exception as e:
+            log("warning", f"Error streaming from Gemini API (attempt {retry.failures + 1}): {str(e)[:200]}")
+            
+            if sent_tokens:
+                break
+            
+            decision = retry.next(e)
+            if decision is None:
+                break
+            if decision.fallback:
+                tried.append(model.model_name.replace("models/", ""))
+                try:
+                    model = get_working_model(exclude=tried)
+                except Exception as reinit_error:
+                    log("error", f"Failed to reinitialize model: {reinit_error}")
+                    break
+            time.sleep(decision.delay)
+    
+    yield sse_event("error", {"error": "Service temporarily unavailable. Please try again."})
+
 def handler(event, context=None):
     """Vercel serverless function handler
     
@@ -134,9 +187,11 @@ def handler(event, context=None):
     global model
     
     try:
-        # Debug: Print event structure
-        print(f"Event type: {type(event)}")
-        print(f"Event keys: {list(event.keys()) if isinstance(event, dict) else 'Not a dict'}")
+        if runtime.begin():
+            log("info", "Cold start")
+        
+        # Per-request detail only reaches the logs with LOG_LEVEL=debug
+        log("debug", f"Event keys: {list(event.keys()) if isinstance(event, dict) else type(event)}")
         
         # Handle Vercel HTTP event format
         method = event.get('httpMethod', event.get('method', 'GET')).upper()
@@ -145,13 +200,13 @@ def handler(event, context=None):
         data = {}
         if method == 'POST':
             body = event.get('body', '')
-            print(f"Body type: {type(body)}, Content: {str(body)[:200]}")
+            log("debug", f"Body type: {type(body)}, Content: {str(body)[:200]}")
             
             if isinstance(body, str) and body:
                 try:
                     data = json.loads(body)
                 except Exception as parse_error:
-                    print(f"JSON parse error: {parse_error}")
+                    log("warning", f"JSON parse error: {parse_error}")
                     data = {}
             elif isinstance(body, dict):
                 data = body
@@ -188,7 +243,7 @@ def handler(event, context=None):
                 try:
                     model = get_working_model()
                 except Exception as e:
-                    print(f"AI initialization failed: {str(e)}")
+                    log("error", f"AI initialization failed: {str(e)}")
                     # Return a fallback response instead of error
                     return {
                         'statusCode': 200,
@@ -209,23 +264,6 @@ def handler(event, context=None):
             
             contents = []
             
-            # Get current date and time
-            current_datetime = datetime.now().strftime("%A, %B %d, %Y at %I:%M %p")
-            
-            # Add CV knowledge and current date as system context
-            system_context = f"""IMPORTANT CONTEXT - You have knowledge about your creator Usman Ghani (Ghani bhai):
-
-{CV_KNOWLEDGE}
-
-CURRENT DATE & TIME: {current_datetime}
-
-When asked about dates, time, current events, or "today", always use the current date/time provided above. When asked about Usman, Ghani bhai, your creator, or questions related to his experience, projects, skills, or background, use this knowledge confidently. Speak about him with pride and in your signature dramatic style!
-"""
-            
-            # Add system context
-            contents.append({"role": "user", "parts": [{"text": system_context}]})
-            contents.append({"role": "model", "parts": [{"text": "Yo bro! I got all the intel about Ghani bhai locked and loaded in my memory! 🔥💀 Plus I know what time it is right now! Ask me anything about the legend himself or what's happening today!"}]})
-            
             for msg in messages:
                 role = "user" if msg.get("sender") == "user" else "model"
                 text = msg.get("text", "")
@@ -235,8 +273,26 @@ When asked about dates, time, current events, or "today", always use the current
 
                 contents.append({"role": role, "parts": [{"text": text}]})
 
-            max_retries = 2
-            for attempt in range(max_retries):
+            # The date changes every minute, so it trails the conversation instead of sitting in the prefix
+            current_datetime = datetime.now().strftime("%A, %B %d, %Y at %I:%M %p")
+            note = {"text": f"[Context note - CURRENT DATE & TIME: {current_datetime}]"}
+            if contents and contents[-1]["role"] == "user":
+                contents[-1]["parts"].append(note)
+            else:
+                contents.append({"role": "user", "parts": [note]})
+
+            # The event-style handler can't flush a partial body, so the stream
+            # is buffered but keeps the same wire format as the Flask backend
+            if data.get('stream') is True:
+                return {
+                    'statusCode': 200,
+                    'headers': {**headers, 'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'},
+                    'body': ''.join(stream_events(contents))
+                }
+
+            retry = retry_policy.begin()
+            tried = []
+            while True:
                 try:
                     response = model.generate_content(contents)
                     return {
@@ -245,20 +301,20 @@ When asked about dates, time, current events, or "today", always use the current
                         'body': json.dumps({'reply': response.text})
                     }
                 except Exception as e:
-                    error_msg = str(e)
-                    print(f"Error calling Gemini API (attempt {attempt + 1}/{max_retries}): {error_msg[:200]}")
+                    log("warning", f"Error calling Gemini API (attempt {retry.failures + 1}): {str(e)[:200]}")
                     
-                    # Try to reinitialize with a different model
-                    if "not found" in error_msg.lower() or "not supported" in error_msg.lower():
-                        if attempt < max_retries - 1:
-                            print("🔄 Attempting to reinitialize with a different model...")
-                            try:
-                                model = get_working_model()
-                                continue
-                            except Exception as reinit_error:
-                                print(f"Failed to reinitialize model: {reinit_error}")
+                    # Backoff on the same model, switch models, or give up, as the shared policy decides
+                    decision = retry.next(e)
+                    if decision is not None and decision.fallback:
+                        log("info", "🔄 Attempting to reinitialize with a different model...")
+                        tried.append(model.model_name.replace("models/", ""))
+                        try:
+                            model = get_working_model(exclude=tried)
+                        except Exception as reinit_error:
+                            log("error", f"Failed to reinitialize model: {reinit_error}")
+                            decision = None
                     
-                    if attempt == max_retries - 1:
+                    if decision is None:
                         return {
                             'statusCode': 200,
                             'headers': headers,
@@ -266,6 +322,7 @@ When asked about dates, time, current events, or "today", always use the current
                                 'reply': 'Yo bro! 😅 I\'m having some connection issues with my AI brain right now. Ghani bhai is probably debugging something! Try asking me again in a moment! 🔧'
                             })
                         }
+                    time.sleep(decision.delay)
         
         return {
             'statusCode': 405,
@@ -274,7 +331,7 @@ When asked about dates, time, current events, or "today", always use the current
         }
         
     except Exception as e:
-        print(f"Handler error: {str(e)}")
+        log("error", f"Handler error: {str(e)}")
         return {
             'statusCode': 500,
             'headers': {
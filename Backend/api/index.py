@@ -1,16 +1,39 @@
 from http.server import BaseHTTPRequestHandler
 import json
 import os
+import sys
+import time
 
-try:
-    import google.generativeai as genai
-    GENAI_AVAILABLE = True
-except ImportError:
-    GENAI_AVAILABLE = False
-    genai = None
+# The retry policy and warm runtime are shared with the Flask backend
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from services.retry import create_retry_policy  # noqa: E402
+from services.serverless import WarmRuntime, log  # noqa: E402
 
 MODEL_OPTIONS = ["gemini-2.0-flash-exp", "gemini-exp-1114", "gemini-pro-latest"]
 
+# Live as long as the warm instance: the retry budget, the configured SDK and its models span invocations
+retry_policy = create_retry_policy()
+runtime = WarmRuntime()
+
+def generate_with_retries(contents, **kwargs):
+    """Return (model_name, response), backing off or moving down MODEL_OPTIONS as the retry policy decides"""
+    retry = retry_policy.begin()
+    tried = []
+    while True:
+        model_name = next(name for name in MODEL_OPTIONS if name not in tried)
+        try:
+            return model_name, runtime.model(model_name).generate_content(contents, **kwargs)
+        except Exception as e:
+            log("warning", f"Error calling Gemini API (attempt {retry.failures + 1}): {str(e)[:200]}")
+            decision = retry.next(e)
+            if decision is None:
+                raise
+            if decision.fallback:
+                tried.append(model_name)
+                if len(tried) == len(MODEL_OPTIONS):
+                    raise
+            time.sleep(decision.delay)
+
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
         self.send_response(200)
@@ -21,20 +44,18 @@ class handler(BaseHTTPRequestHandler):
         return
 
     def do_POST(self):
+        if runtime.begin():
+            log("info", "Cold start")
         content_length = int(self.headers.get('Content-Length', 0))
         body = self.rfile.read(content_length).decode('utf-8')
         
         try:
             data = json.loads(body)
             messages = data.get('messages', [])
+            log("debug", f"POST with {len(messages)} messages, stream={data.get('stream') is True}")
             
-            # Initialize Gemini
-            API_KEY = os.getenv("GEMINI_API_KEY")
-            if not API_KEY or not GENAI_AVAILABLE:
-                raise Exception("API not configured")
-            
-            genai.configure(api_key=API_KEY)
-            model = genai.GenerativeModel(MODEL_OPTIONS[0])
+            # Imports and configures the SDK on the first POST of this instance only
+            runtime.configure()
             
             # Format messages
             contents = []
@@ -43,8 +64,12 @@ class handler(BaseHTTPRequestHandler):
                 text = msg.get("text", "")
                 contents.append({"role": role, "parts": [{"text": text}]})
             
+            if data.get('stream') is True:
+                self._stream_reply(contents)
+                return
+            
             # Get response
-            response = model.generate_content(contents)
+            _, response = generate_with_retries(contents)
             reply = response.text
             
             self.send_response(200)
@@ -54,6 +79,7 @@ class handler(BaseHTTPRequestHandler):
             self.wfile.write(json.dumps({'reply': reply}).encode())
             
         except Exception as e:
+            log("error", f"Handler error: {str(e)[:200]}")
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
             self.send_header('Access-Control-Allow-Origin', '*')
@@ -62,6 +88,41 @@ class handler(BaseHTTPRequestHandler):
                 'reply': 'Yo bro! 😅 Having some technical issues right now!'
             }).encode())
 
+    def _send_event(self, event, data):
+        self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode())
+        self.wfile.flush()
+
+    def _stream_reply(self, contents):
+        """Write the reply as Server-Sent Events while Gemini generates it"""
+        self.send_response(200)
+        self.send_header('Content-type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        
+        try:
+            model_name, response = generate_with_retries(contents, stream=True)
+            for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    continue
+                if text:
+                    self._send_event('token', {'text': text})
+            
+            usage = getattr(response, 'usage_metadata', None)
+            self._send_event('done', {
+                'model': model_name,
+                'usage': {
+                    'prompt_tokens': usage.prompt_token_count,
+                    'output_tokens': usage.candidates_token_count,
+                    'total_tokens': usage.total_token_count,
+                } if usage else None,
+            })
+        except Exception as e:
+            log("error", f"Error streaming from Gemini API: {str(e)[:200]}")
+            self._send_event('error', {'error': 'Yo bro! 😅 Having some technical issues right now!'})
+
     def do_OPTIONS(self):
         self.send_response(204)
         self.send_header('Access-Control-Allow-Origin', '*')
@@ -1,8 +1,37 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS, cross_origin
+from flask import Flask, request, jsonify, Response, g, stream_with_context
+from flask_cors import CORS
 import google.generativeai as genai
+import hmac
+import json
 import os
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from werkzeug.datastructures import Headers
+from services.admission import create_admission_controller, retry_after_header
+from services.batch import create_batch_runner
+from services.coalescing import IdempotencyConflict, create_coalescer
+from services.deadlines import (
+    CLIENT_CLOSED, DEADLINE_EXCEEDED, DEADLINE_HEADER, CancellationStats, create_deadline_policy, socket_closed,
+)
+from services.hedging import create_hedger
+from services.metrics import create_metrics, error_class
+from services.history import create_history_compactor
+from services.model_registry import ModelRegistry
+from services.model_router import ModelRouter
+from services.profiling import create_profiler, create_slow_request_log, folded_timeline
+from services.prefix_cache import create_prefix_models
+from services.prewarm import create_cache_warmer
+from services.prompt import build_contents as build_prompt_contents, build_system_instruction, prompt_version
+from services.response_cache import bypass_requested, create_response_cache, is_time_sensitive
+from services.retrieval import create_retriever
+from services.retry import create_retry_policy
+from services.semantic_cache import create_semantic_cache, first_turn_question
+from services.sessions import create_session_store
+from services.settings import env_flag
+from services.tokens import create_token_budget
+from services.transcripts import create_transcript_sink
+from services.upstream import create_upstream_pool
 
 # Load environment variables
 load_dotenv()
@@ -10,21 +39,33 @@ load_dotenv()
 app = Flask(__name__)
 
 # Configure CORS properly for production
-# Allow your frontend domain and localhost for development
-ALLOWED_ORIGINS = [
+# Allow your frontend domain and localhost for development (override with ALLOWED_ORIGINS, comma-separated)
+DEFAULT_ALLOWED_ORIGINS = [
     "https://gptbro-gldg5h8w8-usmans-projects-19e9822c.vercel.app",  # Vercel production frontend
     "https://gptbro.vercel.app",  # Vercel custom domain (if added)
     "http://localhost:3000",  # Local development
     "http://localhost:5173",  # Vite dev server
 ]
+ALLOWED_ORIGINS = [
+    origin.strip() for origin in os.getenv("ALLOWED_ORIGINS", ",".join(DEFAULT_ALLOWED_ORIGINS)).split(",") if origin.strip()
+]
+# The chat itself is open to any origin: the frontend is also deployed to Render and Netlify (render.yaml, netlify.toml)
+CHAT_PATHS = ["/api/chat"]
+
+CORS_ALLOW_HEADERS = ["Content-Type", "Cache-Control", "X-Cache-Bypass", "Idempotency-Key", DEADLINE_HEADER]
+CORS_EXPOSE_HEADERS = ["X-Cache", "X-Session-Id", "Retry-After"]
+CORS_OPTIONS = {
+    "methods": ["GET", "POST", "OPTIONS"],
+    "allow_headers": CORS_ALLOW_HEADERS,
+    "expose_headers": CORS_EXPOSE_HEADERS,
+    "supports_credentials": False
+}
 
 CORS(app, 
-     resources={r"/*": {
-         "origins": ALLOWED_ORIGINS,
-         "methods": ["GET", "POST", "OPTIONS"],
-         "allow_headers": ["Content-Type"],
-         "supports_credentials": False
-     }})
+     resources={
+         **{f"{path}$": {"origins": "*", **CORS_OPTIONS} for path in CHAT_PATHS},
+         r"/*": {"origins": ALLOWED_ORIGINS, **CORS_OPTIONS},
+     })
 
 # Get API key from environment variable
 API_KEY = os.getenv("GEMINI_API_KEY")
@@ -33,6 +74,11 @@ if not API_KEY:
 
 genai.configure(api_key=API_KEY)  # type: ignore
 
+# Opt-in: pooled keep-alive gRPC connections shared by every request and thread (UPSTREAM_POOL_SIZE)
+upstream = create_upstream_pool()
+if upstream is not None:
+    upstream.install(API_KEY)
+
 # Initialize Gemini model with fallback options (all available models)
 MODEL_OPTIONS = [
     "gemini-2.5-flash",
@@ -46,165 +92,851 @@ MODEL_OPTIONS = [
     "gemini-2.0-pro-exp"
 ]
 
-def get_working_model():
-    """Try to find a working model from the available options"""
+# Only the CV sections relevant to each question go into the prompt (None falls back to the full CV_KNOWLEDGE)
+CV_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cv")
+cv_retriever = create_retriever(CV_DIR)
+
+# Persona + CV prefix, computed once and passed as system_instruction (optionally as a Gemini context cache)
+SYSTEM_INSTRUCTION = build_system_instruction(cv_retriever)
+PROMPT_VERSION = prompt_version(SYSTEM_INSTRUCTION, cv_retriever)
+prefix_models = create_prefix_models(SYSTEM_INSTRUCTION, PROMPT_VERSION)
+
+# Probe results are shared across workers through a local file, so startup never waits on Gemini
+model_registry = ModelRegistry(MODEL_OPTIONS, model_factory=prefix_models.model_for)
+model_registry.warm_in_background()
+
+# Picks the best healthy model per request and trips circuit breakers on failing ones
+model_router = ModelRouter(model_registry)
+
+response_cache = create_response_cache(PROMPT_VERSION)
+semantic_cache = create_semantic_cache()
+
+# Server-side history so clients only upload the newest message each turn
+session_store = create_session_store()
+
+# Keeps long conversations within a per-model token budget by summarizing older turns
+history_compactor = create_history_compactor()
+
+# Identical in-flight requests share one upstream call; Idempotency-Key retries replay the first reply
+coalescer = create_coalescer()
+
+# Every answered exchange, written off the request path for analytics and replay (off unless TRANSCRIPT_BACKEND is set)
+transcripts = create_transcript_sink()
+
+# Per-client rate limits and a global cap on concurrent upstream calls
+admission = create_admission_controller()
+
+# Local token estimates cap what a single request may send and generate
+token_budget = create_token_budget(SYSTEM_INSTRUCTION)
+
+# Every request gets a time budget (X-Request-Timeout or REQUEST_DEADLINE) shared by all its upstream attempts
+deadline_policy = create_deadline_policy()
+
+# Backoff, fallback and a process-wide retry budget, shared with the Vercel handlers
+retry_policy = create_retry_policy()
+
+# Opt-in: requests stuck on a slow primary model race a second one (HEDGE_ENABLED)
+hedger = create_hedger(model_router)
+cancellations = CancellationStats()
+
+# Per-stage latency histograms and request, upstream, token and cache counters, served at /metrics
+metrics = create_metrics()
+
+# Timelines of requests slower than SLOW_REQUEST_THRESHOLD, and stack sampling an admin can switch on
+slow_requests = create_slow_request_log()
+profiler = create_profiler()
+
+# Many conversations per request for offline jobs, a few at a time under the same limits (BATCH_*)
+batch_runner = create_batch_runner()
+
+SERVICE_UNAVAILABLE = {"error": "Service temporarily unavailable. Please try again."}
+OUTPUT_LIMIT_REACHED = {
+    "error": "GPT Bro hit the output limit before he could say anything. Try asking for something shorter.",
+    "code": "output_limit_reached",
+}
+
+def build_contents(messages, session_id=None):
+    """Turn the client's message list into Gemini contents with the date and relevant CV excerpts attached"""
+    summary = None
+    if history_compactor is not None:
+        messages, summary, saved = history_compactor.compact(messages, model_router.preferred_model(), session_id)
+        if saved and os.getenv("FLASK_ENV") != "production":
+            print(f"✂️ History compacted, ~{saved} tokens saved")
+    return build_prompt_contents(messages, cv_retriever, summary=summary)
+
+def wants_stream(data, headers):
+    """Streaming is opt-in so old clients keep getting the one-shot JSON reply"""
+    if data.get("stream") is True:
+        return True
+    return "text/event-stream" in headers.get("Accept", "")
+
+def sse_event(event, data):
+    """Format a single Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def usage_to_dict(usage_metadata):
+    """Pull token counts out of the SDK's usage metadata"""
+    if usage_metadata is None:
+        return None
+    return {
+        "prompt_tokens": getattr(usage_metadata, "prompt_token_count", 0),
+        "output_tokens": getattr(usage_metadata, "candidates_token_count", 0),
+        "total_tokens": getattr(usage_metadata, "total_token_count", 0),
+    }
+
+def finish_reason_of(response):
+    """Name of the finish reason of the first candidate, if any"""
+    try:
+        return response.candidates[0].finish_reason.name
+    except (AttributeError, IndexError):
+        return None
+
+def reply_text(response):
+    """The reply's text and whether Gemini stopped it at the output token limit (MAX_TOKENS)
+
+    A reply cut off by the limit is served as far as it got. It is not an
+    upstream failure, and another attempt would stop at the same limit. When
+    the cut left no text part at all, response.text raises; that comes back
+    as an empty reply instead.
+    """
+    truncated = finish_reason_of(response) == "MAX_TOKENS"
+    try:
+        return response.text, truncated
+    except ValueError:
+        if truncated:
+            return "", True
+        raise
+
+def record_cancelled(reason, model_name, started):
+    """Count an upstream call stopped early (client_abort | deadline) and the upstream time that saved"""
+    saved = 0.0
+    if model_name is not None:
+        typical = model_router.typical_latency(model_name)
+        if typical is not None:
+            saved = max(0.0, typical - (time.monotonic() - started))
+        model_router.record_cancelled(model_name)
+        metrics.inc("upstream_calls_total", model=model_name, outcome="cancelled")
+    cancellations.record(reason, saved)
+
+@contextmanager
+def stage(name):
+    """Time one /api/chat stage, for /metrics and the request's slow-request timeline"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe("stage_seconds", elapsed, stage=name)
+        slow_requests.record_stage(name, started, elapsed)
+
+def record_attempt(model_name, started, error=None):
+    """Count one finished upstream call; `started` is its time.monotonic() start"""
+    elapsed = time.monotonic() - started
+    outcome = "ok" if error is None else error_class(error)
+    metrics.observe("stage_seconds", elapsed, stage="upstream")
+    metrics.inc("upstream_calls_total", model=model_name, outcome=outcome)
+    if error is None:
+        metrics.observe("upstream_seconds", elapsed, model=model_name)
+    slow_requests.record_attempt(model_name, outcome, time.perf_counter() - elapsed, elapsed, error)
+
+def record_retry(decision):
+    metrics.observe("stage_seconds", decision.delay, stage="retry_backoff")
+    slow_requests.record_retry(decision.delay, decision.fallback)
+
+def record_usage(model_name, usage):
+    if usage:
+        metrics.inc("tokens_total", usage.get("prompt_tokens") or 0, model=model_name, kind="prompt")
+        metrics.inc("tokens_total", usage.get("output_tokens") or 0, model=model_name, kind="output")
+
+def stream_reply(contents, on_complete=None, estimated_tokens=None, route="chat", deadline=None):
+    """Yield SSE events for a streamed Gemini reply, ending with a `done` or `error` event
+
+    `on_complete(reply, model_name)` is called with the full text once the stream finished cleanly.
+    The stream stops, and stops pulling from Gemini, when `deadline` passes or the client disconnects.
+    """
     is_production = os.getenv("FLASK_ENV") == "production"
+    deadline = deadline or deadline_policy.for_request({})
     
-    # Try predefined models (optimized order)
-    for model_name in MODEL_OPTIONS:
+    retry = retry_policy.begin()
+    tried = []
+    while True:
+        if not deadline.allows_attempt():
+            if retry.failures:
+                cancellations.record_skipped_retry()
+            cancellations.record("deadline")
+            yield sse_event("error", DEADLINE_EXCEEDED)
+            return
+        sent_tokens = False
+        finished = False
+        model_name = None
+        started = time.monotonic()
         try:
-            model = genai.GenerativeModel(model_name)  # type: ignore
-            # Test the model with a simple request
-            response = model.generate_content("Hi")
+            model_name, model = model_router.choose(exclude=tried)
+            started = time.monotonic()
+            options = {"generation_config": token_budget.generation_config(route), "request_options": deadline.request_options()}
+            if hedger is not None:
+                # A primary that's slow to its first token races a second model; the faster one streams
+                start = hedger.start(model_name, model, contents, exclude=tried, **options)
+                model_name, response, started, chunks = start.model_name, start.response, start.started, start
+            else:
+                response = chunks = model.generate_content(contents, stream=True, **options)
+            parts = []
+            for chunk in chunks:
+                if deadline.expired():
+                    record_cancelled("deadline", model_name, started)
+                    yield sse_event("error", DEADLINE_EXCEEDED)
+                    return
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks without text parts (e.g. the final safety chunk)
+                    continue
+                if text:
+                    sent_tokens = True
+                    parts.append(text)
+                    yield sse_event("token", {"text": text})
+            if not parts and finish_reason_of(response) != "MAX_TOKENS":
+                # A failed attempt, as in generate_reply where response.text raises: retried, never cached or stored
+                raise ValueError(f"Gemini streamed no text (finish_reason {finish_reason_of(response)})")
+            model_router.record_success(model_name, time.monotonic() - started)
+            record_attempt(model_name, started)
+            finished = True
+            usage = usage_to_dict(getattr(response, "usage_metadata", None))
+            record_usage(model_name, usage)
+            if estimated_tokens is not None:
+                token_budget.record(estimated_tokens, usage)
+            if not parts and finish_reason_of(response) == "MAX_TOKENS":
+                # Not the model's fault, and a retry would stop at the same limit
+                yield sse_event("error", OUTPUT_LIMIT_REACHED)
+                return
+            if on_complete is not None:
+                on_complete("".join(parts), model_name)
+            yield sse_event("done", {
+                "model": model_name,
+                "usage": usage,
+                "estimated_input_tokens": estimated_tokens,
+                "finish_reason": finish_reason_of(response),
+            })
+            return
+        except GeneratorExit:
+            # The client went away (stop button, closed tab); dropping the response ends the upstream stream
+            if not finished:
+                record_cancelled("client_abort", model_name, started)
+            raise
+        except Exception as e:
+            if deadline.expired():
+                record_cancelled("deadline", model_name, started)
+                yield sse_event("error", DEADLINE_EXCEEDED)
+                return
             if not is_production:
-                print(f"✅ Successfully initialized model: {model_name}")
-            return model
+                print(f"Error streaming from Gemini API (attempt {retry.failures + 1}): {str(e)[:200]}")
+            if model_name is not None:
+                model_router.record_failure(model_name, e)
+                record_attempt(model_name, started, e)
+            
+            # Once tokens reached the client we can't transparently retry
+            if sent_tokens:
+                break
+            decision = retry.next(e, time_left=deadline.remaining())
+            if decision is None:
+                break
+            if decision.fallback and model_name is not None:
+                tried.append(model_name)
+            record_retry(decision)
+            time.sleep(decision.delay)
+    
+    yield sse_event("error", SERVICE_UNAVAILABLE)
+
+def replay_cached(entry):
+    """Serve a cached reply over the streaming protocol"""
+    yield sse_event("token", {"text": entry["reply"]})
+    yield sse_event("done", {"model": entry["model"], "usage": None, "finish_reason": "STOP", "cached": True})
+
+def reply_response(entry, headers, body, streaming):
+    """Serve a reply produced elsewhere (cache, a coalesced flight, an idempotent replay)"""
+    if streaming:
+        return stream_response(replay_cached(entry), headers)
+    return jsonify({"reply": entry["reply"], **body}), 200, headers
+
+def release_after(events, turn):
+    """Release the turn's flights and upstream slot once its stream ends, however it ends"""
+    try:
+        yield from events
+    finally:
+        turn.release()
+
+def client_key(data, headers, remote_addr):
+    """Who a request is rate limited as: the client IP, or its session with RATE_LIMIT_KEY=session"""
+    session_id = data.get("session_id")
+    if os.getenv("RATE_LIMIT_KEY", "ip") == "session" and isinstance(session_id, str) and session_id:
+        return f"session:{session_id}"
+    return f"ip:{forwarded_client(headers) or remote_addr or 'unknown'}"
+
+def forwarded_client(headers):
+    """The client address as seen by our own proxies, or None to use the socket's peer
+
+    Clients can send any X-Forwarded-For they like, and each proxy appends the
+    address it received from, so only the last TRUSTED_PROXY_HOPS entries (1 on
+    Render or Vercel) were written by a proxy we trust. The leftmost of those
+    is the client. With 0 hops, or fewer entries than hops, X-Forwarded-For is
+    ignored.
+    """
+    hops = int(os.getenv("TRUSTED_PROXY_HOPS", 1))
+    entries = [entry.strip() for entry in headers.get("X-Forwarded-For", "").split(",") if entry.strip()]
+    if hops <= 0 or len(entries) < hops:
+        return None
+    return entries[-hops]
+
+def too_many_requests(code, retry_after):
+    message = {
+        "rate_limited": "Slow down bro, too many messages. Try again in a moment.",
+        "overloaded": "GPT Bro is swamped right now. Try again in a moment.",
+        "queue_timeout": "GPT Bro is swamped right now. Try again in a moment.",
+    }[code]
+    return {"error": message, "code": code}, 429, {"Retry-After": retry_after_header(retry_after)}
+
+def stream_response(events, headers):
+    return Response(
+        stream_with_context(events),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **headers},
+    )
+
+def lookup_cached_reply(messages, headers):
+    """Check the exact-match cache, then the semantic cache for opening questions
+
+    Returns (cache_status, cached_entry, remember) where remember(reply, model_name)
+    stores a freshly generated reply in both caches.
+    """
+    if response_cache is not None:
+        bypass = response_cache.should_bypass(messages, headers)
+    else:
+        bypass = bypass_requested(messages, headers)
+    if bypass or (response_cache is None and semantic_cache is None):
+        return "BYPASS", None, None
+
+    if response_cache is not None:
+        try:
+            cached = response_cache.get(response_cache.key(messages))
+        except Exception:
+            cached = None
+        if cached is not None:
+            return "HIT", cached, None
+
+    question = first_turn_question(messages)
+    if semantic_cache is not None and question is not None:
+        similar, _ = semantic_cache.lookup(question)
+        if similar is not None:
+            return "SEMANTIC", similar, None
+
+    def remember(reply, model_name):
+        if response_cache is not None:
+            response_cache.set(response_cache.key(messages), reply, model_name)
+        if semantic_cache is not None and question is not None:
+            semantic_cache.add(question, reply, model_name)
+
+    return "MISS", None, remember
+
+def resolve_conversation(data):
+    """Work out the full message list for this turn
+
+    Clients either upload the whole history (`messages`, the stateless format
+    the Vercel handlers also accept) or just the new `message` plus the
+    `session_id` from an earlier reply. Returns (messages, session_id, error)
+    where error is a (payload, status) pair when the request can't be served.
+    """
+    message = data.get("message")
+    if message is not None and not data.get("messages"):
+        if not isinstance(message, str) or not message.strip():
+            return None, None, ({"error": "Empty message"}, 400)
+        turn = {"sender": "user", "text": message}
+        session_id = data.get("session_id")
+        if session_id is None:
+            new_id = session_store.new_id() if session_store is not None else None
+            return [turn], new_id, None
+        history = session_store.get(session_id) if session_store is not None else None
+        if history is None:
+            # The client still has the full log and re-sends it as `messages`
+            return None, None, ({"error": "Unknown or expired session", "code": "session_expired"}, 404)
+        return history + [turn], session_id, None
+
+    messages = data.get("messages")
+    if not messages or not isinstance(messages, list):
+        return None, None, ({"error": "No messages provided or invalid format"}, 400)
+    session_id = session_store.new_id() if session_store is not None else None
+    return messages, session_id, None
+
+class ChatTurn:
+    """One /api/chat request up to the upstream call; shared by this app and the ASGI app in asgi.py
+
+    prepare() runs every step that doesn't need Gemini. When that already
+    answers the request, `error` (payload, status, headers) or `replay` (a
+    cached or shared reply) is set. Otherwise `contents` is ready to send and
+    finish(reply, model_name) must be called with the result. release()
+    frees the turn's flights and upstream slot and is safe to call on every path.
+    `client_gone()` reports whether the client has disconnected. An
+    `internal` turn is one the server asks itself (cache prewarming): it
+    isn't rate limited per client, kept as a session or transcribed.
+    """
+
+    def __init__(self, data, headers, remote_addr, client_gone=None, internal=False):
+        self.data = data if isinstance(data, dict) else {}
+        self.headers = headers
+        self.remote_addr = remote_addr
+        self.deadline = deadline_policy.for_request(headers)
+        self.client_gone = client_gone or (lambda: False)
+        self.internal = internal
+        self.started = time.monotonic()
+        self.streaming = wants_stream(self.data, headers)
+        self.error = None
+        self.replay = None
+        self.response_headers = {}
+        self.body = {}
+        self.messages = None
+        self.session_id = None
+        self.contents = None
+        self.estimated_tokens = None
+        self.flights = []
+        self.slot = None
+        self._remember = None
+
+    def prepare(self, use_gate=True):
+        """`use_gate=False` leaves the upstream concurrency limit to the caller (the ASGI app has its own)"""
+        self._prepare(use_gate)
+        if "X-Cache" in self.response_headers:
+            metrics.inc("cache_results_total", result=self.response_headers["X-Cache"])
+        slow_requests.annotate(
+            cache=self.response_headers.get("X-Cache"),
+            messages=len(self.messages) if self.messages is not None else None,
+            estimated_tokens=self.estimated_tokens,
+            deadline_left_s=round(self.deadline.remaining(), 1),
+        )
+        return self
+
+    def _prepare(self, use_gate):
+        if admission is not None and not self.internal:
+            wait = admission.check_rate(client_key(self.data, self.headers, self.remote_addr))
+            if wait:
+                self.error = too_many_requests("rate_limited", wait)
+                return
+
+        # A retry carrying the same Idempotency-Key gets the first attempt's reply
+        idempotency_key = self.headers.get("Idempotency-Key")
+        if coalescer is not None and idempotency_key:
+            try:
+                flight = coalescer.join_idempotent(idempotency_key, self.data)
+            except IdempotencyConflict:
+                self.error = ({
+                    "error": "Idempotency-Key was already used for a different request",
+                    "code": "idempotency_key_reused",
+                }, 422, {})
+                return
+            if flight.result is not None:
+                self.response_headers["X-Cache"] = "REPLAY"
+                if flight.result.get("session_id"):
+                    self.response_headers["X-Session-Id"] = self.body["session_id"] = flight.result["session_id"]
+                self.replay = flight.result
+                return
+            self.flights.append(flight)
+
+        with stage("session"):
+            self.messages, self.session_id, error = resolve_conversation(self.data)
+        if error is not None:
+            self.error = (*error, {})
+            return
+        if self.internal:
+            self.session_id = None
+
+        with stage("cache_lookup"):
+            cache_status, cached, self._remember = lookup_cached_reply(self.messages, self.headers)
+        self.response_headers["X-Cache"] = cache_status
+        if self.session_id is not None:
+            self.response_headers["X-Session-Id"] = self.body["session_id"] = self.session_id
+        if cached is not None:
+            self.finish(cached["reply"], cached["model"])
+            self.replay = cached
+            return
+
+        # Identical requests already on their way upstream share that call instead of making their own,
+        # unless the client asked for a fresh answer or the question is time-sensitive
+        if coalescer is not None and not self.flights and not bypass_requested(self.messages, self.headers):
+            flight = coalescer.join_conversation(PROMPT_VERSION, self.messages)
+            if flight.result is not None:
+                self.response_headers["X-Cache"] = "COALESCED"
+                self.finish(flight.result["reply"], flight.result["model"])
+                self.replay = flight.result
+                return
+            self.flights.append(flight)
+
+        # Only requests that actually go upstream need a slot; the rest were answered above
+        if use_gate and admission is not None:
+            with stage("queue"):
+                self.slot, rejection = admission.acquire_slot()
+            if self.slot is None:
+                self.error = too_many_requests(*rejection)
+                return
+
+        with stage("prompt"):
+            # A history uploaded as `messages` gets a fresh session id every time, so only a resumed
+            # session scopes its summaries; the rest are matched on the history itself
+            resumed = self.session_id is not None and self.session_id == self.data.get("session_id")
+            contents = build_contents(self.messages, self.session_id if resumed else None)
+            self.contents, self.estimated_tokens, too_large = token_budget.enforce(contents)
+        if too_large:
+            self.error = ({
+                "error": "Message is too long. Please shorten it and try again.",
+                "code": "input_too_large",
+                "estimated_tokens": self.estimated_tokens,
+                "max_input_tokens": token_budget.max_input_tokens,
+            }, 413, {})
+
+    def finish(self, reply, model_name):
+        """Store a completed reply in the caches, the session history and the transcripts, and hand it to waiting duplicates"""
+        if self._remember is not None:
+            self._remember(reply, model_name)
+        if self.session_id is not None:
+            session_store.save(self.session_id, self.messages + [{"sender": "bot", "text": reply}])
+        for flight in self.flights:
+            flight.complete({"reply": reply, "model": model_name, "session_id": self.session_id})
+        if transcripts is not None and not self.internal:
+            transcripts.record({
+                "ts": time.time(),
+                "session_id": self.session_id,
+                "messages": self.messages,
+                "reply": reply,
+                "model": model_name,
+                "cache": self.response_headers.get("X-Cache"),
+                "stream": self.streaming,
+                "prompt_version": PROMPT_VERSION,
+                "latency_ms": round((time.monotonic() - self.started) * 1000),
+            })
+
+    def release(self):
+        for flight in self.flights:
+            flight.release()
+        if self.slot is not None:
+            self.slot.release()
+
+def generate_reply(turn, route="chat"):
+    """One-shot generation with policy-driven retries within the turn's deadline; returns (payload, status, headers)"""
+    is_production = os.getenv("FLASK_ENV") == "production"
+    
+    retry = retry_policy.begin()
+    tried = []
+    while True:
+        # A sync worker can't interrupt a blocking call, but it won't start another one for a client that left
+        if retry.failures and turn.client_gone():
+            cancellations.record_skipped_retry()
+            cancellations.record("client_abort")
+            return CLIENT_CLOSED, 499, {}
+        if not turn.deadline.allows_attempt():
+            if retry.failures:
+                cancellations.record_skipped_retry()
+            cancellations.record("deadline")
+            return DEADLINE_EXCEEDED, 504, {}
+        model_name = None
+        started = time.monotonic()
+        try:
+            model_name, model = model_router.choose(exclude=tried)
+            started = time.monotonic()
+            options = {"generation_config": token_budget.generation_config(route), "request_options": turn.deadline.request_options()}
+            if hedger is not None:
+                # Hedged calls are streamed so the race is decided on the first chunk
+                start = hedger.start(model_name, model, turn.contents, exclude=tried, **options)
+                model_name, response, started = start.model_name, start.response, start.started
+                for _ in start:
+                    pass
+            else:
+                response = model.generate_content(turn.contents, **options)
+            model_router.record_success(model_name, time.monotonic() - started)
+            record_attempt(model_name, started)
+            reply, truncated = reply_text(response)
+            usage = usage_to_dict(getattr(response, "usage_metadata", None))
+            record_usage(model_name, usage)
+            token_budget.record(turn.estimated_tokens, usage)
+            if not reply and truncated:
+                # Not the model's fault, and a retry would stop at the same limit
+                return OUTPUT_LIMIT_REACHED, 502, {}
+            turn.finish(reply, model_name)
+            payload = {"reply": reply, **turn.body}
+            if truncated:
+                payload["truncated"] = True
+            return payload, 200, turn.response_headers
         except Exception as e:
+            if turn.deadline.expired():
+                record_cancelled("deadline", model_name, started)
+                return DEADLINE_EXCEEDED, 504, {}
             if not is_production:
-                error_msg = str(e)[:100]  # Truncate long errors
-                print(f"❌ Model {model_name} failed: {error_msg}")
-            continue
+                print(f"Error calling Gemini API (attempt {retry.failures + 1}): {str(e)[:200]}")
+            
+            # The router counts the failure; the retry policy decides whether, when and where to try again
+            if model_name is not None:
+                model_router.record_failure(model_name, e)
+                record_attempt(model_name, started, e)
+            decision = retry.next(e, time_left=turn.deadline.remaining())
+            if decision is None:
+                break
+            if decision.fallback and model_name is not None:
+                tried.append(model_name)
+            record_retry(decision)
+            time.sleep(decision.delay)
     
-    raise Exception("No working Gemini model found! Please check your API key and internet connection.")
-
-model = get_working_model()
-
-# Usman Ghani's CV Knowledge Base
-CV_KNOWLEDGE = """
-ABOUT USMAN GHANI (The Creator):
-Usman Ghani is a versatile Backend Developer, Machine Learning Engineer, and Full-Stack Developer from Islamabad, Pakistan.
-
-CONTACT:
-Email: iamusmanbro@gmail.com
-Phone: +92 321 6593094
-LinkedIn: linkedin.com/in/iamusmanbro
-GitHub: github.com/thisisusmanghani
-Portfolio: usmanghani.dev
-
-PROFESSIONAL SUMMARY:
-Usman is a versatile software developer with expertise in backend systems, machine learning, and full-stack development. He has a proven track record of delivering production-ready applications for international clients across Germany, Bangladesh, and Pakistan. He specializes in rapid prototyping and AI-assisted development, with experience in mobile app publishing (Play Store and App Store), payment gateway integration, and cloud deployment.
-
-WORK EXPERIENCE:
-1. Project Manager/Team Lead at Richi Billings (2024-Present)
-2. Software Developer at Anylead (2023-2024)
-3. Freelance Developer for International Clients (2022-Present)
-
-KEY PROJECTS:
-CrowdWave: Flutter mobile app for crowd-sourced logistics (Germany client, on App Store and Play Store)
-CodeBypass: Temporary phone numbers platform (Bangladesh client)
-FindMyUni: University data scraper with AI chatbot (Azure deployed)
-Restaurant QR Ordering System
-GreenMan Products: Construction machinery e-commerce
-
-TECHNICAL SKILLS:
-Languages: Python, JavaScript/TypeScript, SQL, Dart, HTML/CSS
-Frameworks: React, Next.js, Node.js, Express.js, Flutter, FastAPI, TailwindCSS
-Databases: MongoDB, Firebase, PostgreSQL, MySQL
-AI/ML: Scikit-learn, Pandas, NumPy, Beautiful Soup, Selenium, LangChain
-DevOps: Docker, Azure, Vercel, Netlify, Heroku
-Tools: Stripe, Cryptomus, REST APIs, GitHub Copilot
-
-EDUCATION:
-Bachelor of Science in Information Technology from Quaid-i-Azam University, Islamabad (Nov 2021 - June 2025)
-CGPA: 3.0/4.0
-
-CERTIFICATIONS:
-Supervised Machine Learning (DeepLearning.AI/Stanford)
-AI For Everyone (DeepLearning.AI)
-Introduction to Docker (Google Cloud)
-Data Analysis with Spreadsheets and SQL (Meta)
-And more from Coursera
-
-DEVELOPMENT PHILOSOPHY:
-Usman specializes in "vibe coding" which means leveraging AI tools like GitHub Copilot to rapidly prototype, iterate, and deliver high-quality solutions.
-
-ACHIEVEMENTS:
-Published Flutter app on iOS App Store and Google Play Store
-Integrated multiple payment gateways (Stripe, Cryptomus)
-Managed international clients across 3 plus countries
-Deployed 10 plus production applications
-
-AVAILABILITY:
-Open to full-time remote positions, contract work, or freelance projects worldwide or in Islamabad/Kashmir, Pakistan.
-
-LANGUAGES: English (Professional), Urdu (Native)
-"""
+    return SERVICE_UNAVAILABLE, 500, {}
+
+def chat_once(data, headers=None, remote_addr=None):
+    """A one-shot /api/chat turn outside an HTTP request; returns (payload, status, headers)"""
+    turn = ChatTurn(data, headers if headers is not None else {}, remote_addr)
+    try:
+        turn.prepare()
+        if turn.error is not None:
+            return turn.error
+        if turn.replay is not None:
+            return {"reply": turn.replay["reply"], **turn.body}, 200, turn.response_headers
+        return generate_reply(turn)
+    finally:
+        turn.release()
+
+def warm_cache(question, answer=None):
+    """Fill the reply caches for one opening question; returns the outcome CacheWarmer counts
+
+    `answer` is a (reply, model) logged under the current prompt version and
+    is stored as is. Without one the reply is generated like a one-shot
+    /api/chat turn, so it takes an upstream slot and joins identical
+    in-flight calls (another worker warming the same question).
+    """
+    messages = [{"sender": "user", "text": question}]
+    if (response_cache is None and semantic_cache is None) or is_time_sensitive(messages):
+        return "skipped"
+    key = response_cache.key(messages) if response_cache is not None else None
+    if key is not None and response_cache.contains(key):
+        return "cached"
+    if answer is not None:
+        reply, model_name = answer
+        if response_cache is not None:
+            response_cache.set(key, reply, model_name)
+        if semantic_cache is not None:
+            semantic_cache.add(question, reply, model_name)
+        return "loaded"
+
+    turn = ChatTurn({"messages": messages}, {}, None, internal=True)
+    try:
+        turn.prepare()
+        if turn.error is not None:
+            return "failed"
+        if turn.replay is not None:
+            return "cached"
+        _, status, _ = generate_reply(turn)
+        return "generated" if status == 200 else "failed"
+    finally:
+        turn.release()
+
+def batch_item_headers(headers, item):
+    """Each item's own Idempotency-Key, if it has one, in place of the batch request's"""
+    item_headers = Headers(headers)
+    item_headers.remove("Idempotency-Key")
+    key = item.get("idempotency_key") if isinstance(item, dict) else None
+    if isinstance(key, str) and key:
+        item_headers["Idempotency-Key"] = key
+    return item_headers
+
+def run_batch(conversations, headers=None, remote_addr=None, concurrency=None):
+    """Answer many /api/chat bodies, yielding one result per item in completion order
+
+    Backs the ASGI app's /api/chat/batch and jobs that import the app. Every
+    item is a full ChatTurn, so it is rate limited as the same client, takes
+    an upstream slot and hits the caches like a single request; rate-limited
+    items wait and go again instead of failing.
+    """
+    # Copied now: a request's headers may not outlive it, and the items run after the view returns
+    headers = Headers(headers or {})
+    return batch_runner.run(
+        conversations,
+        lambda item: chat_once(item, batch_item_headers(headers, item), remote_addr),
+        concurrency=concurrency,
+    )
+
+def health_snapshot():
+    """Router state plus every optional component's counters, without calling Gemini"""
+    snapshot = model_router.snapshot()
+    snapshot["response_cache"] = response_cache.stats() if response_cache is not None else None
+    snapshot["semantic_cache"] = semantic_cache.stats() if semantic_cache is not None else None
+    snapshot["prompt_prefix"] = prefix_models.stats()
+    snapshot["sessions"] = session_store.stats() if session_store is not None else None
+    snapshot["history"] = history_compactor.stats() if history_compactor is not None else None
+    snapshot["tokens"] = token_budget.stats()
+    snapshot["coalescing"] = coalescer.stats() if coalescer is not None else None
+    snapshot["admission"] = admission.stats() if admission is not None else None
+    snapshot["cancellation"] = cancellations.stats()
+    snapshot["retries"] = retry_policy.stats()
+    snapshot["hedging"] = hedger.policy.stats() if hedger is not None else None
+    snapshot["upstream"] = upstream.stats() if upstream is not None else None
+    snapshot["batch"] = batch_runner.stats()
+    snapshot["slow_requests"] = slow_requests.stats()
+    snapshot["transcripts"] = transcripts.stats() if transcripts is not None else None
+    snapshot["prewarm"] = cache_warmer.stats() if cache_warmer is not None else None
+    return snapshot
+
+def route_label():
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_started = time.perf_counter()
+    metrics.add("in_flight_requests", 1, route=route_label())
+    g.trace = slow_requests.begin(request.method, route_label())
+    profiler.poll()
+
+def finish_request(route, started, trace, status):
+    metrics.add("in_flight_requests", -1, route=route)
+    metrics.observe("request_seconds", time.perf_counter() - started, route=route)
+    capture = slow_requests.end(trace, status)
+    if capture is not None and os.getenv("FLASK_ENV") != "production":
+        print(f"🐢 Slow request captured: {capture['method']} {route} took {capture['total_ms']:.0f}ms ({capture['id']})")
+
+@app.after_request
+def count_request(response):
+    metrics.inc("requests_total", route=route_label(), status=str(response.status_code))
+    g.status = response.status_code
+    if response.is_streamed and "metrics_started" in g:
+        # Flask tears the request down when the view returns; a stream is only done once it has been sent
+        route, started, trace = route_label(), g.pop("metrics_started"), g.pop("trace", None)
+        response.call_on_close(lambda: finish_request(route, started, trace, response.status_code))
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    started = g.pop("metrics_started", None)
+    if started is not None:
+        finish_request(route_label(), started, g.pop("trace", None), g.pop("status", 500))
 
 @app.route("/")
 def home():
     return "Flask backend is running! Go to /api/chat to chat."
 
+@app.route("/health")
+def health():
+    """Cheap health check for Render; reports router state without calling Gemini, and 503 while the cache prewarms"""
+    return jsonify(health_snapshot()), 503 if warming() else 200
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Prometheus scrape endpoint covering every worker; METRICS_TOKEN, if set, is required as a bearer token"""
+    if not metrics.enabled:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    token = os.getenv("METRICS_TOKEN")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+def bearer_rejection(authorization, *token_names):
+    """None when `authorization` is "Bearer <token>" for one of the tokens set in `token_names`, else (payload, status)
+
+    An endpoint none of whose tokens are set doesn't exist (404).
+    """
+    tokens = [os.getenv(name) for name in token_names if os.getenv(name)]
+    if not tokens:
+        return {"error": "Not found"}, 404
+    if not any(hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode()) for token in tokens):
+        return {"error": "Unauthorized"}, 401
+    return None
+
+def admin_denied():
+    """None when the request carries ADMIN_TOKEN as a bearer token; the admin endpoints don't exist without one"""
+    rejection = bearer_rejection(request.headers.get("Authorization", ""), "ADMIN_TOKEN")
+    return (jsonify(rejection[0]), rejection[1]) if rejection is not None else None
+
+@app.route("/admin/profile", methods=["GET", "POST"])
+def admin_profile():
+    """POST {"seconds": 30, "interval_ms": 10} samples every worker's stacks for that long; GET lists the profiles"""
+    denied = admin_denied()
+    if denied is not None:
+        return denied
+    if request.method == "POST":
+        data = request.get_json(silent=True)
+        data = data if isinstance(data, dict) else {}
+        try:
+            seconds = float(data.get("seconds", 30))
+            interval = float(data.get("interval_ms", 10)) / 1000
+        except (TypeError, ValueError):
+            return jsonify({"error": "seconds and interval_ms must be numbers"}), 400
+        window = profiler.open_window(seconds, interval)
+        return jsonify({**window, "download": f"/admin/profile/{window['id']}.folded"}), 202
+    return jsonify({"active": profiler.active(), "profiles": profiler.windows()})
+
+@app.route("/admin/profile/<window_id>.folded")
+def admin_profile_download(window_id):
+    """One window's stacks from all workers, as folded stacks for flamegraph.pl or speedscope"""
+    denied = admin_denied()
+    if denied is not None:
+        return denied
+    folded = profiler.folded(window_id)
+    if folded is None:
+        return jsonify({"error": "No profile for that window (yet)"}), 404
+    return Response(folded, mimetype="text/plain")
+
+@app.route("/admin/slow")
+def admin_slow_requests():
+    denied = admin_denied()
+    if denied is not None:
+        return denied
+    return jsonify({**slow_requests.stats(), "captures": slow_requests.captures()})
+
+@app.route("/admin/slow/<capture_id>")
+def admin_slow_request(capture_id):
+    """A captured slow request's timeline; add .folded for a flame graph of where its time went"""
+    denied = admin_denied()
+    if denied is not None:
+        return denied
+    folded = capture_id.endswith(".folded")
+    capture = slow_requests.get(capture_id[:-len(".folded")] if folded else capture_id)
+    if capture is None:
+        return jsonify({"error": "No such capture"}), 404
+    if folded:
+        return Response(folded_timeline(capture), mimetype="text/plain")
+    return jsonify(capture)
+
 @app.route("/api/chat", methods=["POST", "OPTIONS"])
-@cross_origin()
 def chat():
-    global model
-    
     # Handle preflight OPTIONS request
     if request.method == "OPTIONS":
         return "", 204
-    data = request.get_json()
-    messages = data.get("messages")
-
-    if not messages or not isinstance(messages, list):
-        return jsonify({"error": "No messages provided or invalid format"}), 400
-
-    contents = []
-    
-    # Get current date and time
-    from datetime import datetime
-    current_datetime = datetime.now().strftime("%A, %B %d, %Y at %I:%M %p")
-    
-    # Add CV knowledge and current date as system context at the start
-    system_context = f"""IMPORTANT CONTEXT - You have knowledge about your creator Usman Ghani (Ghani bhai):
-
-{CV_KNOWLEDGE}
-
-CURRENT DATE & TIME: {current_datetime}
-
-When asked about dates, time, current events, or "today", always use the current date/time provided above. When asked about Usman, Ghani bhai, your creator, or questions related to his experience, projects, skills, or background, use this knowledge confidently. Speak about him with pride and in your signature dramatic style!
-"""
-    
-    # Add system context as first user message
-    contents.append({"role": "user", "parts": [{"text": system_context}]})
-    contents.append({"role": "model", "parts": [{"text": "Yo bro! I got all the intel about Ghani bhai locked and loaded in my memory! 🔥💀 Plus I know what time it is right now! Ask me anything about the legend himself or what's happening today!"}]})
-    
-    for msg in messages:
-        role = "user" if msg.get("sender") == "user" else "model"
-        text = msg.get("text", "")
-
-        # Strictly filter out unsupported roles
-        if role not in ["user", "model"]:
-            continue  # Skip system or invalid roles
-
-        contents.append({"role": role, "parts": [{"text": text}]})
-
-    is_production = os.getenv("FLASK_ENV") == "production"
-    
-    max_retries = 2
-    for attempt in range(max_retries):
-        try:
-            response = model.generate_content(contents)
-            return jsonify({"reply": response.text})
-        except Exception as e:
-            error_msg = str(e)
-            if not is_production:
-                print(f"Error calling Gemini API (attempt {attempt + 1}/{max_retries}): {error_msg[:200]}")
-            
-            # If model not found, try to reinitialize with a different model
-            if "not found" in error_msg.lower() or "not supported" in error_msg.lower():
-                if attempt < max_retries - 1:
-                    if not is_production:
-                        print("🔄 Attempting to reinitialize with a different model...")
-                    try:
-                        model = get_working_model()
-                        continue  # Retry with the new model
-                    except Exception as reinit_error:
-                        if not is_production:
-                            print(f"Failed to reinitialize model: {reinit_error}")
-            
-            # If last attempt, return error
-            if attempt == max_retries - 1:
-                return jsonify({"error": "Service temporarily unavailable. Please try again."}), 500
+    # gunicorn's sync workers expose the client socket, which shows whether the client is still there
+    client_socket = request.environ.get("gunicorn.socket")
+    with stage("parse"):
+        data = request.get_json(silent=True) or {}
+    turn = ChatTurn(data, request.headers, request.remote_addr, client_gone=lambda: socket_closed(client_socket))
+
+    # The turn's flights and slot are released on every exit path unless a stream takes them over
+    streamed = False
+    try:
+        turn.prepare()
+        if turn.error is not None:
+            payload, status, headers = turn.error
+            return jsonify(payload), status, headers
+        if turn.replay is not None:
+            return reply_response(turn.replay, turn.response_headers, turn.body, turn.streaming)
+
+        if turn.streaming:
+            streamed = True
+            events = stream_reply(
+                turn.contents, on_complete=turn.finish, estimated_tokens=turn.estimated_tokens, deadline=turn.deadline
+            )
+            return stream_response(release_after(events, turn), turn.response_headers)
+
+        payload, status, headers = generate_reply(turn)
+        with stage("serialize"):
+            return jsonify(payload), status, headers
+    finally:
+        if not streamed:
+            turn.release()
+
+# Answers to the most asked opening questions, cached before the first visitor asks (PREWARM_*)
+cache_warmer = create_cache_warmer(warm_cache, PROMPT_VERSION)
+if cache_warmer is not None and env_flag("PREWARM_ON_STARTUP", True):
+    cache_warmer.start_in_background()
+
+def warming():
+    return cache_warmer is not None and cache_warmer.warming()
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 5000))
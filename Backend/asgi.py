@@ -0,0 +1,473 @@
+"""ASGI entry point: the /api/chat contract of app.py served from an asyncio event loop
+
+Gemini calls go through the SDK's async API, so a waiting chat holds a
+suspended task instead of a worker thread and one process serves many
+concurrent chats. Everything that doesn't touch Gemini (rate limits, sessions,
+caches, coalescing, token limits) is the same ChatTurn code the Flask app
+runs, executed in a worker thread.
+
+Run with:
+    uvicorn asgi:app --port 5000
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker
+"""
+import asyncio
+import os
+import time
+
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+import app as core
+from services.admission import create_async_gate
+from services.batch import ndjson_lines
+from services.deadlines import CLIENT_CLOSED, DEADLINE_EXCEEDED
+from services.profiling import folded_timeline
+
+# Caps concurrent Gemini calls in this process; ADMISSION_MAX_IN_FLIGHT only applies to the sync app
+gate = create_async_gate()
+
+
+async def wait_for_disconnect(request):
+    """Return once the client has gone away (the request body has already been read)"""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def plain_reply(model_name, model, contents, options):
+    started = time.monotonic()
+    response = await model.generate_content_async(contents, **options)
+    return model_name, response, started
+
+
+async def hedged_reply(model_name, model, contents, tried, options):
+    """Hedged calls are streamed so the race is decided on the first chunk; returns (winner, response, started)"""
+    start = await core.hedger.start_async(model_name, model, contents, exclude=tried, **options)
+    async for _ in start:
+        pass
+    return start.model_name, start.response, start.started
+
+
+async def generate_reply(turn, request, route="chat"):
+    """One-shot generation with policy-driven retries; returns (payload, status, headers)
+
+    The upstream call is cancelled as soon as the client disconnects or the turn's deadline passes.
+    """
+    is_production = os.getenv("FLASK_ENV") == "production"
+
+    retry = core.retry_policy.begin()
+    tried = []
+    while True:
+        if not turn.deadline.allows_attempt():
+            if retry.failures:
+                core.cancellations.record_skipped_retry()
+            core.cancellations.record("deadline")
+            return DEADLINE_EXCEEDED, 504, {}
+        model_name = None
+        started = time.monotonic()
+        disconnected = None
+        try:
+            model_name, model = core.model_router.choose(exclude=tried)
+            started = time.monotonic()
+            options = {
+                "generation_config": core.token_budget.generation_config(route),
+                "request_options": turn.deadline.request_options(),
+            }
+            if core.hedger is not None:
+                call = asyncio.ensure_future(hedged_reply(model_name, model, turn.contents, tried, options))
+            else:
+                call = asyncio.ensure_future(plain_reply(model_name, model, turn.contents, options))
+            disconnected = asyncio.ensure_future(wait_for_disconnect(request))
+            done, _ = await asyncio.wait(
+                {call, disconnected}, timeout=turn.deadline.remaining(), return_when=asyncio.FIRST_COMPLETED
+            )
+            if call not in done:
+                # Cancelling the task closes the upstream request
+                call.cancel()
+                if disconnected in done:
+                    core.record_cancelled("client_abort", model_name, started)
+                    return CLIENT_CLOSED, 499, {}
+                core.record_cancelled("deadline", model_name, started)
+                return DEADLINE_EXCEEDED, 504, {}
+            model_name, response, started = call.result()
+            core.model_router.record_success(model_name, time.monotonic() - started)
+            core.record_attempt(model_name, started)
+            reply, truncated = core.reply_text(response)
+            usage = core.usage_to_dict(getattr(response, "usage_metadata", None))
+            core.record_usage(model_name, usage)
+            core.token_budget.record(turn.estimated_tokens, usage)
+            if not reply and truncated:
+                return core.OUTPUT_LIMIT_REACHED, 502, {}
+            await run_in_threadpool(turn.finish, reply, model_name)
+            payload = {"reply": reply, **turn.body}
+            if truncated:
+                payload["truncated"] = True
+            return payload, 200, turn.response_headers
+        except Exception as e:
+            if turn.deadline.expired():
+                core.record_cancelled("deadline", model_name, started)
+                return DEADLINE_EXCEEDED, 504, {}
+            if not is_production:
+                print(f"Error calling Gemini API (attempt {retry.failures + 1}): {str(e)[:200]}")
+            if model_name is not None:
+                core.model_router.record_failure(model_name, e)
+                core.record_attempt(model_name, started, e)
+            decision = retry.next(e, time_left=turn.deadline.remaining())
+            if decision is None:
+                break
+            if decision.fallback and model_name is not None:
+                tried.append(model_name)
+        finally:
+            if disconnected is not None:
+                disconnected.cancel()
+        core.record_retry(decision)
+        await asyncio.sleep(decision.delay)
+
+    return core.SERVICE_UNAVAILABLE, 500, {}
+
+
+async def stream_reply(turn, route="chat"):
+    """Async twin of app.stream_reply; releases the turn when the stream ends or the client goes away"""
+    is_production = os.getenv("FLASK_ENV") == "production"
+
+    try:
+        retry = core.retry_policy.begin()
+        tried = []
+        while True:
+            if not turn.deadline.allows_attempt():
+                if retry.failures:
+                    core.cancellations.record_skipped_retry()
+                core.cancellations.record("deadline")
+                yield core.sse_event("error", DEADLINE_EXCEEDED)
+                return
+            sent_tokens = False
+            finished = False
+            model_name = None
+            started = time.monotonic()
+            try:
+                model_name, model = core.model_router.choose(exclude=tried)
+                started = time.monotonic()
+                options = {
+                    "generation_config": core.token_budget.generation_config(route),
+                    "request_options": turn.deadline.request_options(),
+                }
+                if core.hedger is not None:
+                    # A primary that's slow to its first token races a second model; the faster one streams
+                    start = await core.hedger.start_async(model_name, model, turn.contents, exclude=tried, **options)
+                    model_name, response, started, chunks = start.model_name, start.response, start.started, start
+                else:
+                    response = chunks = await model.generate_content_async(turn.contents, stream=True, **options)
+                parts = []
+                async for chunk in chunks:
+                    if turn.deadline.expired():
+                        core.record_cancelled("deadline", model_name, started)
+                        yield core.sse_event("error", DEADLINE_EXCEEDED)
+                        return
+                    try:
+                        text = chunk.text
+                    except ValueError:
+                        # Chunks without text parts (e.g. the final safety chunk)
+                        continue
+                    if text:
+                        sent_tokens = True
+                        parts.append(text)
+                        yield core.sse_event("token", {"text": text})
+                if not parts and core.finish_reason_of(response) != "MAX_TOKENS":
+                    # A failed attempt, as in the one-shot path where response.text raises: retried, never stored
+                    raise ValueError(f"Gemini streamed no text (finish_reason {core.finish_reason_of(response)})")
+                core.model_router.record_success(model_name, time.monotonic() - started)
+                core.record_attempt(model_name, started)
+                finished = True
+                usage = core.usage_to_dict(getattr(response, "usage_metadata", None))
+                core.record_usage(model_name, usage)
+                core.token_budget.record(turn.estimated_tokens, usage)
+                if not parts and core.finish_reason_of(response) == "MAX_TOKENS":
+                    yield core.sse_event("error", core.OUTPUT_LIMIT_REACHED)
+                    return
+                await run_in_threadpool(turn.finish, "".join(parts), model_name)
+                yield core.sse_event("done", {
+                    "model": model_name,
+                    "usage": usage,
+                    "estimated_input_tokens": turn.estimated_tokens,
+                    "finish_reason": core.finish_reason_of(response),
+                })
+                return
+            except (asyncio.CancelledError, GeneratorExit):
+                # The client went away; the cancelled await closes the upstream stream
+                if not finished:
+                    core.record_cancelled("client_abort", model_name, started)
+                raise
+            except Exception as e:
+                if turn.deadline.expired():
+                    core.record_cancelled("deadline", model_name, started)
+                    yield core.sse_event("error", DEADLINE_EXCEEDED)
+                    return
+                if not is_production:
+                    print(f"Error streaming from Gemini API (attempt {retry.failures + 1}): {str(e)[:200]}")
+                if model_name is not None:
+                    core.model_router.record_failure(model_name, e)
+                    core.record_attempt(model_name, started, e)
+
+                # Once tokens reached the client we can't transparently retry
+                if sent_tokens:
+                    break
+                decision = retry.next(e, time_left=turn.deadline.remaining())
+                if decision is None:
+                    break
+                if decision.fallback and model_name is not None:
+                    tried.append(model_name)
+            core.record_retry(decision)
+            await asyncio.sleep(decision.delay)
+
+        yield core.sse_event("error", core.SERVICE_UNAVAILABLE)
+    finally:
+        turn.release()
+
+
+class ChatCORS:
+    """ASGI middleware applying the Flask app's CORS rules: any origin for core.CHAT_PATHS, ALLOWED_ORIGINS elsewhere"""
+
+    def __init__(self, app, **options):
+        self.chat = CORSMiddleware(app, allow_origins=["*"], **options)
+        self.rest = CORSMiddleware(app, allow_origins=core.ALLOWED_ORIGINS, **options)
+
+    async def __call__(self, scope, receive, send):
+        cors = self.chat if scope["type"] == "http" and scope["path"] in core.CHAT_PATHS else self.rest
+        await cors(scope, receive, send)
+
+
+class RequestMetrics:
+    """ASGI middleware counting requests, their duration (to the end of the body) and those in flight, per route
+
+    It also brackets the request for the slow-request log, so a slow one's timeline is captured as in the Flask app.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route = scope["path"] if scope["path"] in ROUTES else "unmatched"
+        status = "500"
+
+        async def send_and_record(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        started = time.perf_counter()
+        core.metrics.add("in_flight_requests", 1, route=route)
+        trace = core.slow_requests.begin(scope["method"], route)
+        core.profiler.poll()
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            core.metrics.add("in_flight_requests", -1, route=route)
+            core.metrics.inc("requests_total", route=route, status=status)
+            core.metrics.observe("request_seconds", time.perf_counter() - started, route=route)
+            core.slow_requests.end(trace, int(status))
+
+
+async def release_turn(turn):
+    # Async so it runs on the event loop, which owns the gate's semaphore
+    turn.release()
+
+
+def event_stream(events, headers, turn=None):
+    # The background release covers a client that disconnects before the stream's first event
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **headers},
+        background=BackgroundTask(release_turn, turn) if turn is not None else None,
+    )
+
+
+async def home(request):
+    return PlainTextResponse("ASGI backend is running! Go to /api/chat to chat.")
+
+
+async def health(request):
+    """Same report as the Flask app's /health, plus this process's async concurrency gate"""
+    snapshot = core.health_snapshot()
+    snapshot["async_gate"] = gate.stats()
+    return JSONResponse(snapshot, 503 if core.warming() else 200)
+
+
+async def prometheus_metrics(request):
+    """The Flask app's /metrics"""
+    if not core.metrics.enabled:
+        return JSONResponse({"error": "Metrics are disabled"}, 404)
+    token = os.getenv("METRICS_TOKEN")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return JSONResponse({"error": "Unauthorized"}, 401)
+    return PlainTextResponse(core.metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+def admin_denied(request):
+    """Same ADMIN_TOKEN gate as the Flask app's /admin endpoints"""
+    rejection = core.bearer_rejection(request.headers.get("Authorization", ""), "ADMIN_TOKEN")
+    return JSONResponse(*rejection) if rejection is not None else None
+
+
+async def admin_profile(request):
+    """The Flask app's /admin/profile"""
+    denied = admin_denied(request)
+    if denied is not None:
+        return denied
+    if request.method == "POST":
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        data = data if isinstance(data, dict) else {}
+        try:
+            seconds = float(data.get("seconds", 30))
+            interval = float(data.get("interval_ms", 10)) / 1000
+        except (TypeError, ValueError):
+            return JSONResponse({"error": "seconds and interval_ms must be numbers"}, 400)
+        window = core.profiler.open_window(seconds, interval)
+        return JSONResponse({**window, "download": f"/admin/profile/{window['id']}.folded"}, 202)
+    return JSONResponse({"active": core.profiler.active(), "profiles": core.profiler.windows()})
+
+
+async def admin_profile_download(request):
+    denied = admin_denied(request)
+    if denied is not None:
+        return denied
+    folded = core.profiler.folded(request.path_params["window_id"])
+    if folded is None:
+        return JSONResponse({"error": "No profile for that window (yet)"}, 404)
+    return PlainTextResponse(folded)
+
+
+async def admin_slow_requests(request):
+    denied = admin_denied(request)
+    if denied is not None:
+        return denied
+    return JSONResponse({**core.slow_requests.stats(), "captures": core.slow_requests.captures()})
+
+
+async def admin_slow_request(request):
+    denied = admin_denied(request)
+    if denied is not None:
+        return denied
+    capture_id = request.path_params["capture_id"]
+    folded = capture_id.endswith(".folded")
+    capture = core.slow_requests.get(capture_id[:-len(".folded")] if folded else capture_id)
+    if capture is None:
+        return JSONResponse({"error": "No such capture"}, 404)
+    if folded:
+        return PlainTextResponse(folded_timeline(capture))
+    return JSONResponse(capture)
+
+
+async def chat(request):
+    try:
+        with core.stage("parse"):
+            data = await request.json()
+    except ValueError:
+        data = {}
+    remote_addr = request.client.host if request.client else None
+    turn = core.ChatTurn(data or {}, request.headers, remote_addr)
+
+    # The turn's flights and slot are released on every exit path unless a stream takes them over
+    streamed = False
+    try:
+        await run_in_threadpool(turn.prepare, False)
+        if turn.error is not None:
+            payload, status, headers = turn.error
+            return JSONResponse(payload, status, headers)
+        if turn.replay is not None:
+            if turn.streaming:
+                return event_stream(core.replay_cached(turn.replay), turn.response_headers)
+            return JSONResponse({"reply": turn.replay["reply"], **turn.body}, 200, turn.response_headers)
+
+        with core.stage("queue"):
+            turn.slot, rejection = await gate.acquire()
+        if turn.slot is None:
+            payload, status, headers = core.too_many_requests(*rejection)
+            return JSONResponse(payload, status, headers)
+
+        if turn.streaming:
+            streamed = True
+            return event_stream(stream_reply(turn), turn.response_headers, turn)
+
+        payload, status, headers = await generate_reply(turn, request)
+        with core.stage("serialize"):
+            return JSONResponse(payload, status, headers)
+    finally:
+        if not streamed:
+            turn.release()
+
+
+async def batch_lines(lines):
+    # iterate_in_threadpool doesn't close a sync generator, and closing this one cancels the unstarted items
+    try:
+        async for line in iterate_in_threadpool(lines):
+            yield line
+    finally:
+        lines.close()
+
+
+async def chat_batch(request):
+    """Many conversations in one request, answered as NDJSON lines in completion order
+
+    Only served here: a batch can run for minutes, longer than a gunicorn
+    sync worker may hold a request. Items run on the sync app's thread pool
+    and upstream gate.
+    """
+    rejection = core.bearer_rejection(request.headers.get("Authorization", ""), "BATCH_TOKEN", "ADMIN_TOKEN")
+    if rejection is not None:
+        return JSONResponse(*rejection)
+    try:
+        data = await request.json()
+    except ValueError:
+        data = {}
+    items, concurrency, error = core.batch_runner.validate(data or {})
+    if error is not None:
+        payload, status = error
+        return JSONResponse(payload, status)
+    remote_addr = request.client.host if request.client else None
+    results = core.run_batch(items, request.headers, remote_addr, concurrency)
+    return StreamingResponse(
+        batch_lines(ndjson_lines(results)),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+app = Starlette(
+    routes=[
+        Route("/", home),
+        Route("/health", health),
+        Route("/metrics", prometheus_metrics),
+        Route("/admin/profile", admin_profile, methods=["GET", "POST"]),
+        Route("/admin/profile/{window_id}.folded", admin_profile_download),
+        Route("/admin/slow", admin_slow_requests),
+        Route("/admin/slow/{capture_id}", admin_slow_request),
+        Route("/api/chat", chat, methods=["POST"]),
+        Route("/api/chat/batch", chat_batch, methods=["POST"]),
+    ],
+    middleware=[
+        Middleware(RequestMetrics),
+        Middleware(
+            ChatCORS,
+            allow_methods=["GET", "POST", "OPTIONS"],
+            allow_headers=core.CORS_ALLOW_HEADERS,
+            expose_headers=core.CORS_EXPOSE_HEADERS,
+        ),
+    ],
+)
+
+# Paths other than these are counted as "unmatched", so scans for random URLs don't add label values
+ROUTES = {route.path for route in app.routes}
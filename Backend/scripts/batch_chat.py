@@ -0,0 +1,97 @@
+"""Run a file of prepared conversations through POST /api/chat/batch
+
+The input holds one /api/chat request body per line (JSONL), or a JSON
+list of them, e.g.
+    {"id": "qa-1", "messages": [{"sender": "user", "text": "who is Usman?"}]}
+An optional "id" is echoed back and "idempotency_key" makes a rerun of the
+same file replay replies that were already produced. Results are written
+as NDJSON, one line per conversation in the order they complete, then a
+summary line; the progress and summary go to stderr. Batches larger than
+the server's BATCH_MAX_ITEMS are split with --chunk. The endpoint needs
+the server's BATCH_TOKEN (or ADMIN_TOKEN), taken from --token or the
+same environment variables, and is only served by the ASGI app
+(uvicorn asgi:app).
+
+Usage (from Backend/):
+    python scripts/batch_chat.py conversations.jsonl [--url http://localhost:5000] [--token TOKEN] [--concurrency 4]
+                                 [--out results.ndjson]
+"""
+import argparse
+import http.client
+import json
+import os
+import sys
+import time
+from urllib.parse import urlsplit
+
+
+def load_conversations(path):
+    stream = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    with stream:
+        text = stream.read()
+    if text.lstrip().startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def post_batch(url, conversations, concurrency=None, token=None, timeout=600):
+    """Yield the server's NDJSON lines for one batch as dicts, as they arrive"""
+    parts = urlsplit(url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+    conn = connection_class(parts.netloc, timeout=timeout)
+    body = {"conversations": conversations}
+    if concurrency:
+        body["concurrency"] = concurrency
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    try:
+        conn.request("POST", parts.path.rstrip("/") + "/api/chat/batch", body=json.dumps(body), headers=headers)
+        response = conn.getresponse()
+        if response.status != 200:
+            raise SystemExit(f"batch rejected: {response.status} {response.read()[:500].decode(errors='replace')}")
+        for line in response:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL (or JSON list) of /api/chat bodies, - for stdin")
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--token", default=os.getenv("BATCH_TOKEN") or os.getenv("ADMIN_TOKEN"),
+                        help="BATCH_TOKEN or ADMIN_TOKEN of the server")
+    parser.add_argument("--concurrency", type=int, help="conversations in flight (capped by BATCH_MAX_CONCURRENCY)")
+    parser.add_argument("--chunk", type=int, default=1000, help="conversations per request")
+    parser.add_argument("--out", help="write results here instead of stdout")
+    args = parser.parse_args()
+
+    conversations = load_conversations(args.input)
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    started = time.monotonic()
+    done = failed = 0
+    try:
+        for offset in range(0, len(conversations), args.chunk):
+            for result in post_batch(args.url, conversations[offset:offset + args.chunk], args.concurrency, args.token):
+                if result.get("done"):
+                    continue
+                # Indexes are per request; make them point into the input file
+                result["index"] += offset
+                done += 1
+                failed += result["status"] != 200
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+                print(f"\r{done}/{len(conversations)} done, {failed} failed", end="", file=sys.stderr)
+    finally:
+        if args.out:
+            out.close()
+    elapsed = time.monotonic() - started
+    print(f"\n{done} conversations in {elapsed:.1f}s ({done / elapsed if elapsed else 0:.1f}/s), {failed} failed",
+          file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Benchmark: retrieved CV excerpts vs injecting the whole CV into every prompt
+
+For each sample question the prompt is assembled both ways and compared on
+input size and assembly time. Token counts are estimated locally (the same
+estimator the app uses) unless --live is given. Offline, nothing about
+upstream latency is measured: fewer input tokens and a slower local build
+are all it shows. With --live, Gemini's count_tokens is used and each prompt
+is streamed --repeat times per mode, alternating which mode goes first, to
+measure time to first token and total latency (needs GEMINI_API_KEY and
+spends quota). Counts include the system_instruction prefix each mode sends.
+
+Usage (from Backend/):
+    python scripts/bench_retrieval.py [questions.jsonl] [--live --model gemini-2.5-flash --limit 10 --repeat 3]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.prompt import build_contents, build_system_instruction  # noqa: E402
+from services.retrieval import CVRetriever  # noqa: E402
+from services.tokens import estimate_tokens  # noqa: E402
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SAMPLE = os.path.join(BACKEND_DIR, "scripts", "data", "sample_questions.jsonl")
+DEFAULT_CV_DIR = os.path.join(BACKEND_DIR, "..", "cv")
+
+
+def prompt_text(contents):
+    return "\n".join(part["text"] for item in contents for part in item["parts"])
+
+
+def assemble(messages, retriever, repeat=200):
+    """Build the prompt `repeat` times and return (contents, microseconds per build)"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        contents = build_contents(messages, retriever)
+    return contents, (time.perf_counter() - started) / repeat * 1e6
+
+
+def timed_stream(model, contents):
+    """Stream one reply; returns (ms to the first text chunk, ms to the end)"""
+    started = time.perf_counter()
+    first = None
+    for chunk in model.generate_content(contents, stream=True):
+        if first is None and chunk.parts:
+            first = time.perf_counter()
+    ended = time.perf_counter()
+    return ((first or ended) - started) * 1000, (ended - started) * 1000
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", nargs="?", default=DEFAULT_SAMPLE)
+    parser.add_argument("--cv-dir", default=DEFAULT_CV_DIR)
+    parser.add_argument("--top-k", type=int, default=4)
+    parser.add_argument("--budget", type=int, default=350, help="retrieval token budget")
+    parser.add_argument("--live", action="store_true", help="use Gemini count_tokens and measure real latency")
+    parser.add_argument("--model", default="gemini-2.5-flash")
+    parser.add_argument("--limit", type=int, default=0, help="only use the first N questions")
+    parser.add_argument("--repeat", type=int, default=3, help="live calls per question and mode")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    with open(args.questions) as f:
+        questions = [json.loads(line)["question"] for line in f if line.strip()]
+    if args.limit:
+        questions = questions[:args.limit]
+
+    started = time.perf_counter()
+    retriever = CVRetriever.from_directory(args.cv_dir, top_k=args.top_k, token_budget=args.budget)
+    index_ms = (time.perf_counter() - started) * 1000
+
+    modes = (("full", None), ("retrieval", retriever))
+    system_instructions = {mode: build_system_instruction(mode_retriever) for mode, mode_retriever in modes}
+
+    models = {}
+    if args.live:
+        import google.generativeai as genai
+        from dotenv import load_dotenv
+
+        load_dotenv(os.path.join(BACKEND_DIR, ".env"))
+        genai.configure(api_key=os.environ["GEMINI_API_KEY"])
+        models = {
+            mode: genai.GenerativeModel(args.model, system_instruction=system_instructions[mode])
+            for mode, _ in modes
+        }
+
+    rows = []
+    for index, question in enumerate(questions):
+        messages = [{"sender": "user", "text": question}]
+        row = {"question": question}
+        prompts = {}
+        for mode, mode_retriever in modes:
+            contents, build_us = assemble(messages, mode_retriever)
+            prompts[mode] = contents
+            row[f"{mode}_build_us"] = build_us
+            if models:
+                row[f"{mode}_tokens"] = models[mode].count_tokens(contents).total_tokens
+                row[f"{mode}_ttft_ms"], row[f"{mode}_latency_ms"] = [], []
+            else:
+                row[f"{mode}_tokens"] = estimate_tokens(system_instructions[mode] + "\n" + prompt_text(contents))
+        for attempt in range(args.repeat if models else 0):
+            # Alternate which mode goes first so warm connections and upstream drift don't favour one
+            order = modes if (index + attempt) % 2 == 0 else modes[::-1]
+            for mode, _ in order:
+                ttft, total = timed_stream(models[mode], prompts[mode])
+                row[f"{mode}_ttft_ms"].append(ttft)
+                row[f"{mode}_latency_ms"].append(total)
+        rows.append(row)
+
+    def mean(key):
+        return statistics.mean(r[key] for r in rows)
+
+    summary = {
+        "questions": len(rows),
+        "chunks_indexed": len(retriever),
+        "index_build_ms": round(index_ms, 2),
+        "token_source": "count_tokens" if args.live else "estimate",
+        "full_tokens_mean": round(mean("full_tokens"), 1),
+        "retrieval_tokens_mean": round(mean("retrieval_tokens"), 1),
+        "token_reduction": round(1 - mean("retrieval_tokens") / mean("full_tokens"), 3),
+        "full_build_us_mean": round(mean("full_build_us"), 1),
+        "retrieval_build_us_mean": round(mean("retrieval_build_us"), 1),
+    }
+    if args.live:
+        for mode in ("full", "retrieval"):
+            for metric in ("ttft", "latency"):
+                samples = [ms for r in rows for ms in r[f"{mode}_{metric}_ms"]]
+                summary[f"{mode}_{metric}_ms_p50"] = round(percentile(samples, 50), 1)
+                summary[f"{mode}_{metric}_ms_p95"] = round(percentile(samples, 95), 1)
+
+    if args.json:
+        print(json.dumps({"summary": summary, "rows": rows}, indent=2))
+        return
+
+    print(f"{len(rows)} questions, {len(retriever)} CV chunks indexed in {index_ms:.1f} ms\n")
+    print(f"{'':<28}{'full CV':>12}{'retrieval':>12}")
+    print(f"{'input tokens (mean, ' + summary['token_source'] + ')':<28}"
+          f"{summary['full_tokens_mean']:>12}{summary['retrieval_tokens_mean']:>12}")
+    print(f"{'prompt build (us, mean)':<28}"
+          f"{summary['full_build_us_mean']:>12}{summary['retrieval_build_us_mean']:>12}")
+    if args.live:
+        for metric, label in (("ttft", "first token"), ("latency", "total latency")):
+            for pct in ("p50", "p95"):
+                key = f"{metric}_ms_{pct}"
+                print(f"{label + ' ' + pct + ' (ms)':<28}{summary['full_' + key]:>12}{summary['retrieval_' + key]:>12}")
+    print(f"\ninput token reduction: {summary['token_reduction']:.1%}")
+    if not args.live:
+        print("upstream latency not measured; run with --live for time to first token and total latency")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Cold- and warm-start benchmark for the Vercel serverless handlers
+
+Each cold run is a fresh interpreter that loads one handler module and
+times its phases: importing the module, the first GET, the first POST
+(which pays for importing and configuring the Gemini SDK and building the
+model), then `--warm` further POSTs on the same, now warm, instance.
+The generated GenerativeServiceClient's generate_content is replaced by a
+stub that answers after `--latency` seconds, so everything above the wire
+(SDK configuration, client and transport construction) is still measured.
+
+Usage (from Backend/):
+    python scripts/bench_serverless.py [--runs 5] [--warm 50] [--latency 0]
+"""
+import argparse
+import importlib.util
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import types
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_DIR = os.path.dirname(BACKEND_DIR)
+
+HANDLERS = {
+    "api/chat.py": os.path.join(REPO_DIR, "api", "chat.py"),
+    "Backend/api/chat.py": os.path.join(BACKEND_DIR, "api", "chat.py"),
+    "Backend/api/index.py": os.path.join(BACKEND_DIR, "api", "index.py"),
+}
+
+BODY = json.dumps({"messages": [{"sender": "user", "text": "who is Usman?"}]})
+
+
+def stub_generate_content(latency):
+    """Swap the SDK's network call for a fixed-latency reply"""
+    import google.ai.generativelanguage as glm
+    import google.generativeai  # noqa: F401
+
+    def generate_content(self, request=None, **kwargs):
+        time.sleep(latency)
+        return glm.GenerateContentResponse(candidates=[
+            {"content": {"role": "model", "parts": [{"text": "Yo bro, Usman ships fast."}]}, "finish_reason": 1},
+        ])
+
+    glm.GenerativeServiceClient.generate_content = generate_content
+
+
+def event_request(module, method):
+    event = {"httpMethod": method, "headers": {"content-type": "application/json"}, "path": "/api/chat"}
+    if method == "POST":
+        event["body"] = BODY
+    response = module.handler(event)
+    return response["statusCode"], response["body"]
+
+
+def http_request(module, method):
+    """Drive the BaseHTTPRequestHandler without a socket"""
+    request = module.handler.__new__(module.handler)
+    body = BODY.encode() if method == "POST" else b""
+    request.rfile = io.BytesIO(body)
+    request.wfile = io.BytesIO()
+    request.headers = {"Content-Length": str(len(body))}
+    request.command, request.path = method, "/api/chat"
+    request.request_version = "HTTP/1.1"
+    request.requestline = f"{method} /api/chat HTTP/1.1"
+    request.client_address = ("127.0.0.1", 0)
+    request.log_message = lambda *args: None
+    getattr(request, f"do_{method}")()
+    raw = request.wfile.getvalue().decode()
+    return int(raw.split(" ", 2)[1]), raw.split("\r\n\r\n", 1)[1]
+
+
+def child(name, warm, latency):
+    """One cold instance: print the phase timings as JSON"""
+    os.environ.setdefault("GEMINI_API_KEY", "bench")
+    os.environ.setdefault("LOG_LEVEL", "error")
+    timings = {}
+
+    started = time.perf_counter()
+    spec = importlib.util.spec_from_file_location(f"bench_handler_{os.getpid()}", HANDLERS[name])
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    timings["import_ms"] = (time.perf_counter() - started) * 1000
+    request = event_request if isinstance(module.handler, types.FunctionType) else http_request
+
+    started = time.perf_counter()
+    request(module, "GET")
+    timings["first_get_ms"] = (time.perf_counter() - started) * 1000
+
+    # Installing the stub imports the SDK. A handler that imports it lazily would have paid for
+    # that on its first POST, so the import is charged to that POST
+    sdk_preloaded = "google.generativeai" in sys.modules
+    started = time.perf_counter()
+    stub_generate_content(latency)
+    sdk_ms = 0.0 if sdk_preloaded else (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    status, body = request(module, "POST")
+    timings["first_post_ms"] = (time.perf_counter() - started) * 1000 + sdk_ms
+    if status != 200 or "Usman ships fast" not in body:
+        raise SystemExit(f"{name}: unexpected first reply {status} {body[:200]}")
+
+    warm_ms = []
+    for _ in range(warm):
+        started = time.perf_counter()
+        request(module, "POST")
+        warm_ms.append((time.perf_counter() - started) * 1000)
+    timings["warm_post_p50_ms"] = statistics.median(warm_ms) if warm_ms else 0.0
+    timings["cold_total_ms"] = timings["import_ms"] + timings["first_get_ms"] + timings["first_post_ms"]
+    print(json.dumps(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="cold starts per handler")
+    parser.add_argument("--warm", type=int, default=50, help="warm POSTs per cold start")
+    parser.add_argument("--latency", type=float, default=0.0, help="stubbed Gemini latency in seconds")
+    parser.add_argument("--only", choices=sorted(HANDLERS))
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.warm, args.latency)
+        return
+
+    columns = ["import_ms", "first_get_ms", "first_post_ms", "cold_total_ms", "warm_post_p50_ms"]
+    print(f"median of {args.runs} cold starts, {args.warm} warm POSTs each, stubbed latency {args.latency * 1000:.0f}ms\n")
+    print(f"{'handler':<22}" + "".join(f"{c.replace('_ms', ''):>18}" for c in columns))
+    for name in HANDLERS:
+        if args.only and name != args.only:
+            continue
+        runs = []
+        for _ in range(args.runs):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", name, "--warm", str(args.warm),
+                 "--latency", str(args.latency)],
+                cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+            ).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        print(f"{name:<22}" + "".join(f"{statistics.median(r[c] for r in runs):>18.1f}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,505 @@
+"""Offline benchmark of every serving path against a local mock Gemini
+
+For each target a fresh scripts/mock_gemini.py is started. Its latency,
+token rate and fault injection are set with the same flags as the mock.
+The server under test points at the mock through UPSTREAM_ENDPOINT, so
+the real SDK, gRPC pool, retries and routing run with no network access.
+Targets:
+  - gunicorn            app.py under gunicorn sync workers (the Render command)
+  - asgi                asgi.py under uvicorn
+  - vercel:<handler>    each Vercel handler as one warm instance behind a local HTTP server
+Responses are served without caches, coalescing or admission control, so
+every request goes upstream. `--concurrency` clients post a mix of
+conversation lengths (`--mix short:0.6,medium:0.3,long:0.1` is 1, 6 and 20
+turns) for `--duration` seconds after `--warmup`, and `--stream-share` of
+them ask for SSE. `--replay PATH` posts logged conversations instead (a
+transcript directory or file, see TRANSCRIPT_BACKEND), bucketed by length
+by their number of user turns. Reported per target:
+  - throughput, latency and time to first byte (p50/p95/p99)
+  - latency p50/p95 per conversation length
+  - CPU time per request and peak RSS of the server's process tree (from /proc)
+  - upstream calls per request, which shows retry amplification under
+    --error-rate/--rate-limit-rate
+Results are written as JSON (--out). With --baseline they are compared
+metric by metric against a stored run, and the exit status is 1 if any
+metric is worse by more than --tolerance. Only compare runs made with the
+same settings on the same machine.
+
+Usage (from Backend/):
+    python scripts/benchmark.py [--targets gunicorn,asgi] [--duration 20] [--concurrency 16]
+    python scripts/benchmark.py --baseline benchmarks/baseline.json [--save-baseline]
+    python scripts/benchmark.py --error-rate 0.05 --rate-limit-rate 0.02 --ttft-sigma 0.8
+    python scripts/benchmark.py --replay /tmp/gptbro_transcripts
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts import mock_gemini  # noqa: E402
+from scripts.bench_serverless import BACKEND_DIR, HANDLERS  # noqa: E402
+from scripts.loadtest_async import SERVER_ENV, free_port  # noqa: E402
+from services.model_router import percentile  # noqa: E402
+from services.transcripts import conversations, read_transcripts  # noqa: E402
+
+BENCHMARKS_DIR = os.path.join(BACKEND_DIR, "benchmarks")
+
+# Conversation lengths in user turns; every turn but the last also has the bot's reply
+TURNS = {"short": 1, "medium": 6, "long": 20}
+
+# (metric, which way is better); error_rate is compared in absolute terms
+COMPARED_METRICS = [
+    ("throughput_rps", "higher"),
+    ("latency_ms.p50", "lower"),
+    ("latency_ms.p95", "lower"),
+    ("latency_ms.p99", "lower"),
+    ("ttfb_ms.p50", "lower"),
+    ("ttfb_ms.p99", "lower"),
+    ("cpu_ms_per_request", "lower"),
+    ("rss_mb_peak", "lower"),
+    ("upstream_calls_per_request", "lower"),
+    ("error_rate", "lower"),
+]
+
+
+def server_command(target, port, args):
+    if target == "gunicorn":
+        return [sys.executable, "-m", "gunicorn", "app:app", "-b", f"127.0.0.1:{port}", "-w", str(args.workers),
+                "--log-level", "warning", "--timeout", "120"]
+    if target == "asgi":
+        return [sys.executable, "-m", "uvicorn", "asgi:app", "--port", str(port), "--log-level", "warning",
+                "--no-access-log"]
+    return [sys.executable, os.path.abspath(__file__), "--serve-handler", target.split(":", 1)[1], "--port", str(port)]
+
+
+TARGETS = ["gunicorn", "asgi", *(f"vercel:{name}" for name in HANDLERS)]
+
+
+def serve_handler(name, port):
+    """Serve one Vercel handler module over HTTP, like a single warm instance"""
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location("benchmarked_handler", HANDLERS[name])
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    if isinstance(module.handler, types.FunctionType):
+        class EventHandler(BaseHTTPRequestHandler):
+            """Turns each HTTP request into the event dict the function handlers take"""
+            protocol_version = "HTTP/1.1"
+
+            def call(self, method):
+                length = int(self.headers.get("Content-Length") or 0)
+                event = {"httpMethod": method, "path": self.path, "headers": dict(self.headers),
+                         "body": self.rfile.read(length).decode() if length else ""}
+                response = module.handler(event)
+                body = (response.get("body") or "").encode()
+                self.send_response(response.get("statusCode", 200))
+                for key, value in (response.get("headers") or {}).items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self.call("GET")
+
+            def do_POST(self):
+                self.call("POST")
+
+            def do_OPTIONS(self):
+                self.call("OPTIONS")
+
+            def log_message(self, *args):
+                pass
+
+        request_handler = EventHandler
+    else:
+        request_handler = type("QuietHandler", (module.handler,), {"log_message": lambda self, *args: None})
+    # The default listen backlog of 5 resets connections when all the clients connect at once
+    server_class = type("BenchmarkServer", (ThreadingHTTPServer,), {"request_queue_size": 128})
+    server_class(("127.0.0.1", port), request_handler).serve_forever()
+
+
+def start_mock(args, stats_file):
+    command = [sys.executable, os.path.join(BACKEND_DIR, "scripts", "mock_gemini.py"), "--port", "0",
+               "--stats-file", stats_file]
+    for flag in ("ttft_ms", "ttft_sigma", "tokens_per_s", "reply_tokens", "chunk_tokens", "error_rate",
+                 "rate_limit_rate", "retry_after", "seed"):
+        value = getattr(args, flag)
+        if value is not None:
+            command += ["--" + flag.replace("_", "-"), str(value)]
+    mock = subprocess.Popen(command, cwd=BACKEND_DIR, stdout=subprocess.PIPE, text=True)
+    line = mock.stdout.readline()
+    if "listening on" not in line:
+        mock.kill()
+        raise RuntimeError("mock Gemini did not start")
+    return mock, int(line.rsplit(":", 1)[1])
+
+
+def start_server(target, port, mock_port, args, model_cache):
+    env = {
+        **os.environ, **SERVER_ENV,
+        "GEMINI_API_KEY": "benchmark",
+        "UPSTREAM_ENDPOINT": f"127.0.0.1:{mock_port}",
+        # UPSTREAM_ENDPOINT, and so the mock, is only used by the pool
+        "UPSTREAM_POOL_SIZE": os.getenv("UPSTREAM_POOL_SIZE", "2"),
+        "MODEL_CACHE_PATH": model_cache,
+        "LOG_LEVEL": "error",
+        # google.generativeai warns about its deprecation on import
+        "PYTHONWARNINGS": "ignore::FutureWarning",
+    }
+    server = subprocess.Popen(server_command(target, port, args), cwd=BACKEND_DIR, env=env)
+    # The handlers have no /health; any HTTP answer means the server is up
+    path = "/health" if target in ("gunicorn", "asgi") else "/api/chat"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", path)
+            conn.getresponse().read()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"{target} did not start")
+
+
+def process_tree(pid):
+    """`pid` and all its descendants, from /proc"""
+    children = defaultdict(list)
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children[ppid].append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, []))
+    return tree
+
+
+def cpu_seconds(pids):
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            total += int(fields[11]) + int(fields[12])
+        except (OSError, IndexError, ValueError):
+            continue
+    return total / os.sysconf("SC_CLK_TCK")
+
+
+def rss_bytes(pids):
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+
+class ResourceSampler(threading.Thread):
+    """Tracks the peak RSS of a process tree while a run is measured"""
+
+    def __init__(self, pid, interval=0.25):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.is_set():
+            self.peak = max(self.peak, rss_bytes(process_tree(self.pid)))
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def parse_mix(spec):
+    mix = []
+    for part in spec.split(","):
+        name, _, weight = part.partition(":")
+        if name not in TURNS:
+            raise SystemExit(f"--mix: unknown length {name!r} (one of {', '.join(TURNS)})")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def conversation(rng, turns, tag):
+    """A conversation of `turns` user messages, unique per request so nothing is answered from a cache"""
+    topics = ["his projects", "React", "Flask", "his experience", "Gemini", "hiring him", "his stack", "his CV"]
+    messages = []
+    for turn in range(turns):
+        words = " ".join(rng.choice(topics) for _ in range(rng.randint(3, 12)))
+        messages.append({"sender": "user", "text": f"[{tag}-{turn}] tell me about Usman and {words}?"})
+        if turn < turns - 1:
+            messages.append({"sender": "bot", "text": "Yo bro, Usman ships fast. " * rng.randint(2, 8)})
+    return messages
+
+
+def length_of(messages):
+    """The TURNS bucket of a replayed conversation"""
+    turns = sum(1 for message in messages if message.get("sender") == "user")
+    for name, limit in TURNS.items():
+        if turns <= limit:
+            return name
+    return name
+
+
+def client(port, stop_at, args, mix, worker, samples):
+    rng = random.Random(f"{args.seed}-{worker}")
+    names, weights = zip(*mix)
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+    n = 0
+    while time.monotonic() < stop_at:
+        n += 1
+        if args.replayed:
+            messages = rng.choice(args.replayed)["messages"]
+            length = length_of(messages)
+        else:
+            length = rng.choices(names, weights)[0]
+            messages = conversation(rng, TURNS[length], f"{worker}-{n}")
+        stream = rng.random() < args.stream_share
+        body = {"messages": messages, "stream": stream}
+        started = time.monotonic()
+        try:
+            conn.request("POST", "/api/chat", body=json.dumps(body), headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            first = response.read(1)
+            ttfb = time.monotonic() - started
+            rest = response.read()
+            status = response.status
+            # A stream that fails after its headers still says 200; its error event is the real outcome
+            if status == 200 and stream and b"event: error" in first + rest:
+                status = "stream_error"
+        except OSError:
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+            status, ttfb = "connection_error", None
+        samples.append((length, status, time.monotonic() - started, ttfb))
+    conn.close()
+
+
+def run_load(port, seconds, args, mix):
+    samples = []
+    stop_at = time.monotonic() + seconds
+    threads = [threading.Thread(target=client, args=(port, stop_at, args, mix, i, samples))
+               for i in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return samples
+
+
+def ms(values, pct):
+    value = percentile(values, pct)
+    return round(value * 1000, 1) if value is not None else None
+
+
+def summarize(samples, elapsed, cpu, peak_rss, upstream_calls, total_requests):
+    ok = [s for s in samples if s[1] == 200]
+    latencies = [s[2] for s in ok]
+    ttfbs = [s[3] for s in ok]
+    by_length = {}
+    for length in TURNS:
+        values = [s[2] for s in ok if s[0] == length]
+        if values:
+            by_length[length] = {"requests": len(values), "p50": ms(values, 50), "p95": ms(values, 95)}
+    return {
+        "requests": len(samples),
+        "status_counts": {str(status): count for status, count in Counter(s[1] for s in samples).items()},
+        "error_rate": round(1 - len(ok) / len(samples), 4) if samples else None,
+        "throughput_rps": round(len(ok) / elapsed, 2),
+        "latency_ms": {"p50": ms(latencies, 50), "p95": ms(latencies, 95), "p99": ms(latencies, 99)},
+        "ttfb_ms": {"p50": ms(ttfbs, 50), "p95": ms(ttfbs, 95), "p99": ms(ttfbs, 99)},
+        "by_length": by_length,
+        "cpu_ms_per_request": round(cpu * 1000 / len(samples), 2) if samples else None,
+        "rss_mb_peak": round(peak_rss / 2 ** 20, 1),
+        "upstream_calls_per_request": round(upstream_calls / total_requests, 3) if total_requests else None,
+    }
+
+
+def benchmark(target, args, mix):
+    workdir = tempfile.mkdtemp(prefix="gptbro_benchmark_")
+    stats_file = os.path.join(workdir, "mock_stats.json")
+    mock, mock_port = start_mock(args, stats_file)
+    server = None
+    try:
+        port = free_port()
+        server = start_server(target, port, mock_port, args, os.path.join(workdir, "models.json"))
+        warmup = run_load(port, args.warmup, args, mix) if args.warmup else []
+
+        pids = process_tree(server.pid)
+        cpu_before = cpu_seconds(pids)
+        sampler = ResourceSampler(server.pid)
+        sampler.start()
+        started = time.monotonic()
+        samples = run_load(port, args.duration, args, mix)
+        elapsed = time.monotonic() - started
+        sampler.stop()
+        cpu = cpu_seconds(pids) - cpu_before
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        mock.terminate()
+        mock.wait()
+    with open(stats_file) as f:
+        calls = json.load(f)
+    upstream_calls = calls["generate"] + calls["stream"]
+    return summarize(samples, elapsed, cpu, sampler.peak, upstream_calls, len(warmup) + len(samples))
+
+
+def lookup(result, path):
+    for key in path.split("."):
+        if not isinstance(result, dict):
+            return None
+        result = result.get(key)
+    return result
+
+
+def compare(current, baseline, tolerance):
+    """Print each metric against the baseline; returns the regressions as (target, metric) pairs"""
+    if current["meta"]["config"] != baseline["meta"].get("config"):
+        print("warning: the baseline was recorded with different settings; the comparison may not be meaningful\n")
+    regressions = []
+    print(f"{'target':<28} {'metric':<28} {'baseline':>10} {'current':>10} {'change':>8}")
+    for target, result in current["results"].items():
+        base = baseline["results"].get(target)
+        if base is None:
+            print(f"{target:<28} (not in baseline)")
+            continue
+        for metric, better in COMPARED_METRICS:
+            old, new = lookup(base, metric), lookup(result, metric)
+            if old is None or new is None:
+                continue
+            if metric == "error_rate":
+                worse = new - old > tolerance / 10
+                change = f"{(new - old) * 100:+.1f}pt"
+            else:
+                delta = (new - old) / old if old else 0.0
+                worse = (delta < -tolerance) if better == "higher" else (delta > tolerance)
+                change = f"{delta:+.0%}"
+            flag = "  REGRESSION" if worse else ""
+            print(f"{target:<28} {metric:<28} {old:>10} {new:>10} {change:>8}{flag}")
+            if worse:
+                regressions.append((target, metric))
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--targets", default=",".join(TARGETS), help="comma-separated, from: " + ", ".join(TARGETS))
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds per target")
+    parser.add_argument("--warmup", type=float, default=3, help="unmeasured seconds before each run")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn sync workers")
+    parser.add_argument("--mix", default="short:0.6,medium:0.3,long:0.1", help="conversation lengths and weights")
+    parser.add_argument("--stream-share", type=float, default=0.3, help="share of requests asking for SSE")
+    parser.add_argument("--replay", help="post logged conversations from this transcript directory or file")
+    parser.add_argument("--out", help="results file (default benchmarks/results/<time>.json)")
+    parser.add_argument("--baseline", help="compare against this results file")
+    parser.add_argument("--save-baseline", action="store_true", help="also write the results to --baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="relative change that counts as a regression")
+    mock_gemini.add_arguments(parser)
+    parser.add_argument("--serve-handler", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_handler:
+        serve_handler(args.serve_handler, args.port)
+        return
+    if args.seed is None:
+        args.seed = 1
+    targets = [t.strip() for t in args.targets.split(",") if t.strip()]
+    unknown = [t for t in targets if t not in TARGETS]
+    if unknown:
+        raise SystemExit(f"--targets: unknown {', '.join(unknown)} (one of {', '.join(TARGETS)})")
+    mix = parse_mix(args.mix)
+    args.replayed = list(conversations(read_transcripts(args.replay))) if args.replay else None
+    if args.replay and not args.replayed:
+        raise SystemExit(f"--replay: no conversations in {args.replay}")
+
+    config = {key: value for key, value in vars(args).items()
+              if key not in ("targets", "out", "baseline", "save_baseline", "tolerance", "serve_handler", "port",
+                             "replayed")}
+    source = f"{len(args.replayed)} replayed conversations" if args.replayed else f"mix {args.mix}"
+    print(f"{args.concurrency} clients, {args.duration:g}s per target, {source}, {args.stream_share:.0%} SSE; "
+          f"mock ttft {args.ttft_ms:g}ms (sigma {args.ttft_sigma:g}), {args.tokens_per_s:g} tok/s, "
+          f"{args.error_rate:.0%} errors, {args.rate_limit_rate:.0%} 429s\n")
+    print(f"{'target':<28} {'req/s':>7} {'p50':>7} {'p95':>7} {'p99':>7} {'ttfb50':>7} {'err':>6} "
+          f"{'cpu ms/req':>10} {'rss MB':>7} {'calls/req':>9}")
+    results = {}
+    for target in targets:
+        r = results[target] = benchmark(target, args, mix)
+        print(f"{target:<28} {r['throughput_rps']:>7} {r['latency_ms']['p50']:>7} {r['latency_ms']['p95']:>7} "
+              f"{r['latency_ms']['p99']:>7} {r['ttfb_ms']['p50']:>7} {r['error_rate']:>6.1%} "
+              f"{r['cpu_ms_per_request']:>10} {r['rss_mb_peak']:>7} {r['upstream_calls_per_request']:>9}")
+
+    report = {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "machine": f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs",
+            "config": config,
+        },
+        "results": results,
+    }
+    out = args.out or os.path.join(BENCHMARKS_DIR, "results", datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nresults written to {os.path.relpath(out, BACKEND_DIR)}")
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print()
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
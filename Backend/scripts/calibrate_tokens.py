@@ -0,0 +1,121 @@
+"""Calibrate the local token estimator against Gemini's count_tokens
+
+Collects a mix of texts (sample questions, CV chunks, the system prompt and
+a few synthetic pastes with code, emoji and Urdu), counts each with
+count_tokens and fits the estimator's three coefficients by least squares.
+Prints the error of the shipped (uncalibrated) defaults and of the fit, the
+estimator's cost per call and the TOKEN_ESTIMATOR_COEFFS line to put in
+.env. Needs GEMINI_API_KEY and makes one count_tokens call per text; only
+counts from the real API give meaningful coefficients.
+
+Usage (from Backend/):
+    python scripts/calibrate_tokens.py [--model gemini-2.5-flash] [--counts counts.jsonl]
+
+--counts caches the upstream counts so refits don't call the API again.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.prompt import build_system_instruction  # noqa: E402
+from services.retrieval import CVRetriever  # noqa: E402
+from services.tokens import DEFAULT_COEFFS, TokenEstimator  # noqa: E402
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_QUESTIONS = os.path.join(BACKEND_DIR, "scripts", "data", "sample_questions.jsonl")
+CV_DIR = os.path.join(BACKEND_DIR, "..", "cv")
+
+SYNTHETIC = [
+    "def handler(event):\n    body = json.loads(event['body'])\n    return {'statusCode': 200, 'body': body}\n" * 5,
+    "Yo bro 🔥💀😂 what's good?? 🚀🚀🚀 " * 10,
+    "آپ کیسے ہیں؟ عثمان غنی کے بارے میں بتائیں۔ " * 10,
+    "ERROR 2024-05-01T12:00:00Z worker=3 status=503 latency_ms=1834 path=/api/chat\n" * 10,
+    "lorem ipsum dolor sit amet consectetur adipiscing elit " * 40,
+]
+
+
+def collect_texts():
+    texts = [build_system_instruction(None)]
+    with open(SAMPLE_QUESTIONS) as f:
+        texts += [json.loads(line)["question"] for line in f if line.strip()]
+    retriever = CVRetriever.from_directory(CV_DIR)
+    texts += [chunk["title"] + "\n" + chunk["text"] for chunk in retriever.index.chunks]
+    return texts + SYNTHETIC
+
+
+def features(text):
+    chars = len(text)
+    words = text.count(" ") + text.count("\n") + 1
+    non_ascii = len(text.encode("utf-8", "ignore")) - chars
+    return [chars, words, non_ascii]
+
+
+def load_counts(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return {row["text"]: row["tokens"] for row in map(json.loads, f) if row}
+
+
+def error_rate(estimator, texts, actual):
+    errors = [abs(estimator.estimate_text(t) - a) / a for t, a in zip(texts, actual)]
+    return statistics.mean(errors), max(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="gemini-2.5-flash")
+    parser.add_argument("--counts", help="jsonl cache of upstream counts (read, then extended)")
+    args = parser.parse_args()
+
+    texts = collect_texts()
+    counts = load_counts(args.counts)
+    missing = [t for t in texts if t not in counts]
+    if missing:
+        import google.generativeai as genai
+        from dotenv import load_dotenv
+
+        load_dotenv(os.path.join(BACKEND_DIR, ".env"))
+        genai.configure(api_key=os.environ["GEMINI_API_KEY"])
+        model = genai.GenerativeModel(args.model)
+        for text in missing:
+            counts[text] = model.count_tokens(text).total_tokens
+        if args.counts:
+            with open(args.counts, "w") as f:
+                for text, tokens in counts.items():
+                    f.write(json.dumps({"text": text, "tokens": tokens}) + "\n")
+
+    actual = [counts[t] for t in texts]
+    x = np.array([features(t) for t in texts], dtype=np.float64)
+    y = np.array(actual, dtype=np.float64)
+    # Weight by 1/y so short questions matter as much as long CV chunks (relative error)
+    weights = 1 / y
+    coeffs, *_ = np.linalg.lstsq(x * weights[:, None], y * weights, rcond=None)
+    coeffs = tuple(round(float(c), 4) for c in np.clip(coeffs, 0, None))
+
+    default = TokenEstimator(DEFAULT_COEFFS)
+    fitted = TokenEstimator(coeffs)
+    sample = texts[0]
+    started = time.perf_counter()
+    for _ in range(10000):
+        fitted.estimate_text(sample)
+    per_call_us = (time.perf_counter() - started) / 10000 * 1e6
+
+    print(f"{len(texts)} texts, {sum(actual)} upstream tokens ({args.model})\n")
+    for name, estimator in (("default", default), ("fitted", fitted)):
+        mean_error, max_error = error_rate(estimator, texts, actual)
+        print(f"{name:<8} coeffs={estimator.per_char, estimator.per_word, estimator.per_non_ascii}  "
+              f"mean error {mean_error:.1%}  max error {max_error:.1%}")
+    print(f"\nestimate_text on the {len(sample)}-char system prompt: {per_call_us:.1f}us")
+    print(f"\nTOKEN_ESTIMATOR_COEFFS={','.join(str(c) for c in coeffs)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Offline evaluation of the semantic FAQ cache
+
+Replays logged first-turn questions through a fresh SemanticCache: a miss
+stores the question (as if Gemini had answered it), a hit is checked against
+the intent label of the question it matched. Reports hit rate and
+false-positive rate for each threshold.
+
+Usage (from Backend/):
+    python scripts/eval_semantic_cache.py [questions.jsonl] [--thresholds 0.6,0.7,0.8,0.9]
+
+Each input line is {"question": "...", "intent": "..."}.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.semantic_cache import SemanticCache  # noqa: E402
+
+DEFAULT_SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "sample_questions.jsonl")
+
+
+def load_questions(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def evaluate(questions, threshold):
+    cache = SemanticCache(threshold=threshold, max_entries=max(len(questions), 1))
+    hits = false_hits = 0
+    lookup_time = 0.0
+    for item in questions:
+        started = time.perf_counter()
+        entry, _ = cache.lookup(item["question"])
+        lookup_time += time.perf_counter() - started
+        if entry is None:
+            # Store the intent as the "reply" so a hit can be checked against it
+            cache.add(item["question"], item["intent"])
+            continue
+        hits += 1
+        if entry["reply"] != item["intent"]:
+            false_hits += 1
+    total = len(questions)
+    return {
+        "threshold": threshold,
+        "questions": total,
+        "hits": hits,
+        "hit_rate": hits / total if total else 0.0,
+        "false_positives": false_hits,
+        "false_positive_rate": false_hits / hits if hits else 0.0,
+        "avg_lookup_us": lookup_time / total * 1e6 if total else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", nargs="?", default=DEFAULT_SAMPLE)
+    parser.add_argument("--thresholds", default="0.5,0.6,0.7,0.8,0.9")
+    parser.add_argument("--seed", type=int, default=7, help="shuffle seed (visitors don't arrive grouped by intent)")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions)
+    random.Random(args.seed).shuffle(questions)
+    results = [evaluate(questions, float(t)) for t in args.thresholds.split(",")]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{len(questions)} questions from {args.questions}\n")
+    print(f"{'threshold':>9}  {'hits':>5}  {'hit rate':>8}  {'false +':>7}  {'FP rate':>7}  {'lookup':>9}")
+    for r in results:
+        print(
+            f"{r['threshold']:>9.2f}  {r['hits']:>5}  {r['hit_rate']:>8.1%}  "
+            f"{r['false_positives']:>7}  {r['false_positive_rate']:>7.1%}  {r['avg_lookup_us']:>7.1f}us"
+        )
+
+
+if __name__ == "__main__":
+    main()
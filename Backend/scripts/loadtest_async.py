@@ -0,0 +1,231 @@
+"""Load test: sync Flask deployment vs the ASGI app, against a mocked Gemini
+
+Starts each server on a local port with google.generativeai replaced by a
+stub that answers after a fixed latency (time.sleep in the sync app,
+asyncio.sleep in the async one), then keeps `--concurrency` clients
+posting unique chats for `--duration` seconds. Caches, coalescing and
+admission control are switched off so every request waits on the mocked
+upstream. Reports throughput and p50/p99 latency per deployment.
+
+Usage (from Backend/):
+    python scripts/loadtest_async.py [--concurrency 50] [--duration 15] [--latency 0.8] [--sync-workers 2]
+    python scripts/loadtest_async.py --only asgi --latency 0.2 --slow-rate 0.05 --slow-latency 3 [--hedge]
+
+--stream posts SSE requests instead of one-shot JSON. --slow-rate gives the
+mock a heavy tail (that share of calls takes --slow-latency instead) and
+--hedge turns on HEDGE_ENABLED, to see what hedging does to p99. The servers
+can also be started by hand with the same stub:
+    gunicorn 'scripts.loadtest_async:flask_app()'
+    uvicorn scripts.loadtest_async:asgi_app --factory
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Every layer that would answer without calling upstream is off, so the numbers measure serving only
+SERVER_ENV = {
+    "GEMINI_API_KEY": "loadtest",
+    "FLASK_ENV": "production",
+    "RESPONSE_CACHE_BACKEND": "off",
+    "SEMANTIC_CACHE_ENABLED": "false",
+    "COALESCE_BACKEND": "off",
+    "ADMISSION_CONTROL": "off",
+    "HISTORY_COMPACTION": "off",
+    "SESSION_BACKEND": "off",
+    "ASGI_MAX_CONCURRENCY": "10000",
+    "ASGI_QUEUE_SIZE": "10000",
+}
+
+
+class MockResponse:
+    usage_metadata = types.SimpleNamespace(prompt_token_count=500, candidates_token_count=40, total_token_count=540)
+    candidates = []
+
+    def __init__(self, text):
+        self.text = text
+
+    def __iter__(self):
+        for word in self.text.split(" "):
+            yield types.SimpleNamespace(text=word + " ")
+
+    async def __aiter__(self):
+        for word in self.text.split(" "):
+            yield types.SimpleNamespace(text=word + " ")
+
+
+def install_mock_gemini():
+    """Replace the SDK's network calls with fixed-latency stubs (MOCK_GEMINI_LATENCY seconds)"""
+    import google.generativeai as genai
+
+    latency = float(os.getenv("MOCK_GEMINI_LATENCY", 0.8))
+    slow_rate = float(os.getenv("MOCK_GEMINI_SLOW_RATE", 0))
+    slow_latency = float(os.getenv("MOCK_GEMINI_SLOW_LATENCY", 5))
+
+    def call_latency():
+        return slow_latency if random.random() < slow_rate else latency
+
+    reply = "Yo bro, Usman is a full-stack developer who ships fast. " * 3
+
+    class MockModel:
+        def __init__(self, model_name, **kwargs):
+            self.model_name = model_name
+
+        def generate_content(self, contents, stream=False, **kwargs):
+            time.sleep(call_latency())
+            return MockResponse(reply)
+
+        async def generate_content_async(self, contents, stream=False, **kwargs):
+            await asyncio.sleep(call_latency())
+            return MockResponse(reply)
+
+    genai.configure = lambda **kwargs: None
+    genai.GenerativeModel = MockModel
+    genai.get_model = lambda name, **kwargs: types.SimpleNamespace(supported_generation_methods=["generateContent"])
+
+
+def flask_app():
+    """gunicorn factory: the Flask app on the mocked upstream"""
+    install_mock_gemini()
+    import app
+
+    return app.app
+
+
+def asgi_app():
+    """uvicorn factory: the ASGI app on the mocked upstream"""
+    install_mock_gemini()
+    import asgi
+
+    return asgi.app
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(kind, port, sync_workers, args, model_cache):
+    env = {
+        **os.environ, **SERVER_ENV,
+        "MOCK_GEMINI_LATENCY": str(args.latency),
+        "MOCK_GEMINI_SLOW_RATE": str(args.slow_rate),
+        "MOCK_GEMINI_SLOW_LATENCY": str(args.slow_latency),
+        "HEDGE_ENABLED": "true" if args.hedge else "false",
+        "MODEL_CACHE_PATH": model_cache,
+    }
+    if kind == "sync":
+        # The command Render runs today: gunicorn's default sync workers
+        command = ["gunicorn", "scripts.loadtest_async:flask_app()", "-b", f"127.0.0.1:{port}",
+                   "-w", str(sync_workers), "--log-level", "warning"]
+    else:
+        command = ["uvicorn", "scripts.loadtest_async:asgi_app", "--factory", "--port", str(port),
+                   "--log-level", "warning", "--no-access-log"]
+    server = subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"{kind} server did not start")
+
+
+def client(port, stop_at, stream, worker, latencies, errors):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    n = 0
+    while time.monotonic() < stop_at:
+        n += 1
+        body = {"messages": [{"sender": "user", "text": f"load test {worker}-{n}: who is Usman?"}], "stream": stream}
+        started = time.monotonic()
+        try:
+            conn.request("POST", "/api/chat", body=json.dumps(body), headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            response.read()
+            ok = response.status == 200
+        except OSError:
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            ok = False
+        if ok:
+            latencies.append(time.monotonic() - started)
+        else:
+            errors.append(1)
+    conn.close()
+
+
+def run_load(port, concurrency, duration, stream):
+    latencies, errors = [], []
+    stop_at = time.monotonic() + duration
+    threads = [
+        threading.Thread(target=client, args=(port, stop_at, stream, i, latencies, errors))
+        for i in range(concurrency)
+    ]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, len(errors), time.monotonic() - started
+
+
+def main():
+    from services.model_router import percentile
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--latency", type=float, default=0.8, help="mocked Gemini latency in seconds")
+    parser.add_argument("--sync-workers", type=int, default=2)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="share of mocked calls that are slow")
+    parser.add_argument("--slow-latency", type=float, default=5.0)
+    parser.add_argument("--hedge", action="store_true", help="run the servers with HEDGE_ENABLED=true")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--only", choices=["sync", "asgi"])
+    args = parser.parse_args()
+
+    print(f"{args.concurrency} clients for {args.duration:g}s, mocked upstream latency {args.latency * 1000:.0f}ms "
+          f"({args.slow_rate:.0%} at {args.slow_latency * 1000:.0f}ms), {'SSE' if args.stream else 'JSON'} requests"
+          f"{', hedging on' if args.hedge else ''}\n")
+    print(f"{'deployment':<28} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for kind in ("sync", "asgi"):
+        if args.only and kind != args.only:
+            continue
+        port = free_port()
+        model_cache = os.path.join(tempfile.gettempdir(), f"gptbro_loadtest_models_{port}.json")
+        server = start_server(kind, port, args.sync_workers, args, model_cache)
+        try:
+            latencies, errors, elapsed = run_load(port, args.concurrency, args.duration, args.stream)
+        finally:
+            server.terminate()
+            server.wait()
+            for path in (model_cache, model_cache + ".lock"):
+                if os.path.exists(path):
+                    os.remove(path)
+        label = f"gunicorn sync x{args.sync_workers}" if kind == "sync" else "uvicorn asgi x1"
+        p50 = percentile(latencies, 50)
+        p99 = percentile(latencies, 99)
+        print(f"{label:<28} {len(latencies):>8} {errors:>6} {len(latencies) / elapsed:>8.1f} "
+              f"{(p50 or 0) * 1000:>8.0f} {(p99 or 0) * 1000:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""Local stand-in for the Gemini API, for benchmarks and offline runs
+
+Serves the gRPC methods the SDK uses (GenerativeService.GenerateContent,
+StreamGenerateContent and ModelService.GetModel) on a loopback port.
+Point the backend at it with UPSTREAM_ENDPOINT (services/upstream.py sends
+every SDK call through that endpoint):
+
+    python scripts/mock_gemini.py --port 50051 --ttft-ms 400 --tokens-per-s 80
+    UPSTREAM_ENDPOINT=127.0.0.1:50051 GEMINI_API_KEY=mock python app.py
+
+Every call waits a time to first token drawn from a lognormal distribution
+(median --ttft-ms, spread --ttft-sigma), then generates --reply-tokens
+tokens at --tokens-per-s. Streams send a chunk every --chunk-tokens tokens
+and one-shot calls answer once the whole reply is done. --error-rate fails
+that share of calls with UNAVAILABLE. --rate-limit-rate answers that share
+with RESOURCE_EXHAUSTED, carrying a RetryInfo of --retry-after seconds the
+way the real API does. On SIGTERM or SIGINT the call counters are written
+to --stats-file.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import signal
+import sys
+import threading
+import time
+from concurrent import futures
+
+import grpc
+from google.ai import generativelanguage_v1beta as glm
+from google.protobuf import duration_pb2
+from google.rpc import code_pb2, error_details_pb2, status_pb2
+from grpc_status import rpc_status
+
+GENERATIVE_SERVICE = "google.ai.generativelanguage.v1beta.GenerativeService"
+MODEL_SERVICE = "google.ai.generativelanguage.v1beta.ModelService"
+
+WORDS = ("Yo bro, Usman is a full-stack developer who ships fast, builds with React, Flask and "
+         "Gemini, and keeps his bots snappy under load.").split(" ")
+
+
+class MockGemini:
+    """The mock's latency, token-rate and fault settings, and its call counters"""
+
+    def __init__(self, ttft_ms=400.0, ttft_sigma=0.4, tokens_per_s=80.0, reply_tokens=60, chunk_tokens=8,
+                 error_rate=0.0, rate_limit_rate=0.0, retry_after=1.0, seed=None):
+        self.ttft_ms = ttft_ms
+        self.ttft_sigma = ttft_sigma
+        self.tokens_per_s = tokens_per_s
+        self.reply_tokens = reply_tokens
+        self.chunk_tokens = chunk_tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {"generate": 0, "stream": 0, "get_model": 0, "errors": 0, "rate_limited": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def _draw(self):
+        with self._lock:
+            return self._random.random(), self._random.lognormvariate(math.log(self.ttft_ms / 1000), self.ttft_sigma)
+
+    def _fault(self, context, roll):
+        """Abort the call if this roll lands in the injected error or 429 share"""
+        if roll < self.error_rate:
+            self._count("errors")
+            context.abort(grpc.StatusCode.UNAVAILABLE, "mock: injected error")
+        if roll < self.error_rate + self.rate_limit_rate:
+            self._count("rate_limited")
+            retry_info = error_details_pb2.RetryInfo(retry_delay=duration_pb2.Duration(
+                seconds=int(self.retry_after), nanos=int(self.retry_after % 1 * 1e9)))
+            status = status_pb2.Status(code=code_pb2.RESOURCE_EXHAUSTED, message="mock: injected rate limit")
+            status.details.add().Pack(retry_info)
+            context.abort_with_status(rpc_status.to_status(status))
+
+    def _response(self, tokens, request, finished):
+        text = " ".join(WORDS[i % len(WORDS)] for i in range(tokens)) + " "
+        response = {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}]}
+        if finished:
+            response["candidates"][0]["finish_reason"] = glm.Candidate.FinishReason.STOP
+            # About four bytes of request per token, like the backend's own estimate
+            prompt_tokens = len(glm.GenerateContentRequest.serialize(request)) // 4
+            response["usage_metadata"] = {
+                "prompt_token_count": prompt_tokens,
+                "candidates_token_count": self.reply_tokens,
+                "total_token_count": prompt_tokens + self.reply_tokens,
+            }
+        return glm.GenerateContentResponse(response)
+
+    def generate_content(self, request, context):
+        self._count("generate")
+        roll, ttft = self._draw()
+        self._fault(context, roll)
+        time.sleep(ttft + self.reply_tokens / self.tokens_per_s)
+        return self._response(self.reply_tokens, request, finished=True)
+
+    def stream_generate_content(self, request, context):
+        self._count("stream")
+        roll, ttft = self._draw()
+        self._fault(context, roll)
+        time.sleep(ttft)
+        sent = 0
+        while sent < self.reply_tokens:
+            tokens = min(self.chunk_tokens, self.reply_tokens - sent)
+            if sent:
+                time.sleep(tokens / self.tokens_per_s)
+            sent += tokens
+            yield self._response(tokens, request, finished=sent >= self.reply_tokens)
+
+    def get_model(self, request, context):
+        self._count("get_model")
+        return glm.Model(name=request.name, supported_generation_methods=["generateContent", "countTokens"])
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+def serve(mock, port=0, host="127.0.0.1", workers=256):
+    """Start a gRPC server for `mock`; returns (server, port)"""
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers))
+    generate = {"request_deserializer": glm.GenerateContentRequest.deserialize,
+                "response_serializer": glm.GenerateContentResponse.serialize}
+    server.add_generic_rpc_handlers((
+        grpc.method_handlers_generic_handler(GENERATIVE_SERVICE, {
+            "GenerateContent": grpc.unary_unary_rpc_method_handler(mock.generate_content, **generate),
+            "StreamGenerateContent": grpc.unary_stream_rpc_method_handler(mock.stream_generate_content, **generate),
+        }),
+        grpc.method_handlers_generic_handler(MODEL_SERVICE, {
+            "GetModel": grpc.unary_unary_rpc_method_handler(
+                mock.get_model, request_deserializer=glm.GetModelRequest.deserialize,
+                response_serializer=glm.Model.serialize),
+        }),
+    ))
+    port = server.add_insecure_port(f"{host}:{port}")
+    server.start()
+    return server, port
+
+
+def add_arguments(parser):
+    """The mock's settings, shared with scripts/benchmark.py"""
+    parser.add_argument("--ttft-ms", type=float, default=400, help="median time to first token")
+    parser.add_argument("--ttft-sigma", type=float, default=0.4, help="lognormal spread of the time to first token")
+    parser.add_argument("--tokens-per-s", type=float, default=80, help="generation speed after the first token")
+    parser.add_argument("--reply-tokens", type=int, default=60, help="tokens per reply")
+    parser.add_argument("--chunk-tokens", type=int, default=8, help="tokens per streamed chunk")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls failed with UNAVAILABLE")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of calls answered with a 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="RetryInfo delay on injected 429s, in seconds")
+    parser.add_argument("--seed", type=int, help="random seed for latencies and faults")
+
+
+def mock_from_args(args):
+    return MockGemini(
+        ttft_ms=args.ttft_ms, ttft_sigma=args.ttft_sigma, tokens_per_s=args.tokens_per_s,
+        reply_tokens=args.reply_tokens, chunk_tokens=args.chunk_tokens, error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after, seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=50051, help="0 picks a free port")
+    parser.add_argument("--stats-file", help="write the call counters here on exit")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    mock = mock_from_args(args)
+    server, port = serve(mock, args.port)
+    # The port line is what scripts/benchmark.py waits for
+    print(f"mock Gemini listening on 127.0.0.1:{port}", flush=True)
+
+    def stop(signum, frame):
+        server.stop(grace=1)
+        if args.stats_file:
+            with open(args.stats_file, "w") as f:
+                json.dump(mock.stats(), f)
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    server.wait_for_termination()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
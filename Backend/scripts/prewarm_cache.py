@@ -0,0 +1,69 @@
+"""Fill the reply cache ahead of traffic, as a release step
+
+Runs the same warm-up the app runs at startup (PREWARM_*), once and in the
+foreground, then prints what it did. Only a cache that outlives this
+process is useful here: RESPONSE_CACHE_BACKEND=sqlite on the machine that
+serves. With the default in-memory cache, let each worker warm itself at
+startup instead. --dry-run lists the questions and whether a logged answer
+can be reused, without calling Gemini. The exit status is 1 if any
+question failed.
+
+Usage (from Backend/):
+    python scripts/prewarm_cache.py [--questions questions.txt] [--transcripts /tmp/gptbro_transcripts] [--top 50]
+                                    [--rate 2] [--concurrency 2] [--budget 60] [--dry-run]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The app would otherwise start its own warm-up on import
+os.environ["PREWARM_ON_STARTUP"] = "false"
+
+import app as core  # noqa: E402
+from services.prewarm import CacheWarmer  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", default=os.getenv("PREWARM_QUESTIONS"), help="curated list (.txt or .json)")
+    parser.add_argument("--transcripts", help="transcript directory or file (default: the app's)")
+    parser.add_argument("--top", type=int, default=int(os.getenv("PREWARM_TOP", 50)),
+                        help="most frequent logged opening questions to warm")
+    parser.add_argument("--rate", type=float, default=float(os.getenv("PREWARM_RATE", 2)), help="Gemini calls per second")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("PREWARM_CONCURRENCY", 2)))
+    parser.add_argument("--budget", type=float, default=float(os.getenv("PREWARM_BUDGET", 60)), help="seconds")
+    parser.add_argument("--dry-run", action="store_true", help="list the questions without warming anything")
+    args = parser.parse_args()
+
+    transcripts = args.transcripts
+    if transcripts is None and core.cache_warmer is not None:
+        transcripts = core.cache_warmer.transcripts_path
+    warmer = CacheWarmer(
+        core.warm_cache,
+        core.PROMPT_VERSION,
+        questions_path=args.questions,
+        transcripts_path=transcripts,
+        top=args.top,
+        rate=args.rate,
+        concurrency=args.concurrency,
+        budget=args.budget,
+    )
+    if args.dry_run:
+        pairs = warmer.questions()
+        for question, answer in pairs:
+            print(f"{'logged' if answer is not None else 'generate':<9} {question}")
+        print(f"\n{len(pairs)} questions, {sum(answer is not None for _, answer in pairs)} with a reusable answer "
+              f"(prompt version {core.PROMPT_VERSION})")
+        return
+
+    if core.response_cache is None or type(core.response_cache.backend).__name__ == "MemoryBackend":
+        print("warning: the response cache isn't shared (RESPONSE_CACHE_BACKEND is not sqlite), "
+              "so only this process would see the warmed answers", file=sys.stderr)
+    stats = warmer.run()
+    sys.exit(1 if stats.get("failed") else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""Startup profile of every entry point, with a time-to-first-request budget
+
+Each entry point (the Flask app and the three Vercel handlers) is started
+in a fresh interpreter against a stubbed Gemini: the generated gRPC
+clients' get_model and generate_content answer locally, so model
+discovery and the first chat run their real code without the network.
+For each one this reports:
+  - time to first request: interpreter start until the first POST /api/chat
+    has been answered (median of --runs cold starts)
+  - startup phases: load_dotenv, genai.configure, building the Flask/CORS
+    app and model discovery, where the entry point has them
+  - the import-time breakdown from `python -X importtime`, summed per
+    top-level package
+
+Exits with status 1 when an entry point's time to first request exceeds
+its budget (--budget-ms, or STARTUP_BUDGET_MS; override one entry point
+with --budget app.py=2500), so `npm run deploy` stops on a regression.
+
+Usage (from Backend/):
+    python scripts/profile_startup.py [--runs 3] [--budget-ms 3000] [--top 8] [--only app.py]
+"""
+import argparse
+import importlib.abc
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.bench_serverless import BACKEND_DIR, BODY, HANDLERS, event_request, http_request  # noqa: E402
+
+ENTRY_POINTS = ["app.py", *HANDLERS]
+
+# Callables whose time is reported as a startup phase, by the module that defines them
+PHASES = {
+    "dotenv": {"load_dotenv": "load_dotenv"},
+    "google.generativeai": {"configure": "genai.configure"},
+    "flask": {"Flask.__init__": "Flask app"},
+    "flask_cors": {"CORS.__init__": "CORS"},
+    "services.model_registry": {"ModelRegistry.probe_all": "model discovery"},
+    "services.serverless": {"WarmRuntime.genai": "import google.generativeai"},
+}
+
+
+def discover_in_foreground(module):
+    """-X importtime isn't thread-safe: discover models on the first request, probing one model at a time"""
+    pool = module.ThreadPoolExecutor
+    module.ModelRegistry.warm_in_background = lambda self: None
+    module.ThreadPoolExecutor = lambda max_workers: pool(max_workers=1)
+
+
+def stub_upstream(glm):
+    """Answer the SDK's network calls locally"""
+    def get_model(self, request=None, name=None, **kwargs):
+        return glm.Model(name=name or request.name, supported_generation_methods=["generateContent"])
+
+    def generate_content(self, request=None, **kwargs):
+        return glm.GenerateContentResponse(
+            candidates=[{"content": {"role": "model", "parts": [{"text": "Yo bro, Usman ships fast."}]}, "finish_reason": 1}],
+            usage_metadata={"prompt_token_count": 500, "candidates_token_count": 8, "total_token_count": 508},
+        )
+
+    glm.ModelServiceClient.get_model = get_model
+    glm.GenerativeServiceClient.generate_content = generate_content
+
+
+class AfterImport(importlib.abc.MetaPathFinder):
+    """Runs a callback on a module right after it is first imported, without importing it any earlier"""
+
+    def __init__(self, callbacks):
+        self.callbacks = callbacks
+
+    def find_spec(self, name, path, target=None):
+        callback = self.callbacks.pop(name, None)
+        if callback is None:
+            return None
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        exec_module = spec.loader.exec_module
+
+        def exec_and_call(module):
+            exec_module(module)
+            callback(module)
+
+        spec.loader.exec_module = exec_and_call
+        return spec
+
+
+def timed(original, label, phases):
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            phases[label] += (time.perf_counter() - started) * 1000
+
+    return wrapper
+
+
+def time_phases(module, targets, phases):
+    """Wrap the PHASES callables of a freshly imported module so their time adds up in `phases`"""
+    for path, label in targets.items():
+        owner_name, _, attr = path.rpartition(".")
+        owner = getattr(module, owner_name) if owner_name else module
+        setattr(owner, attr, timed(getattr(owner, attr), label, phases))
+
+
+def child(entry, spawned_at, importtime=False):
+    """One cold start: print phase timings and the time to the first answered POST as JSON"""
+    os.environ.setdefault("GEMINI_API_KEY", "profile")
+    os.environ.setdefault("LOG_LEVEL", "error")
+    os.environ.setdefault("FLASK_ENV", "production")
+    # A fresh model list so discovery runs as it does on a new instance
+    os.environ["MODEL_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="gptbro_startup_"), "models.json")
+
+    phases = defaultdict(float)
+    callbacks = {name: (lambda module, targets=targets: time_phases(module, targets, phases))
+                 for name, targets in PHASES.items()}
+    callbacks["google.ai.generativelanguage"] = stub_upstream
+    if importtime:
+        services_hook = callbacks["services.model_registry"]
+        callbacks["services.model_registry"] = lambda module: (services_hook(module), discover_in_foreground(module))
+    sys.meta_path.insert(0, AfterImport(callbacks))
+
+    started = time.perf_counter()
+    if entry == "app.py":
+        import app
+
+        client = app.app.test_client()
+        ready = time.perf_counter()
+        response = client.post("/api/chat", data=BODY, content_type="application/json")
+        status, body = response.status_code, response.get_data(as_text=True)
+    else:
+        import importlib.util
+
+        spec = importlib.util.spec_from_file_location("handler_under_profile", HANDLERS[entry])
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        ready = time.perf_counter()
+        request = event_request if isinstance(module.handler, types.FunctionType) else http_request
+        status, body = request(module, "POST")
+    answered = time.perf_counter()
+    if status != 200 or "Usman ships fast" not in body:
+        raise SystemExit(f"{entry}: unexpected first reply {status} {body[:200]}")
+
+    print(json.dumps({
+        "first_request_ms": (time.time() - spawned_at) * 1000,
+        "load_ms": (ready - started) * 1000,
+        "first_post_ms": (answered - ready) * 1000,
+        "phases": dict(phases),
+    }))
+
+
+def run_child(entry, importtime=False):
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += [os.path.abspath(__file__), "--child", entry, "--spawned-at", repr(time.time())]
+    if importtime:
+        command.append("--importtime")
+    result = subprocess.run(command, cwd=BACKEND_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SystemExit(f"{entry} failed to start:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def import_breakdown(stderr):
+    """Self time of every import in a -X importtime log, summed per top-level package, in ms"""
+    totals = defaultdict(float)
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = (part.strip() for part in line.split(":", 1)[1].split("|"))
+        totals[name.split(".")[0]] += int(self_us) / 1000
+    return totals
+
+
+def parse_budgets(default, overrides):
+    budgets = {entry: default for entry in ENTRY_POINTS}
+    for override in overrides:
+        entry, _, ms = override.partition("=")
+        if entry not in budgets:
+            raise SystemExit(f"--budget: unknown entry point {entry!r} (one of {', '.join(ENTRY_POINTS)})")
+        budgets[entry] = float(ms)
+    return budgets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="cold starts per entry point for the timings")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", 3000)),
+                        help="time-to-first-request budget per entry point")
+    parser.add_argument("--budget", action="append", default=[], metavar="ENTRY=MS",
+                        help="budget for one entry point, e.g. app.py=2500")
+    parser.add_argument("--top", type=int, default=8, help="packages to show in the import breakdown")
+    parser.add_argument("--only", choices=ENTRY_POINTS)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--spawned-at", type=float, help=argparse.SUPPRESS)
+    parser.add_argument("--importtime", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.spawned_at, args.importtime)
+        return
+
+    budgets = parse_budgets(args.budget_ms, args.budget)
+    over_budget = []
+    for entry in ENTRY_POINTS:
+        if args.only and entry != args.only:
+            continue
+        runs = [run_child(entry)[0] for _ in range(args.runs)]
+        _, importtime_log = run_child(entry, importtime=True)
+
+        first_request = statistics.median(r["first_request_ms"] for r in runs)
+        verdict = "ok" if first_request <= budgets[entry] else "OVER BUDGET"
+        print(f"{entry}: first request after {first_request:.0f}ms (budget {budgets[entry]:.0f}ms) {verdict}")
+        print(f"  load {statistics.median(r['load_ms'] for r in runs):.0f}ms, "
+              f"first POST {statistics.median(r['first_post_ms'] for r in runs):.0f}ms")
+        labels = sorted({label for r in runs for label in r["phases"]})
+        for label in labels:
+            print(f"  {label:<28} {statistics.median(r['phases'].get(label, 0.0) for r in runs):>8.1f}ms")
+        print("  imports by package (self time):")
+        breakdown = sorted(import_breakdown(importtime_log).items(), key=lambda item: -item[1])
+        for package, ms in breakdown[:args.top]:
+            print(f"    {package:<26} {ms:>8.1f}ms")
+        print(f"    {'total':<26} {sum(ms for _, ms in breakdown):>8.1f}ms\n")
+        if verdict != "ok":
+            over_budget.append(entry)
+
+    if over_budget:
+        print(f"Startup budget exceeded: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Turn logged transcripts back into /api/chat requests
+
+Reads what the app recorded with TRANSCRIPT_BACKEND=jsonl or sqlite: a
+transcript directory, a single .jsonl(.gz) file or the SQLite file. It
+writes one /api/chat body per line, {"id": ..., "messages": [...]}, which
+is the input of scripts/batch_chat.py. scripts/benchmark.py --replay reads
+transcripts directly. Repeated conversations are written once unless
+--keep-duplicates is given. Without --summary the bodies go to stdout or
+--out; with it, only counts per model and cache result are printed.
+
+Usage (from Backend/):
+    python scripts/replay_transcripts.py [PATH] [--since 2026-10-01] [--limit 500] [--out conversations.jsonl]
+    python scripts/replay_transcripts.py --summary
+"""
+import argparse
+import json
+import os
+import sys
+from collections import Counter
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.transcripts import conversations, default_path, read_transcripts  # noqa: E402
+
+
+def default_source():
+    backend = os.getenv("TRANSCRIPT_BACKEND", "jsonl").lower()
+    return os.getenv("TRANSCRIPT_PATH") or default_path(backend)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", help="transcript directory, file or SQLite database (default: the app's)")
+    parser.add_argument("--since", help="only entries from this date (YYYY-MM-DD) or ISO time on")
+    parser.add_argument("--limit", type=int, help="stop after this many conversations")
+    parser.add_argument("--keep-duplicates", action="store_true", help="write repeated conversations every time")
+    parser.add_argument("--summary", action="store_true", help="print counts instead of the conversations")
+    parser.add_argument("--out", help="write here instead of stdout")
+    args = parser.parse_args()
+
+    path = args.path or default_source()
+    if not os.path.exists(path):
+        raise SystemExit(f"no transcripts at {path}")
+    since = datetime.fromisoformat(args.since).timestamp() if args.since else None
+    entries = read_transcripts(path, since)
+
+    if args.summary:
+        total = 0
+        models, caches = Counter(), Counter()
+        for entry in entries:
+            total += 1
+            models[entry.get("model")] += 1
+            caches[entry.get("cache")] += 1
+        print(f"{total} exchanges in {path}")
+        print("models: " + ", ".join(f"{name} {count}" for name, count in models.most_common()))
+        print("cache:  " + ", ".join(f"{name} {count}" for name, count in caches.most_common()))
+        return
+
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    written = 0
+    try:
+        for body in conversations(entries, unique=not args.keep_duplicates, limit=args.limit):
+            written += 1
+            out.write(json.dumps({"id": f"replay-{written}", **body}, ensure_ascii=False) + "\n")
+    finally:
+        if args.out:
+            out.close()
+    print(f"{written} conversations from {path}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
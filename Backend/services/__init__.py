@@ -0,0 +1 @@
+# Services used by the Flask app
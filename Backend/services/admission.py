@@ -0,0 +1,341 @@
+import asyncio
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from services.settings import env_flag
+from services.shared_file import thread_connection
+
+try:
+    import fcntl
+except ImportError:  # Windows: the concurrency cap then only applies per worker
+    fcntl = None
+
+
+class MemoryBuckets:
+    """Token buckets for one worker, least recently seen clients dropped beyond max_clients"""
+
+    def __init__(self, max_clients=10000):
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def take(self, key, rate, burst):
+        """Spend one token; returns seconds until a token is available (0 when allowed)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class SQLiteBuckets:
+    """Token buckets in a SQLite file, so a client's limit holds across all gunicorn workers"""
+
+    def __init__(self, path, max_clients=10000):
+        self.path = path
+        self.max_clients = max_clients
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS buckets_updated ON buckets (updated)")
+
+    def _conn(self):
+        return thread_connection(self._local, self.path)
+
+    def take(self, key, rate, burst):
+        conn = self._conn()
+        # Wall clock, since workers don't share a monotonic clock
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + max(0.0, now - row[1]) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+            if row is None:
+                conn.execute(
+                    "DELETE FROM buckets WHERE key IN ("
+                    "SELECT key FROM buckets ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+                    (self.max_clients,),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+
+class Slot:
+    """One of the upstream concurrency slots; release() is safe to call more than once"""
+
+    def __init__(self, gate, handle):
+        self.gate = gate
+        self.handle = handle
+
+    def release(self):
+        if self.handle is not None:
+            handle, self.handle = self.handle, None
+            self.gate._release(handle)
+
+
+class ConcurrencyGate:
+    """Caps in-flight upstream calls with a bounded wait queue
+
+    On POSIX each slot is an flock on a small file, so the cap holds across
+    all gunicorn workers and a crashed worker's slot frees itself. Requests
+    wait at most `queue_timeout` for a slot, and no more than `queue_size`
+    wait per worker. Once the recent average wait exceeds `shed_wait`, new
+    requests are turned away at once instead of joining a queue that can't
+    drain in time.
+    """
+
+    def __init__(self, max_in_flight=8, queue_size=16, queue_timeout=5.0, shed_wait=2.0, lock_dir=None,
+                 poll_interval=0.02):
+        self.max_in_flight = max_in_flight
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.shed_wait = shed_wait
+        self.poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self.avg_wait = 0.0
+        self.in_flight = 0
+        self._semaphore = None
+        self._paths = []
+        if fcntl is not None:
+            lock_dir = lock_dir or os.path.join(tempfile.gettempdir(), "gptbro_slots")
+            os.makedirs(lock_dir, exist_ok=True)
+            self._paths = [os.path.join(lock_dir, f"slot-{i}.lock") for i in range(max_in_flight)]
+        else:
+            self._semaphore = threading.BoundedSemaphore(max_in_flight)
+
+    def _try_acquire(self):
+        if self._semaphore is not None:
+            return True if self._semaphore.acquire(blocking=False) else None
+        # Start at a different slot per process so workers don't all contend for slot 0
+        offset = os.getpid() % len(self._paths)
+        for i in range(len(self._paths)):
+            path = self._paths[(offset + i) % len(self._paths)]
+            handle = open(path, "a")
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return handle
+            except OSError:
+                handle.close()
+        return None
+
+    def _release(self, handle):
+        with self._lock:
+            self.in_flight -= 1
+        if self._semaphore is not None:
+            self._semaphore.release()
+        else:
+            handle.close()
+
+    def _observe(self, waited):
+        # Exponentially weighted so a burst of slow waits trips shedding quickly and recovers as quickly
+        self.avg_wait = 0.8 * self.avg_wait + 0.2 * waited
+
+    def acquire(self):
+        """Return (slot, None) or (None, (reason, retry_after_seconds))"""
+        handle = self._try_acquire()
+        if handle is not None:
+            with self._lock:
+                self.in_flight += 1
+                self._observe(0.0)
+            return Slot(self, handle), None
+
+        with self._lock:
+            if self.avg_wait > self.shed_wait or self._waiting >= self.queue_size:
+                return None, ("overloaded", max(1.0, self.avg_wait))
+            self._waiting += 1
+        started = time.monotonic()
+        try:
+            while time.monotonic() - started < self.queue_timeout:
+                time.sleep(self.poll_interval)
+                handle = self._try_acquire()
+                if handle is not None:
+                    with self._lock:
+                        self.in_flight += 1
+                        self._observe(time.monotonic() - started)
+                    return Slot(self, handle), None
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        with self._lock:
+            self._observe(self.queue_timeout)
+        return None, ("queue_timeout", max(1.0, self.avg_wait))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_in_flight": self.max_in_flight,
+                "in_flight": self.in_flight,
+                "waiting": self._waiting,
+                "avg_wait_ms": round(self.avg_wait * 1000, 1),
+            }
+
+
+class AsyncConcurrencyGate:
+    """ConcurrencyGate for the asyncio server in asgi.py: one process, many chats per event loop
+
+    The slots are an asyncio.Semaphore, so waiting costs a suspended task
+    instead of a thread. Queueing, timeout and shedding behave like
+    ConcurrencyGate. acquire() and release() must run on the event loop.
+    """
+
+    def __init__(self, max_in_flight=64, queue_size=256, queue_timeout=5.0, shed_wait=2.0):
+        self.max_in_flight = max_in_flight
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.shed_wait = shed_wait
+
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._waiting = 0
+        self.avg_wait = 0.0
+        self.in_flight = 0
+        self.shed = 0
+
+    def _release(self, handle):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def _observe(self, waited):
+        self.avg_wait = 0.8 * self.avg_wait + 0.2 * waited
+
+    async def acquire(self):
+        """Return (slot, None) or (None, (reason, retry_after_seconds))"""
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+            self.in_flight += 1
+            self._observe(0.0)
+            return Slot(self, True), None
+
+        if self.avg_wait > self.shed_wait or self._waiting >= self.queue_size:
+            self.shed += 1
+            return None, ("overloaded", max(1.0, self.avg_wait))
+        self._waiting += 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._observe(self.queue_timeout)
+            self.shed += 1
+            return None, ("queue_timeout", max(1.0, self.avg_wait))
+        finally:
+            self._waiting -= 1
+        self.in_flight += 1
+        self._observe(time.monotonic() - started)
+        return Slot(self, True), None
+
+    def stats(self):
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "waiting": self._waiting,
+            "shed": self.shed,
+            "avg_wait_ms": round(self.avg_wait * 1000, 1),
+        }
+
+
+class AdmissionController:
+    """Per-client token buckets in front of a global cap on upstream concurrency"""
+
+    def __init__(self, buckets, gate, rate_per_minute=20, burst=10):
+        self.buckets = buckets
+        self.gate = gate
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rate_limited = 0
+        self.shed = 0
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def check_rate(self, client_key):
+        """Seconds the client must wait before its next request (0 when allowed)"""
+        try:
+            wait = self.buckets.take(client_key, self.rate, self.burst)
+        except sqlite3.Error:
+            # A locked or broken bucket store must not take the chat down
+            return 0.0
+        if wait:
+            self._count("rate_limited")
+        return wait
+
+    def acquire_slot(self):
+        """Return (slot, None) or (None, (reason, retry_after_seconds)) when the request is shed"""
+        slot, rejection = self.gate.acquire()
+        self._count("admitted" if slot is not None else "shed")
+        return slot, rejection
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "rate_per_minute": round(self.rate * 60, 2),
+                "burst": self.burst,
+                "admitted": self.admitted,
+                "rate_limited": self.rate_limited,
+                "shed": self.shed,
+            }
+        stats.update(self.gate.stats())
+        return stats
+
+
+def retry_after_header(seconds):
+    return str(max(1, math.ceil(seconds)))
+
+
+def create_admission_controller():
+    """Build from RATE_LIMIT_* / ADMISSION_* settings; returns None when disabled"""
+    if not env_flag("ADMISSION_CONTROL", True):
+        return None
+    if os.getenv("RATE_LIMIT_BACKEND", "memory").lower() == "sqlite":
+        path = os.getenv("RATE_LIMIT_PATH", os.path.join(tempfile.gettempdir(), "gptbro_ratelimit.sqlite3"))
+        buckets = SQLiteBuckets(path)
+    else:
+        buckets = MemoryBuckets()
+    gate = ConcurrencyGate(
+        max_in_flight=int(os.getenv("ADMISSION_MAX_IN_FLIGHT", 8)),
+        queue_size=int(os.getenv("ADMISSION_QUEUE_SIZE", 16)),
+        queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 5)),
+        shed_wait=float(os.getenv("ADMISSION_SHED_WAIT", 2)),
+        lock_dir=os.getenv("ADMISSION_LOCK_DIR"),
+    )
+    return AdmissionController(
+        buckets,
+        gate,
+        rate_per_minute=float(os.getenv("RATE_LIMIT_PER_MINUTE", 20)),
+        burst=float(os.getenv("RATE_LIMIT_BURST", 10)),
+    )
+
+
+def create_async_gate():
+    """Concurrency limit for the ASGI app, from ASGI_* settings (queue timeout and shedding shared with ADMISSION_*)"""
+    return AsyncConcurrencyGate(
+        max_in_flight=int(os.getenv("ASGI_MAX_CONCURRENCY", 64)),
+        queue_size=int(os.getenv("ASGI_QUEUE_SIZE", 256)),
+        queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 5)),
+        shed_wait=float(os.getenv("ADMISSION_SHED_WAIT", 2)),
+    )
@@ -0,0 +1,170 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Rejections that clear by themselves: rate limits and a full upstream gate
+RETRYABLE_CODES = ("rate_limited", "overloaded", "queue_timeout")
+
+ITEM_FAILED = {"error": "This conversation could not be answered.", "code": "item_failed"}
+
+
+def retry_after_seconds(headers, default=1.0):
+    try:
+        return max(0.0, float(headers.get("Retry-After", default)))
+    except (TypeError, ValueError):
+        return default
+
+
+class BatchRunner:
+    """Runs many chats with at most `concurrency` in flight, yielding each result as it completes
+
+    `run_one(item)` answers one conversation the way /api/chat would and
+    returns its (payload, status, headers). An item turned away with a 429
+    (its client's rate limit, a full upstream gate) waits out Retry-After
+    and goes again, for up to `max_wait` seconds in total, so a batch moves
+    at the pace the limits allow instead of failing. Closing the generator
+    returned by run() (a client that stops reading) cancels the items that
+    haven't started.
+    """
+
+    def __init__(self, concurrency=4, max_concurrency=8, max_items=1000, max_wait=600.0):
+        self.concurrency = min(concurrency, max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.max_items = max_items
+        self.max_wait = max_wait
+
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.limit_waits = 0
+        self.in_flight = 0
+
+    def validate(self, data):
+        """Pull (items, concurrency) out of a request body; returns (items, concurrency, error)"""
+        items = data.get("conversations") if isinstance(data, dict) else None
+        if not isinstance(items, list) or not items:
+            return None, None, ({"error": "No conversations provided", "code": "empty_batch"}, 400)
+        if len(items) > self.max_items:
+            return None, None, ({
+                "error": "Too many conversations in one batch",
+                "code": "batch_too_large",
+                "max_items": self.max_items,
+            }, 413)
+        concurrency = data.get("concurrency")
+        if concurrency is not None and (isinstance(concurrency, bool) or not isinstance(concurrency, int) or concurrency < 1):
+            return None, None, ({"error": "concurrency must be a positive integer", "code": "invalid_concurrency"}, 400)
+        return items, concurrency, None
+
+    def run(self, items, run_one, concurrency=None):
+        """Yield one result dict per item, in completion order"""
+        items = list(items)
+        concurrency = min(concurrency or self.concurrency, self.max_concurrency, len(items)) or 1
+        with self._lock:
+            self.batches += 1
+        stop = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch")
+        futures = [pool.submit(self._run_item, index, item, run_one, stop) for index, item in enumerate(items)]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            stop.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run_item(self, index, item, run_one, stop):
+        started = time.monotonic()
+        result = {"index": index}
+        if isinstance(item, dict) and item.get("id") is not None:
+            result["id"] = item["id"]
+        with self._lock:
+            self.in_flight += 1
+        try:
+            waited = 0.0
+            attempts = 0
+            while True:
+                attempts += 1
+                try:
+                    payload, status, headers = run_one(item)
+                except Exception as e:
+                    if os.getenv("FLASK_ENV") != "production":
+                        print(f"Batch item {index} failed: {str(e)[:200]}")
+                    payload, status, headers = ITEM_FAILED, 500, {}
+                if status != 429 or payload.get("code") not in RETRYABLE_CODES:
+                    break
+                delay = retry_after_seconds(headers)
+                if waited + delay > self.max_wait or stop.is_set():
+                    break
+                with self._lock:
+                    self.limit_waits += 1
+                waited += delay
+                if stop.wait(delay):
+                    break
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+        result["status"] = status
+        result.update(payload)
+        if headers.get("X-Cache"):
+            result["cache"] = headers["X-Cache"]
+        result["attempts"] = attempts
+        result["elapsed_ms"] = round((time.monotonic() - started) * 1000)
+        with self._lock:
+            self.items += 1
+            if status == 200:
+                self.succeeded += 1
+            else:
+                self.failed += 1
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "concurrency": self.concurrency,
+                "max_concurrency": self.max_concurrency,
+                "max_items": self.max_items,
+                "batches": self.batches,
+                "items": self.items,
+                "succeeded": self.succeeded,
+                "failed": self.failed,
+                "limit_waits": self.limit_waits,
+                "in_flight": self.in_flight,
+            }
+
+
+def ndjson_lines(results):
+    """Encode results one JSON object per line, closed by a summary line ({"done": true, ...})"""
+    started = time.monotonic()
+    succeeded = failed = 0
+    try:
+        for result in results:
+            if result["status"] == 200:
+                succeeded += 1
+            else:
+                failed += 1
+            yield json.dumps(result) + "\n"
+        yield json.dumps({
+            "done": True,
+            "items": succeeded + failed,
+            "succeeded": succeeded,
+            "failed": failed,
+            "elapsed_ms": round((time.monotonic() - started) * 1000),
+        }) + "\n"
+    finally:
+        close = getattr(results, "close", None)
+        if close is not None:
+            close()
+
+
+def create_batch_runner():
+    """Build from BATCH_* settings"""
+    return BatchRunner(
+        concurrency=int(os.getenv("BATCH_CONCURRENCY", 4)),
+        max_concurrency=int(os.getenv("BATCH_MAX_CONCURRENCY", 8)),
+        max_items=int(os.getenv("BATCH_MAX_ITEMS", 1000)),
+        max_wait=float(os.getenv("BATCH_MAX_WAIT", 600)),
+    )
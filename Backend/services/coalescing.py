@@ -0,0 +1,254 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from services.response_cache import normalize_text
+from services.shared_file import thread_connection
+
+RUNNING = "running"
+DONE = "done"
+
+
+class IdempotencyConflict(Exception):
+    """An Idempotency-Key was reused with a different request body"""
+
+
+class MemoryFlightStore:
+    """Flight table for a single worker"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = {}
+
+    def claim(self, key, owner, lease, body_digest):
+        """Take the key unless a live row exists; returns None when claimed, else the existing row"""
+        now = time.time()
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None or row["expires_at"] < now:
+                self._rows[key] = {
+                    "owner": owner, "state": RUNNING, "value": None,
+                    "digest": body_digest, "expires_at": now + lease,
+                }
+                if len(self._rows) > 1000:
+                    for stale in [k for k, r in self._rows.items() if r["expires_at"] < now]:
+                        del self._rows[stale]
+                return None
+            return dict(row)
+
+    def finish(self, key, owner, value, ttl):
+        with self._lock:
+            row = self._rows.get(key)
+            if row is not None and row["owner"] == owner:
+                row.update(state=DONE, value=value, expires_at=time.time() + ttl)
+
+    def release(self, key, owner):
+        with self._lock:
+            row = self._rows.get(key)
+            if row is not None and row["owner"] == owner and row["state"] == RUNNING:
+                del self._rows[key]
+
+
+class SQLiteFlightStore:
+    """Flight table in a SQLite file so every gunicorn worker on the machine sees the same flights"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS flights ("
+            "key TEXT PRIMARY KEY, owner TEXT NOT NULL, state TEXT NOT NULL, "
+            "value TEXT, digest TEXT, expires_at REAL NOT NULL)"
+        )
+
+    def _conn(self):
+        return thread_connection(self._local, self.path)
+
+    def claim(self, key, owner, lease, body_digest):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT owner, state, value, digest, expires_at FROM flights WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[4] < now:
+                conn.execute(
+                    "INSERT OR REPLACE INTO flights (key, owner, state, value, digest, expires_at) "
+                    "VALUES (?, ?, ?, NULL, ?, ?)",
+                    (key, owner, RUNNING, body_digest, now + lease),
+                )
+                conn.execute("DELETE FROM flights WHERE expires_at < ?", (now,))
+                conn.execute("COMMIT")
+                return None
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return {"owner": row[0], "state": row[1], "value": row[2], "digest": row[3], "expires_at": row[4]}
+
+    def finish(self, key, owner, value, ttl):
+        self._conn().execute(
+            "UPDATE flights SET state = ?, value = ?, expires_at = ? WHERE key = ? AND owner = ?",
+            (DONE, value, time.time() + ttl, key, owner),
+        )
+
+    def release(self, key, owner):
+        self._conn().execute(
+            "DELETE FROM flights WHERE key = ? AND owner = ? AND state = ?", (key, owner, RUNNING)
+        )
+
+
+class Flight:
+    """One request's place in a flight: the leader does the upstream call, everyone else gets its result"""
+
+    def __init__(self, coalescer, key, role, result=None, ttl=0):
+        self.coalescer = coalescer
+        self.key = key
+        self.role = role
+        self.result = result
+        self.ttl = ttl
+        self.owner = None
+        self._settled = False
+
+    @property
+    def leader(self):
+        return self.role == "leader"
+
+    def complete(self, result):
+        """Publish the leader's result to waiting and later duplicate requests"""
+        if self.leader and not self._settled:
+            self._settled = True
+            self.coalescer._settle(self, json.dumps(result))
+
+    def release(self):
+        """Give up the flight without a result (error or client gone); waiters then run on their own"""
+        if self.leader and not self._settled:
+            self._settled = True
+            self.coalescer._settle(self, None)
+
+
+class RequestCoalescer:
+    """Single-flight for identical chat requests plus short-lived idempotency keys
+
+    The first request for a key becomes the leader and calls Gemini; identical
+    requests that arrive meanwhile wait for its result instead of making their
+    own call. Threads in the same worker wait on an Event, other workers poll
+    the shared store. A finished result is kept for `result_ttl` seconds
+    (`idempotency_ttl` for client-supplied Idempotency-Keys) so retries
+    replay it instantly. Waiters give up after `wait_timeout` and call
+    upstream themselves; a leader that dies loses its lease after `lease`.
+    """
+
+    def __init__(self, store, lease=60, wait_timeout=30, poll_interval=0.05, result_ttl=5, idempotency_ttl=600):
+        self.store = store
+        self.lease = lease
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.result_ttl = result_ttl
+        self.idempotency_ttl = idempotency_ttl
+
+        self._lock = threading.Lock()
+        self._events = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.replayed = 0
+        self.timeouts = 0
+
+    @staticmethod
+    def digest(payload):
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    def conversation_key(self, prompt_version, messages):
+        normalized = [[m.get("sender") == "user", normalize_text(m.get("text", ""))] for m in messages]
+        return "msg:" + self.digest([prompt_version, normalized])
+
+    def join_conversation(self, prompt_version, messages):
+        return self._join(self.conversation_key(prompt_version, messages), None, self.result_ttl, "coalesced")
+
+    def join_idempotent(self, idempotency_key, body):
+        """Raises IdempotencyConflict when the key was already used for a different body"""
+        key = "idem:" + hashlib.sha256(str(idempotency_key).encode()).hexdigest()
+        return self._join(key, self.digest(body), self.idempotency_ttl, "replayed")
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _join(self, key, body_digest, ttl, shared_role):
+        owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            with self._lock:
+                row = self.store.claim(key, owner, self.lease, body_digest)
+                if row is None:
+                    self._events[key] = threading.Event()
+            if row is None:
+                self._count("leaders")
+                flight = Flight(self, key, "leader", ttl=ttl)
+                flight.owner = owner
+                return flight
+            if body_digest is not None and row["digest"] != body_digest:
+                raise IdempotencyConflict(key)
+            if row["state"] == DONE:
+                self._count(shared_role)
+                return Flight(self, key, shared_role, result=json.loads(row["value"]))
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._count("timeouts")
+                return Flight(self, key, "solo")
+            with self._lock:
+                event = self._events.get(key)
+            if event is not None:
+                event.wait(remaining)
+            else:
+                time.sleep(min(self.poll_interval, remaining))
+
+    def _settle(self, flight, value):
+        try:
+            if value is None:
+                self.store.release(flight.key, flight.owner)
+            else:
+                self.store.finish(flight.key, flight.owner, value, flight.ttl)
+        finally:
+            with self._lock:
+                event = self._events.pop(flight.key, None)
+            if event is not None:
+                event.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": type(self.store).__name__,
+                "in_flight": len(self._events),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "replayed": self.replayed,
+                "wait_timeouts": self.timeouts,
+            }
+
+
+def create_coalescer():
+    """Build from COALESCE_* / IDEMPOTENCY_TTL settings; returns None when disabled
+
+    Flights are per worker by default. COALESCE_BACKEND=sqlite shares them
+    between the workers of one machine, at the cost of a file write per request.
+    """
+    kind = os.getenv("COALESCE_BACKEND", "memory").lower()
+    if kind in ("off", "none", ""):
+        return None
+    if kind == "memory":
+        store = MemoryFlightStore()
+    else:
+        store = SQLiteFlightStore(os.getenv("COALESCE_PATH", os.path.join(tempfile.gettempdir(), "gptbro_flights.sqlite3")))
+    return RequestCoalescer(
+        store,
+        wait_timeout=float(os.getenv("COALESCE_WAIT_TIMEOUT", 30)),
+        result_ttl=float(os.getenv("COALESCE_RESULT_TTL", 5)),
+        idempotency_ttl=float(os.getenv("IDEMPOTENCY_TTL", 600)),
+    )
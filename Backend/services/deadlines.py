@@ -0,0 +1,109 @@
+import os
+import select
+import socket
+import threading
+import time
+
+# Seconds a request may ask for with this header, capped at REQUEST_DEADLINE_MAX
+DEADLINE_HEADER = "X-Request-Timeout"
+
+# No point starting an upstream attempt that can't finish in less than this
+MIN_ATTEMPT_SECONDS = 0.5
+
+DEADLINE_EXCEEDED = {"error": "GPT Bro took too long to answer. Please try again.", "code": "deadline_exceeded"}
+CLIENT_CLOSED = {"error": "Client closed the request", "code": "client_closed"}
+
+
+class Deadline:
+    """Time budget for one request, shared by every upstream attempt and model fallback"""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def allows_attempt(self):
+        return self.remaining() >= MIN_ATTEMPT_SECONDS
+
+    def request_options(self):
+        """SDK request options that stop the upstream call when the budget runs out"""
+        return {"timeout": max(MIN_ATTEMPT_SECONDS, self.remaining())}
+
+
+class DeadlinePolicy:
+    """Default budget plus a cap on what clients may ask for via X-Request-Timeout"""
+
+    def __init__(self, default=30.0, maximum=60.0):
+        self.default = default
+        self.maximum = maximum
+
+    def for_request(self, headers):
+        try:
+            budget = float(headers.get(DEADLINE_HEADER) or self.default)
+        except ValueError:
+            budget = self.default
+        return Deadline(min(max(budget, MIN_ATTEMPT_SECONDS), self.maximum))
+
+
+class CancellationStats:
+    """Counts upstream work stopped early and estimates the upstream time that saved
+
+    The saving of one cancelled call is the model's typical (p50) latency
+    minus the time the call had already run; calls to models without
+    latency samples count as zero.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.client_aborts = 0
+        self.deadline_exceeded = 0
+        self.retries_skipped = 0
+        self.upstream_seconds_saved = 0.0
+
+    def record(self, reason, saved=0.0):
+        """reason: client_abort | deadline"""
+        with self._lock:
+            if reason == "client_abort":
+                self.client_aborts += 1
+            else:
+                self.deadline_exceeded += 1
+            self.upstream_seconds_saved += saved
+
+    def record_skipped_retry(self):
+        with self._lock:
+            self.retries_skipped += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "client_aborts": self.client_aborts,
+                "deadline_exceeded": self.deadline_exceeded,
+                "retries_skipped": self.retries_skipped,
+                "upstream_seconds_saved": round(self.upstream_seconds_saved, 2),
+            }
+
+
+def socket_closed(sock):
+    """True once the peer has closed `sock`, without consuming any request bytes"""
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        return sock.recv(1, socket.MSG_PEEK) == b""
+    except (OSError, ValueError):
+        return True
+
+
+def create_deadline_policy():
+    """Build from REQUEST_DEADLINE / REQUEST_DEADLINE_MAX settings"""
+    return DeadlinePolicy(
+        default=float(os.getenv("REQUEST_DEADLINE", 30)),
+        maximum=float(os.getenv("REQUEST_DEADLINE_MAX", 60)),
+    )
@@ -0,0 +1,306 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from services.model_router import percentile
+from services.settings import env_flag
+
+# Hedge delays come from a model's own first-chunk latencies once it has this many
+MIN_SAMPLES = 20
+
+
+def close_stream(response):
+    """Stop a streamed generation nobody will read: cancel its gRPC call, or close its HTTP stream
+
+    The SDK's response has no public way to do this, so it goes through the
+    stream it wraps. Anything without a cancel() or close() is left to the
+    garbage collector, as before.
+    """
+    stream = getattr(response, "_iterator", response)
+    for name in ("cancel", "close"):
+        method = getattr(stream, name, None)
+        if callable(method):
+            try:
+                method()
+            except Exception:
+                pass
+            return
+
+
+class Start:
+    """A streamed generation that has produced its first chunk; `chunks` yields that chunk and the rest"""
+
+    def __init__(self, model_name, response, first, rest, started):
+        self.model_name = model_name
+        self.response = response
+        self.first = first
+        self.rest = rest
+        self.started = started
+
+    def __iter__(self):
+        if self.first is not None:
+            yield self.first
+        yield from self.rest
+
+    async def __aiter__(self):
+        if self.first is not None:
+            yield self.first
+        async for chunk in self.rest:
+            yield chunk
+
+
+class HedgePolicy:
+    """When to hedge and how much extra load hedging may add
+
+    A request is hedged once its primary model has been silent for longer
+    than the `pct` percentile of that model's recent first-chunk latencies
+    (`default_delay` until there are enough samples), clamped to
+    [min_delay, max_delay]. Hedges are capped at `max_extra_ratio` of the
+    requests seen in the last `window` seconds, but `min_hedges` are always
+    allowed per window so a quiet site still gets hedged.
+    """
+
+    def __init__(self, pct=95, default_delay=2.0, min_delay=0.2, max_delay=10.0, max_extra_ratio=0.1,
+                 min_hedges=1, window=60.0, samples=200):
+        self.pct = pct
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_extra_ratio = max_extra_ratio
+        self.min_hedges = min_hedges
+        self.window = window
+        self.samples = samples
+
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._requests = deque()
+        self._hedges = deque()
+        self.requests = 0
+        self.fired = 0
+        self.denied = 0
+        self.secondary_wins = 0
+        self.saved_total = 0.0
+
+    def observe(self, model_name, seconds):
+        """Record how long a model took to its first chunk"""
+        with self._lock:
+            self._latencies.setdefault(model_name, deque(maxlen=self.samples)).append(seconds)
+
+    def delay_for(self, model_name):
+        with self._lock:
+            latencies = list(self._latencies.get(model_name, ()))
+        if len(latencies) < MIN_SAMPLES:
+            return self.default_delay
+        return min(self.max_delay, max(self.min_delay, percentile(latencies, self.pct)))
+
+    def _trim(self, now):
+        for window in (self._requests, self._hedges):
+            while window and window[0] < now - self.window:
+                window.popleft()
+
+    def record_request(self):
+        now = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            self._requests.append(now)
+            self._trim(now)
+
+    def try_fire(self):
+        """Reserve a hedge if the extra-load budget allows one"""
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            if len(self._hedges) + 1 > max(self.min_hedges, self.max_extra_ratio * len(self._requests)):
+                self.denied += 1
+                return False
+            self._hedges.append(now)
+            self.fired += 1
+            return True
+
+    def estimated_saving(self, model_name, elapsed):
+        """How much longer the primary would probably have taken: its mean latency beyond `elapsed`"""
+        with self._lock:
+            slower = [s for s in self._latencies.get(model_name, ()) if s > elapsed]
+        return sum(slower) / len(slower) - elapsed if slower else 0.0
+
+    def record_win(self, saved):
+        with self._lock:
+            self.secondary_wins += 1
+            self.saved_total += saved
+
+    def stats(self):
+        with self._lock:
+            delays = {}
+            for name, latencies in self._latencies.items():
+                if len(latencies) >= MIN_SAMPLES:
+                    delays[name] = round(min(self.max_delay, max(self.min_delay, percentile(list(latencies), self.pct))) * 1000)
+            return {
+                "percentile": self.pct,
+                "max_extra_ratio": self.max_extra_ratio,
+                "min_hedges": self.min_hedges,
+                "requests": self.requests,
+                "fired": self.fired,
+                "fire_rate": round(self.fired / self.requests, 3) if self.requests else 0.0,
+                "denied_by_budget": self.denied,
+                "secondary_wins": self.secondary_wins,
+                "estimated_ms_saved": round(self.saved_total * 1000),
+                "estimated_ms_saved_per_win": round(self.saved_total * 1000 / self.secondary_wins) if self.secondary_wins else 0,
+                "delay_ms": delays,
+            }
+
+
+class Hedger:
+    """Races a slow primary model against a second model and keeps whichever streams first
+
+    Both calls are streamed so the race is decided on the first chunk. The
+    loser is stopped as soon as the winner is known: the async path cancels
+    its task, the sync path cancels its future if it hasn't started and
+    otherwise cancels its stream the moment its first chunk arrives, since a
+    blocked SDK call can't be interrupted from another thread. Failures of
+    the model that didn't decide the outcome are recorded with the router
+    here; the caller records the primary's failure when both fail.
+    """
+
+    def __init__(self, router, policy, max_workers=32):
+        self.router = router
+        self.policy = policy
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+
+    def _secondary(self, primary_name, exclude):
+        if not self.policy.try_fire():
+            return None
+        try:
+            return self.router.choose(exclude=list(exclude) + [primary_name])
+        except Exception:
+            # No other healthy model; the hedge reservation is simply unused
+            return None
+
+    def _finish(self, start, primary_name, begun):
+        self.policy.observe(start.model_name, time.monotonic() - start.started)
+        if start.model_name != primary_name:
+            self.policy.record_win(self.policy.estimated_saving(primary_name, time.monotonic() - begun))
+        return start
+
+    def _open(self, model_name, model, contents, kwargs):
+        started = time.monotonic()
+        response = model.generate_content(contents, stream=True, **kwargs)
+        rest = iter(response)
+        return Start(model_name, response, next(rest, None), rest, started)
+
+    def _drop(self, future, model_name):
+        """Stop a losing call now if it hasn't started, or close its stream once it has one"""
+        if future.done() and future.exception() is not None:
+            return
+        self.router.record_cancelled(model_name)
+        if future.cancel():
+            return
+
+        def close(finished):
+            if finished.exception() is None:
+                close_stream(finished.result().response)
+
+        # Runs at once if the call has already finished
+        future.add_done_callback(close)
+
+    def start(self, model_name, model, contents, exclude=(), **kwargs):
+        """Return the Start of whichever model streams first; raises the primary's error if both fail"""
+        self.policy.record_request()
+        begun = time.monotonic()
+        futures = {self._executor.submit(self._open, model_name, model, contents, kwargs): model_name}
+        done, _ = wait(futures, timeout=self.policy.delay_for(model_name))
+        if not done:
+            secondary = self._secondary(model_name, exclude)
+            if secondary is not None:
+                futures[self._executor.submit(self._open, *secondary, contents, kwargs)] = secondary[0]
+
+        errors = {}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    start = future.result()
+                except Exception as e:
+                    errors[futures[future]] = e
+                    continue
+                for loser in futures:
+                    if loser is not future:
+                        self._drop(loser, futures[loser])
+                for name, error in errors.items():
+                    self.router.record_failure(name, error)
+                return self._finish(start, model_name, begun)
+        for name, error in errors.items():
+            if name != model_name:
+                self.router.record_failure(name, error)
+        raise errors[model_name]
+
+    async def _open_async(self, model_name, model, contents, kwargs):
+        started = time.monotonic()
+        response = await model.generate_content_async(contents, stream=True, **kwargs)
+        rest = response.__aiter__()
+        try:
+            first = await rest.__anext__()
+        except StopAsyncIteration:
+            first = None
+        return Start(model_name, response, first, rest, started)
+
+    async def start_async(self, model_name, model, contents, exclude=(), **kwargs):
+        """Async start(); the losing call is cancelled"""
+        self.policy.record_request()
+        begun = time.monotonic()
+        tasks = {asyncio.ensure_future(self._open_async(model_name, model, contents, kwargs)): model_name}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.policy.delay_for(model_name))
+            if not done:
+                secondary = self._secondary(model_name, exclude)
+                if secondary is not None:
+                    tasks[asyncio.ensure_future(self._open_async(*secondary, contents, kwargs))] = secondary[0]
+
+            errors = {}
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    try:
+                        start = task.result()
+                    except Exception as e:
+                        errors[tasks[task]] = e
+                        continue
+                    for loser in tasks:
+                        if loser is task or (loser.done() and loser.exception() is not None):
+                            continue
+                        self.router.record_cancelled(tasks[loser])
+                        if loser.done():
+                            # Finished in the same round as the winner: its stream is open and unread
+                            close_stream(loser.result().response)
+                        else:
+                            loser.cancel()
+                    for name, error in errors.items():
+                        self.router.record_failure(name, error)
+                    return self._finish(start, model_name, begun)
+            for name, error in errors.items():
+                if name != model_name:
+                    self.router.record_failure(name, error)
+            raise errors[model_name]
+        finally:
+            # The request itself was cancelled (client gone): take every call down with it
+            for task in tasks:
+                task.cancel()
+
+
+def create_hedger(router):
+    """Build from HEDGE_* settings; returns None unless HEDGE_ENABLED is set"""
+    if not env_flag("HEDGE_ENABLED", False):
+        return None
+    policy = HedgePolicy(
+        pct=float(os.getenv("HEDGE_PERCENTILE", 95)),
+        default_delay=float(os.getenv("HEDGE_DEFAULT_DELAY", 2)),
+        min_delay=float(os.getenv("HEDGE_MIN_DELAY", 0.2)),
+        max_delay=float(os.getenv("HEDGE_MAX_DELAY", 10)),
+        max_extra_ratio=float(os.getenv("HEDGE_MAX_EXTRA_RATIO", 0.1)),
+        min_hedges=int(os.getenv("HEDGE_MIN_PER_WINDOW", 1)),
+    )
+    return Hedger(router, policy)
@@ -0,0 +1,219 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import google.generativeai as genai
+
+from services.response_cache import MemoryBackend, SQLiteBackend, normalize_text
+from services.settings import env_flag
+from services.tokens import estimate_tokens
+
+SUMMARY_PROMPT = """You maintain the running summary of a chat between a visitor and GPT Bro, a chatbot that answers questions about its creator Usman Ghani.
+Update the summary with the new messages. Keep facts the visitor shared about themselves, what they asked and the key points of each answer. Drop greetings and filler. Reply with the summary only, at most {max_words} words.
+
+CURRENT SUMMARY:
+{summary}
+
+NEW MESSAGES:
+{transcript}
+"""
+
+
+def message_tokens(msg):
+    # A few tokens of per-turn overhead on top of the text
+    return estimate_tokens(str(msg.get("text", ""))) + 4
+
+
+def prefix_digests(messages):
+    """Fingerprints of every prefix of `messages` (entry i covers messages[:i]), chained so they take one pass
+
+    A stored summary is only reused for exactly the messages it was built from.
+    """
+    digests = [hashlib.sha256(b"").hexdigest()]
+    for m in messages:
+        entry = json.dumps([m.get("sender") == "user", normalize_text(m.get("text", ""))])
+        digests.append(hashlib.sha256((digests[-1] + entry).encode()).hexdigest())
+    return digests
+
+
+def parse_model_budgets(spec):
+    """"gemini-2.5-pro=6000,gemini-2.0-flash-lite=1500" -> {name: tokens}"""
+    budgets = {}
+    for item in spec.split(","):
+        name, _, tokens = item.partition("=")
+        if name.strip() and tokens.strip():
+            budgets[name.strip()] = int(tokens)
+    return budgets
+
+
+class HistoryCompactor:
+    """Keeps long conversations inside a token budget
+
+    The last `keep_turns` user turns (and the replies to them) are always
+    sent verbatim. When the history exceeds the model's budget, the older
+    turns are replaced by a rolling summary. Summaries are extended
+    incrementally in a background thread by a cheap model, so a request
+    never waits on one: until a summary has caught up, the oldest turns that
+    don't fit are simply dropped. Each summary is stored under the
+    conversation's id (the session the client resumed, if any) and a fingerprint of
+    every message it covers, so it is only ever reused for that exact
+    history.
+    """
+
+    def __init__(self, summarize, backend, token_budget=2000, model_budgets=None, keep_turns=4):
+        self.summarize = summarize
+        self.backend = backend
+        self.token_budget = token_budget
+        self.model_budgets = model_budgets or {}
+        self.keep_turns = keep_turns
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-summary")
+        self._lock = threading.Lock()
+        self._pending = set()
+        self.requests = 0
+        self.compacted = 0
+        self.tokens_saved = 0
+        self.summaries_built = 0
+        self.summary_failures = 0
+
+    def budget_for(self, model_name):
+        return self.model_budgets.get(model_name, self.token_budget)
+
+    def _window_start(self, messages, budget):
+        """Index where the verbatim window begins: the last keep_turns user turns, fewer if they don't fit"""
+        user_indexes = [i for i, m in enumerate(messages) if m.get("sender") == "user"]
+        if not user_indexes:
+            return 0
+        starts = user_indexes[-self.keep_turns:]
+        for start in starts:
+            if sum(message_tokens(m) for m in messages[start:]) <= budget:
+                return start
+        # Even the latest turn alone is over budget; it is sent anyway and the input limits deal with it
+        return starts[-1]
+
+    def compact(self, messages, model_name, conversation_id=None):
+        """Return (messages to send, summary text or None, tokens saved)"""
+        budget = self.budget_for(model_name)
+        total = sum(message_tokens(m) for m in messages)
+        with self._lock:
+            self.requests += 1
+        if total <= budget:
+            return messages, None, 0
+
+        start = self._window_start(messages, budget)
+        window = messages[start:]
+        used = sum(message_tokens(m) for m in window)
+
+        older = messages[:start]
+        # Clients without a session send their whole history, so the fingerprint alone tells them apart
+        scope = conversation_id or "stateless"
+        record = self._latest_record(scope, older, prefix_digests(older))
+        summary = None
+        covered = 0
+        if record is not None:
+            summary = record["summary"]
+            covered = record["covered"]
+            used += estimate_tokens(summary)
+        if covered < len(older):
+            self._schedule(scope, older)
+
+        # Turns the summary doesn't cover yet fill whatever budget is left, newest first
+        uncovered = older[covered:]
+        keep_from = len(uncovered)
+        while keep_from > 0 and used + message_tokens(uncovered[keep_from - 1]) <= budget:
+            keep_from -= 1
+            used += message_tokens(uncovered[keep_from])
+        compacted = uncovered[keep_from:] + window
+
+        saved = max(0, total - used)
+        with self._lock:
+            self.compacted += 1
+            self.tokens_saved += saved
+        return compacted, summary, saved
+
+    def _latest_record(self, scope, older, digests):
+        """The stored summary covering the longest prefix of `older`, tried at each turn boundary, newest first"""
+        for covered in range(len(older), 0, -1):
+            if covered < len(older) and older[covered].get("sender") != "user":
+                continue
+            record = self.backend.get(f"{scope}:{digests[covered]}")
+            if record is not None and record["covered"] == covered:
+                return record
+        return None
+
+    def _schedule(self, scope, older):
+        key = f"{scope}:{prefix_digests(older)[-1]}"
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        self._executor.submit(self._extend_summary, key, scope, list(older))
+
+    def _extend_summary(self, key, scope, older):
+        try:
+            record = self._latest_record(scope, older, prefix_digests(older))
+            previous = record["summary"] if record is not None else ""
+            covered = record["covered"] if record is not None else 0
+            summary = self.summarize(previous, older[covered:]).strip()
+            if summary:
+                self.backend.set(key, {"summary": summary, "covered": len(older)})
+                with self._lock:
+                    self.summaries_built += 1
+        except Exception as e:
+            with self._lock:
+                self.summary_failures += 1
+            if os.getenv("FLASK_ENV") != "production":
+                print(f"⚠️ History summary failed: {str(e)[:200]}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "token_budget": self.token_budget,
+                "keep_turns": self.keep_turns,
+                "requests": self.requests,
+                "compacted": self.compacted,
+                "tokens_saved": self.tokens_saved,
+                "tokens_saved_per_request": round(self.tokens_saved / self.requests, 1) if self.requests else 0.0,
+                "summaries_built": self.summaries_built,
+                "summary_failures": self.summary_failures,
+            }
+
+
+def gemini_summarizer(model_name, max_words=150):
+    """summarize(previous_summary, messages) backed by a plain Gemini model (no persona prefix)"""
+    model = genai.GenerativeModel(model_name)  # type: ignore
+
+    def summarize(previous, messages):
+        transcript = "\n".join(
+            f"{'Visitor' if m.get('sender') == 'user' else 'GPT Bro'}: {m.get('text', '')}" for m in messages
+        )
+        prompt = SUMMARY_PROMPT.format(max_words=max_words, summary=previous or "(none yet)", transcript=transcript)
+        response = model.generate_content(prompt, generation_config={"max_output_tokens": max_words * 2})
+        return response.text
+
+    return summarize
+
+
+def create_history_compactor():
+    """Build from HISTORY_* settings; returns None when disabled"""
+    if not env_flag("HISTORY_COMPACTION", True):
+        return None
+    max_entries = int(os.getenv("HISTORY_SUMMARY_CACHE_SIZE", 1000))
+    if os.getenv("HISTORY_SUMMARY_BACKEND", "memory").lower() == "sqlite":
+        path = os.getenv("HISTORY_SUMMARY_PATH", os.path.join(tempfile.gettempdir(), "gptbro_summaries.sqlite3"))
+        backend = SQLiteBackend(max_entries, path, table="history_summaries")
+    else:
+        backend = MemoryBackend(max_entries)
+    return HistoryCompactor(
+        gemini_summarizer(os.getenv("HISTORY_SUMMARY_MODEL", "gemini-2.0-flash-lite")),
+        backend,
+        token_budget=int(os.getenv("HISTORY_TOKEN_BUDGET", 2000)),
+        model_budgets=parse_model_budgets(os.getenv("HISTORY_MODEL_BUDGETS", "")),
+        keep_turns=int(os.getenv("HISTORY_KEEP_TURNS", 4)),
+    )
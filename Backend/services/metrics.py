@@ -0,0 +1,243 @@
+import bisect
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from services.retry import error_status
+from services.settings import env_flag
+from services.shared_file import read_json, write_json_atomic
+
+# Seconds; covers a JSON parse (sub-millisecond) up to a slow Gemini call
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Every metric exposed at /metrics: name -> (type, help); names get the "gptbro_" prefix
+METRICS = {
+    "requests_total": ("counter", "HTTP requests by route and status"),
+    "request_seconds": ("histogram", "Time from a request's arrival until its response (or stream) ended, by route"),
+    "in_flight_requests": ("gauge", "Requests being served right now, by route"),
+    "stage_seconds": ("histogram", "Time spent in each stage of the /api/chat pipeline"),
+    "upstream_calls_total": ("counter", "Gemini calls by model and outcome"),
+    "upstream_seconds": ("histogram", "Duration of successful Gemini calls by model"),
+    "tokens_total": ("counter", "Tokens reported in Gemini's usage metadata, by model and kind"),
+    "cache_results_total": ("counter", "How /api/chat requests were answered (the X-Cache value)"),
+}
+
+ERROR_CLASSES = {
+    400: "invalid_argument",
+    403: "permission_denied",
+    404: "not_found",
+    429: "rate_limited",
+    500: "internal",
+    503: "unavailable",
+    504: "deadline_exceeded",
+}
+
+
+def error_class(error):
+    """A short, low-cardinality label for an upstream error"""
+    if isinstance(error, TimeoutError):
+        return "timeout"
+    if isinstance(error, ConnectionError):
+        return "connection"
+    return ERROR_CLASSES.get(error_status(error), "other")
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metrics:
+    """Prometheus counters, gauges and histograms for this process, merged across workers at scrape time
+
+    Recording is a dict update under a lock, a few microseconds. Every `flush_interval` seconds a background thread writes
+    this process's values to `<directory>/<pid>.json`. render() combines the
+    live values of the process serving /metrics with the files of every other
+    worker that is still running, so a scrape that lands on any gunicorn
+    worker reports the whole server, with other workers' values up to one
+    interval old. A worker that exits takes its counts with it (Prometheus
+    sees a counter reset). The default directory is per parent process, so
+    the workers of one gunicorn master share it.
+    """
+
+    def __init__(self, directory=None, flush_interval=5.0, buckets=DEFAULT_BUCKETS, enabled=True):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.buckets = tuple(buckets)
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._flushing = False
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        # A worker forked from a process that already recorded (gunicorn --preload) starts empty
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._flushing = False
+        self._counters, self._gauges, self._histograms = {}, {}, {}
+
+    def _check_process(self):
+        # Threads don't survive a fork, so each process starts its own flush thread on first use
+        if self._flushing or self.flush_interval <= 0:
+            return
+        with self._lock:
+            if self._flushing:
+                return
+            self._flushing = True
+        threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        self._check_process()
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def add(self, name, amount, **labels):
+        """Move a gauge up or down"""
+        if not self.enabled:
+            return
+        self._check_process()
+        key = (name, _labels(labels))
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        self._check_process()
+        key = (name, _labels(labels))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # One count per bucket plus +Inf, then the sum
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            histogram[index] += 1
+            histogram[-1] += value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                "gauges": [[name, list(labels), value] for (name, labels), value in self._gauges.items()],
+                "histograms": [[name, list(labels), list(values)] for (name, labels), values in self._histograms.items()],
+            }
+
+    def _directory(self):
+        if self.directory is None:
+            self.directory = os.path.join(tempfile.gettempdir(), f"gptbro_metrics_{os.getppid()}")
+        os.makedirs(self.directory, exist_ok=True)
+        return self.directory
+
+    def flush(self):
+        write_json_atomic(os.path.join(self._directory(), f"{os.getpid()}.json"), self.snapshot())
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def _other_workers(self):
+        """Snapshots flushed by the other live processes; files of exited ones are removed"""
+        if self.flush_interval <= 0:
+            return []
+        directory = self._directory()
+        snapshots = []
+        for entry in os.listdir(directory):
+            pid, _, extension = entry.partition(".")
+            if extension != "json" or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                try:
+                    os.remove(os.path.join(directory, entry))
+                except OSError:
+                    pass
+                continue
+            except PermissionError:
+                pass
+            snapshot = read_json(os.path.join(directory, entry))
+            if snapshot is not None:
+                snapshots.append(snapshot)
+        return snapshots
+
+    def render(self):
+        """All workers' metrics in the Prometheus text exposition format"""
+        self._check_process()
+        merged = {"counters": {}, "gauges": {}, "histograms": {}}
+        for snapshot in [self.snapshot(), *self._other_workers()]:
+            for kind in ("counters", "gauges"):
+                for name, labels, value in snapshot.get(kind, []):
+                    key = (name, tuple(tuple(pair) for pair in labels))
+                    merged[kind][key] = merged[kind].get(key, 0) + value
+            for name, labels, values in snapshot.get("histograms", []):
+                key = (name, tuple(tuple(pair) for pair in labels))
+                if len(values) != len(self.buckets) + 2:
+                    continue
+                total = merged["histograms"].setdefault(key, [0] * len(values))
+                for i, value in enumerate(values):
+                    total[i] += value
+
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            series = merged["histograms" if kind == "histogram" else kind + "s"]
+            keys = sorted(key for key in series if key[0] == name)
+            full_name = "gptbro_" + name
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            for key in keys:
+                labels = key[1]
+                if kind != "histogram":
+                    lines.append(f"{full_name}{_format_labels(labels)} {_format_value(series[key])}")
+                    continue
+                values = series[key]
+                cumulative = 0
+                for bound, count in zip([*self.buckets, "+Inf"], values[:-1]):
+                    cumulative += count
+                    le = bound if isinstance(bound, str) else _format_value(bound)
+                    lines.append(f"{full_name}_bucket{_format_labels(labels, [('le', le)])} {cumulative}")
+                lines.append(f"{full_name}_sum{_format_labels(labels)} {_format_value(values[-1])}")
+                lines.append(f"{full_name}_count{_format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def create_metrics():
+    """Build from METRICS_* settings; METRICS_ENABLED=false keeps the calls but records nothing"""
+    return Metrics(
+        directory=os.getenv("METRICS_DIR") or None,
+        flush_interval=float(os.getenv("METRICS_FLUSH_INTERVAL", 5)),
+        enabled=env_flag("METRICS_ENABLED", True),
+    )
@@ -0,0 +1,219 @@
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import google.generativeai as genai
+
+from services.shared_file import read_json, write_json_atomic
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines
+    fcntl = None
+
+DEFAULT_CACHE_PATH = os.path.join(tempfile.gettempdir(), "gptbro_models.json")
+
+
+class ModelRegistry:
+    """Knows which Gemini models are usable, probing them in parallel and sharing the result on disk
+
+    The probe list is written to a small JSON file with a TTL so every gunicorn
+    worker (and the next restart) reuses it instead of probing again. When a
+    probe finds nothing (Gemini or the network is down), requests use
+    `default_model` and discovery is only retried every `retry_interval`
+    seconds, so an outage doesn't add a probe round to every request.
+    """
+
+    def __init__(self, candidates, cache_path=None, ttl=None, probe_timeout=None, model_factory=None,
+                 default_model=None, retry_interval=None):
+        self.candidates = list(candidates)
+        self.default_model = default_model or os.getenv("MODEL_DEFAULT") or self.candidates[0]
+        # model_factory(name) takes over building *and* reusing models when given
+        self.model_factory = model_factory
+        self.cache_path = cache_path or os.getenv("MODEL_CACHE_PATH", DEFAULT_CACHE_PATH)
+        self.ttl = ttl if ttl is not None else float(os.getenv("MODEL_CACHE_TTL", 6 * 60 * 60))
+        self.probe_timeout = probe_timeout if probe_timeout is not None else float(os.getenv("MODEL_PROBE_TIMEOUT", 5))
+        self.retry_interval = (
+            retry_interval if retry_interval is not None else float(os.getenv("MODEL_DISCOVERY_RETRY", 30))
+        )
+        self.is_production = os.getenv("FLASK_ENV") == "production"
+
+        self._lock = threading.Lock()
+        self._available = None
+        self._checked_at = 0.0
+        self._retry_at = 0.0
+        # Set while a thread is discovering; the Event fires when it's done
+        self._discovery = None
+        self._models = {}
+
+    def _log(self, message):
+        if not self.is_production:
+            print(message)
+
+    def _is_fresh(self, checked_at):
+        return time.time() - checked_at < self.ttl
+
+    def _probe(self, model_name):
+        """Check that a model exists and can generate content without spending generation quota"""
+        info = genai.get_model(f"models/{model_name}", request_options={"timeout": self.probe_timeout})
+        if "generateContent" not in info.supported_generation_methods:
+            raise Exception(f"{model_name} does not support generateContent")
+        return model_name
+
+    def probe_all(self):
+        """Probe every candidate concurrently and return the available ones in preference order"""
+        available = set()
+        failures = {}
+
+        pool = ThreadPoolExecutor(max_workers=len(self.candidates) or 1)
+        futures = {pool.submit(self._probe, name): name for name in self.candidates}
+        done, not_done = wait(futures, timeout=self.probe_timeout)
+        # Don't wait on stragglers; the deadline is the whole point
+        pool.shutdown(wait=False)
+
+        for future in done:
+            name = futures[future]
+            try:
+                available.add(future.result())
+                self._log(f"✅ Model available: {name}")
+            except Exception as e:
+                failures[name] = str(e)[:100]
+                self._log(f"❌ Model {name} failed: {failures[name]}")
+        for future in not_done:
+            failures[futures[future]] = "probe timed out"
+
+        return [name for name in self.candidates if name in available], failures
+
+    def _read_cache(self):
+        cached = read_json(self.cache_path)
+        if cached is None:
+            return None
+        if cached.get("candidates") != self.candidates or not cached.get("available"):
+            return None
+        if not self._is_fresh(cached.get("checked_at", 0)):
+            return None
+        return cached
+
+    def _write_cache(self, available, failures, checked_at):
+        payload = {
+            "candidates": self.candidates,
+            "available": available,
+            "unavailable": failures,
+            "checked_at": checked_at,
+        }
+        try:
+            write_json_atomic(self.cache_path, payload)
+        except OSError as e:
+            self._log(f"⚠️ Could not persist model cache: {e}")
+
+    def _discover(self):
+        """Load the shared cache, or probe if it's stale; only one process probes at a time
+
+        Returns the shared cache's contents. Called without self._lock held.
+        """
+        cached = self._read_cache()
+        if cached is None:
+            lock_file = None
+            try:
+                if fcntl is not None:
+                    lock_file = open(f"{self.cache_path}.lock", "w")
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    # Another worker may have finished probing while we waited
+                    cached = self._read_cache()
+                if cached is None:
+                    available, failures = self.probe_all()
+                    checked_at = time.time()
+                    if available:
+                        self._write_cache(available, failures, checked_at)
+                    cached = {"available": available, "checked_at": checked_at}
+            finally:
+                if lock_file is not None:
+                    lock_file.close()
+        return cached
+
+    def available_models(self):
+        """Model names that are currently believed to work, best first; the default model while none are known
+
+        One thread at a time runs discovery, outside the lock, so known_models()
+        (and /health) never wait on the network. Meanwhile other callers get the
+        previous list when there is one, or wait for that thread when there isn't.
+        """
+        with self._lock:
+            if self._available and self._is_fresh(self._checked_at):
+                return list(self._available)
+            if not self._available and time.monotonic() < self._retry_at:
+                return [self.default_model]
+            running = self._discovery
+            if running is None:
+                discovery = self._discovery = threading.Event()
+            elif self._available:
+                return list(self._available)
+        if running is not None:
+            running.wait()
+            with self._lock:
+                return list(self._available) if self._available else [self.default_model]
+
+        try:
+            cached = self._discover()
+        except Exception:
+            with self._lock:
+                self._discovery = None
+            discovery.set()
+            raise
+        with self._lock:
+            self._available = cached["available"]
+            self._checked_at = cached["checked_at"]
+            self._discovery = None
+            if not self._available:
+                self._retry_at = time.monotonic() + self.retry_interval
+                self._log(f"⚠️ No Gemini model found, using {self.default_model}; "
+                          f"trying discovery again in {self.retry_interval:g}s")
+            available = list(self._available) or [self.default_model]
+        discovery.set()
+        return available
+
+    def get_model(self):
+        """Return a GenerativeModel for the best available model"""
+        available = self.available_models()
+        if not available:
+            raise Exception("No working Gemini model found! Please check your API key and internet connection.")
+        return self.model_for(available[0])
+
+    def model_for(self, model_name):
+        """Reuse one GenerativeModel per model name"""
+        if self.model_factory is not None:
+            return self.model_factory(model_name)
+        with self._lock:
+            if model_name not in self._models:
+                self._models[model_name] = genai.GenerativeModel(model_name)  # type: ignore
+            return self._models[model_name]
+
+    def known_models(self):
+        """Last known model list without probing (None while discovery hasn't finished)"""
+        with self._lock:
+            return None if self._available is None else list(self._available)
+
+    def mark_unavailable(self, model_name):
+        """Drop a model that started failing and share that with the other workers"""
+        model_name = model_name.replace("models/", "")
+        with self._lock:
+            if self._available is None or model_name not in self._available:
+                return
+            self._available = [name for name in self._available if name != model_name]
+            self._models.pop(model_name, None)
+            self._write_cache(self._available, {model_name: "marked unavailable"}, self._checked_at)
+        self._log(f"🔄 Model {model_name} marked unavailable")
+
+    def warm_in_background(self):
+        """Resolve the model list off the request path so startup doesn't block on the network"""
+        thread = threading.Thread(target=self._warm, daemon=True)
+        thread.start()
+        return thread
+
+    def _warm(self):
+        try:
+            self.available_models()
+        except Exception as e:
+            self._log(f"⚠️ Background model discovery failed: {e}")
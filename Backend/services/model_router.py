@@ -0,0 +1,185 @@
+import math
+import os
+import threading
+import time
+from collections import deque
+
+from services.retry import error_status, server_retry_delay
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Don't judge a model's error rate on fewer requests than this
+MIN_SAMPLES = 10
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a small sample"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+class ModelHealth:
+    """Rolling latency/error window and circuit breaker for one model"""
+
+    def __init__(self, window):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.trial_in_flight = False
+        self.last_error = None
+
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def snapshot(self):
+        latencies = list(self.latencies)
+        return {
+            "state": self.state,
+            "requests": len(self.outcomes),
+            "error_rate": round(self.error_rate(), 3),
+            "p50_ms": _ms(percentile(latencies, 50)),
+            "p95_ms": _ms(percentile(latencies, 95)),
+            "p99_ms": _ms(percentile(latencies, 99)),
+            "open_for_s": round(max(0.0, self.open_until - time.time()), 1) if self.state == OPEN else 0,
+            "last_error": self.last_error,
+        }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+class ModelRouter:
+    """Routes each request to the best healthy model instead of walking MODEL_OPTIONS in order
+
+    Models keep their registry preference order; a model is skipped while its
+    circuit is open and demoted while its recent error rate is high. After the
+    cooldown one trial request is let through (half-open) to decide whether to
+    close the circuit again.
+    """
+
+    def __init__(self, registry, window=None, failure_threshold=None, error_rate_threshold=None, cooldown=None, rate_limit_cooldown=None):
+        self.registry = registry
+        self.window = window or int(os.getenv("ROUTER_WINDOW", 50))
+        self.failure_threshold = failure_threshold or int(os.getenv("ROUTER_FAILURE_THRESHOLD", 3))
+        self.error_rate_threshold = error_rate_threshold or float(os.getenv("ROUTER_ERROR_RATE_THRESHOLD", 0.5))
+        self.cooldown = cooldown or float(os.getenv("ROUTER_COOLDOWN", 30))
+        self.rate_limit_cooldown = rate_limit_cooldown or float(os.getenv("ROUTER_RATE_LIMIT_COOLDOWN", 60))
+
+        self._lock = threading.Lock()
+        self._health = {}
+
+    def _health_for(self, model_name):
+        if model_name not in self._health:
+            self._health[model_name] = ModelHealth(self.window)
+        return self._health[model_name]
+
+    def _allows_request(self, health, now):
+        if health.state == CLOSED:
+            return True
+        if health.state == OPEN and now >= health.open_until:
+            health.state = HALF_OPEN
+            health.trial_in_flight = False
+        if health.state == HALF_OPEN and not health.trial_in_flight:
+            return True
+        return False
+
+    def _best(self, available, exclude):
+        candidates = [name for name in available if name not in exclude]
+        now = time.time()
+        healthy = []
+        for index, name in enumerate(candidates):
+            health = self._health_for(name)
+            if self._allows_request(health, now):
+                degraded = health.error_rate() >= self.error_rate_threshold
+                healthy.append((degraded, index, name))
+        if not healthy:
+            raise Exception("No healthy Gemini model available right now.")
+        return min(healthy)[2]
+
+    def preferred_model(self, exclude=()):
+        """Name of the model the next request would go to, without reserving a half-open trial"""
+        available = self.registry.available_models()
+        with self._lock:
+            return self._best(available, exclude)
+
+    def choose(self, exclude=()):
+        """Return (model_name, GenerativeModel) for the best model not in `exclude`"""
+        available = self.registry.available_models()
+        with self._lock:
+            model_name = self._best(available, exclude)
+            health = self._health[model_name]
+            if health.state == HALF_OPEN:
+                health.trial_in_flight = True
+        return model_name, self.registry.model_for(model_name)
+
+    def record_success(self, model_name, latency):
+        with self._lock:
+            health = self._health_for(model_name)
+            health.latencies.append(latency)
+            health.outcomes.append(True)
+            health.consecutive_failures = 0
+            health.state = CLOSED
+            health.trial_in_flight = False
+
+    def record_cancelled(self, model_name):
+        """A call we stopped ourselves (client gone, deadline) says nothing about the model's health"""
+        with self._lock:
+            self._health_for(model_name).trial_in_flight = False
+
+    def typical_latency(self, model_name):
+        """Recent p50 latency of a model in seconds, None without samples"""
+        with self._lock:
+            health = self._health.get(model_name)
+            return percentile(list(health.latencies), 50) if health is not None else None
+
+    def record_failure(self, model_name, error):
+        """Count a failed call and open the circuit when the model looks unhealthy"""
+        status = error_status(error)
+        if status == 404:
+            # The model is gone, not just unhealthy
+            self.registry.mark_unavailable(model_name)
+        with self._lock:
+            health = self._health_for(model_name)
+            health.outcomes.append(False)
+            health.consecutive_failures += 1
+            health.trial_in_flight = False
+            health.last_error = str(error)[:100]
+
+            if status == 429:
+                # Stay away for as long as the upstream asked, if it said
+                self._open(health, server_retry_delay(error) or self.rate_limit_cooldown)
+            elif health.state == HALF_OPEN:
+                self._open(health, self.cooldown)
+            elif health.consecutive_failures >= self.failure_threshold:
+                self._open(health, self.cooldown)
+            elif len(health.outcomes) >= MIN_SAMPLES and health.error_rate() >= self.error_rate_threshold:
+                self._open(health, self.cooldown)
+        return status
+
+    def _open(self, health, cooldown):
+        health.state = OPEN
+        health.open_until = time.time() + cooldown
+
+    def snapshot(self):
+        """In-memory view of every model's health; never calls Gemini"""
+        available = self.registry.known_models()
+        with self._lock:
+            models = {name: health.snapshot() for name, health in self._health.items()}
+
+        if available is None:
+            status = "starting"
+        elif not available or all(models.get(name, {}).get("state") == OPEN for name in available):
+            status = "degraded"
+        else:
+            status = "ok"
+        return {"status": status, "available": available, "models": models}
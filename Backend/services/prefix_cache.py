@@ -0,0 +1,149 @@
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+import google.generativeai as genai
+from google.generativeai import caching
+
+from services.settings import env_flag
+from services.shared_file import read_json, write_json_atomic
+
+DEFAULT_STATE_PATH = os.path.join(tempfile.gettempdir(), "gptbro_prefix_cache.json")
+
+
+class PrefixModels:
+    """Hands out GenerativeModels that carry the immutable system prefix
+
+    By default the prefix is simply passed as system_instruction, which keeps
+    it byte-identical across requests so Gemini's implicit prefix caching can
+    kick in. With context caching on, one CachedContent per model is created
+    for the prefix, refreshed before it expires and shared with the other
+    workers through a small state file, so the prefix is billed at the cached
+    rate. Models that can't be cached (e.g. prefix below the minimum size)
+    fall back to the plain system_instruction. One request per model creates
+    or extends its cache; the others carry on with the current cache, or the
+    plain system_instruction, instead of waiting on it.
+    """
+
+    def __init__(self, system_instruction, version, use_context_cache=False, ttl=3600, refresh_margin=300, state_path=None):
+        self.system_instruction = system_instruction
+        self.version = version
+        self.use_context_cache = use_context_cache
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.state_path = state_path or DEFAULT_STATE_PATH
+        self.is_production = os.getenv("FLASK_ENV") == "production"
+
+        self._lock = threading.Lock()
+        self._plain_models = {}
+        self._cached = {}
+        self._uncacheable_until = {}
+        self._in_flight = set()
+        # Every model's entry lives in one state file, so its read-modify-write is serialized
+        self._state_lock = threading.Lock()
+
+    def _log(self, message):
+        if not self.is_production:
+            print(message)
+
+    def _plain(self, model_name):
+        if model_name not in self._plain_models:
+            self._plain_models[model_name] = genai.GenerativeModel(model_name, system_instruction=self.system_instruction)  # type: ignore
+        return self._plain_models[model_name]
+
+    def model_for(self, model_name):
+        with self._lock:
+            if not self.use_context_cache or self._uncacheable_until.get(model_name, 0) > time.time():
+                return self._plain(model_name)
+            now = time.time()
+            entry = self._cached.get(model_name)
+            if entry is not None and entry["expires_at"] - now > self.refresh_margin:
+                return entry["model"]
+            if model_name in self._in_flight:
+                # Another request is creating or extending this cache; use what there is rather than wait
+                return entry["model"] if entry is not None and entry["expires_at"] > now else self._plain(model_name)
+            self._in_flight.add(model_name)
+
+        # Gemini is called outside the lock, so requests for other models (or ones already cached) never wait on it
+        try:
+            entry = self._refreshed_entry(model_name, entry, now)
+        except Exception as e:
+            self._log(f"⚠️ Context cache unavailable for {model_name}, using system_instruction: {str(e)[:100]}")
+            with self._lock:
+                self._in_flight.discard(model_name)
+                self._uncacheable_until[model_name] = time.time() + self.ttl
+                self._cached.pop(model_name, None)
+                return self._plain(model_name)
+        with self._lock:
+            self._in_flight.discard(model_name)
+            self._cached[model_name] = entry
+        return entry["model"]
+
+    def _refreshed_entry(self, model_name, entry, now):
+        """The model's cache entry, extended if it is about to expire, else another worker's or a new one"""
+        if entry is not None and entry["expires_at"] > now:
+            # Extend the existing cache instead of paying to create a new one
+            entry["cached"].update(ttl=timedelta(seconds=self.ttl))
+            self._save_state(model_name, entry["cached"].name, now + self.ttl)
+            return {**entry, "expires_at": now + self.ttl}
+
+        cached = self._load_shared(model_name, now)
+        if cached is None:
+            cached = caching.CachedContent.create(
+                model=f"models/{model_name}",
+                display_name=f"gptbro-{self.version}",
+                system_instruction=self.system_instruction,
+                ttl=timedelta(seconds=self.ttl),
+            )
+            expires_at = now + self.ttl
+            self._save_state(model_name, cached.name, expires_at)
+            self._log(f"✅ Created context cache for {model_name}: {cached.name}")
+        else:
+            expires_at = cached.expire_time.timestamp()
+
+        model = genai.GenerativeModel.from_cached_content(cached)
+        return {"cached": cached, "model": model, "expires_at": expires_at}
+
+    def _load_shared(self, model_name, now):
+        """Reuse a cache another worker already created for this prompt version"""
+        state = (read_json(self.state_path) or {}).get(model_name)
+        if not state or state.get("version") != self.version:
+            return None
+        if state.get("expires_at", 0) - now <= self.refresh_margin:
+            return None
+        try:
+            return caching.CachedContent.get(state["cache_name"])
+        except Exception:
+            return None
+
+    def _save_state(self, model_name, cache_name, expires_at):
+        with self._state_lock:
+            state = read_json(self.state_path) or {}
+            state[model_name] = {"cache_name": cache_name, "expires_at": expires_at, "version": self.version}
+            try:
+                write_json_atomic(self.state_path, state)
+            except OSError as e:
+                self._log(f"⚠️ Could not persist context cache state: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "context_cache": self.use_context_cache,
+                "version": self.version,
+                "cached_models": {
+                    name: round(entry["expires_at"] - time.time()) for name, entry in self._cached.items()
+                },
+            }
+
+
+def create_prefix_models(system_instruction, version):
+    """Build from PROMPT_CONTEXT_CACHE* settings"""
+    return PrefixModels(
+        system_instruction,
+        version,
+        use_context_cache=env_flag("PROMPT_CONTEXT_CACHE", False),
+        ttl=float(os.getenv("PROMPT_CONTEXT_CACHE_TTL", 60 * 60)),
+        state_path=os.getenv("PROMPT_CONTEXT_CACHE_PATH"),
+    )
@@ -0,0 +1,189 @@
+import json
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from services.response_cache import is_time_sensitive, normalize_text
+from services.transcripts import default_path, read_transcripts
+
+
+def load_curated(path):
+    """Questions from a curated list: a JSON list of strings, or a text file with one per line (# starts a comment)"""
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".json"):
+            return [str(question).strip() for question in json.load(f) if str(question).strip()]
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+
+def top_questions(entries, limit, prompt_version=None):
+    """The `limit` most frequent opening questions in logged entries, most frequent first
+
+    Returns (question, answer) pairs. Questions that only differ in case and
+    spacing count as one, under their most common phrasing. `answer` is the
+    latest logged (reply, model) made under `prompt_version`, or None when
+    there is none to reuse. Time-sensitive questions are left out since they
+    are never served from the cache.
+    """
+    counts = Counter()
+    phrasings = {}
+    answers = {}
+    for entry in entries:
+        messages = entry.get("messages")
+        if not isinstance(messages, list) or len(messages) != 1 or messages[0].get("sender") != "user":
+            continue
+        text = str(messages[0].get("text", "")).strip()
+        if not text or is_time_sensitive(messages):
+            continue
+        key = normalize_text(text)
+        counts[key] += 1
+        phrasings.setdefault(key, Counter())[text] += 1
+        if prompt_version is not None and entry.get("prompt_version") == prompt_version and entry.get("reply"):
+            answers[key] = (entry["reply"], entry.get("model"))
+    return [(phrasings[key].most_common(1)[0][0], answers.get(key)) for key, _ in counts.most_common(limit)]
+
+
+class CacheWarmer:
+    """Fills the reply caches with answers to the questions visitors ask most, before traffic arrives
+
+    The questions are the curated list at `questions_path` followed by the
+    `top` most frequent opening questions in the transcripts at
+    `transcripts_path`. `warm(question, answer)` fills the caches for one
+    question and says how: "cached", "loaded" (a reply logged under the
+    current prompt version, no Gemini call), "generated", "skipped" or
+    "failed". Questions without a logged answer may call Gemini, so they
+    start at most `rate` per second, `concurrency` at a time. Nothing new
+    starts once `budget` seconds have passed, and warming() turns false then
+    even if calls are still finishing, so a deploy never waits longer.
+    """
+
+    def __init__(self, warm, prompt_version, questions_path=None, transcripts_path=None, top=50,
+                 rate=2.0, concurrency=2, budget=60.0):
+        self.warm = warm
+        self.prompt_version = prompt_version
+        self.questions_path = questions_path
+        self.transcripts_path = transcripts_path
+        self.top = top
+        self.rate = rate
+        self.concurrency = concurrency
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+        self.state = "idle"
+        self.started = None
+        self.finished = None
+        self.total = 0
+        self.outcomes = Counter()
+
+    def questions(self):
+        """The (question, answer) pairs to warm, curated ones first, without repeats or time-sensitive questions"""
+        pairs = []
+        if self.questions_path:
+            try:
+                pairs += [(question, None) for question in load_curated(self.questions_path)]
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Prewarm: can't read {self.questions_path}: {e}")
+        if self.transcripts_path and self.top > 0 and os.path.exists(self.transcripts_path):
+            try:
+                pairs += top_questions(read_transcripts(self.transcripts_path), self.top, self.prompt_version)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Prewarm: can't read transcripts at {self.transcripts_path}: {e}")
+        seen = set()
+        unique = []
+        for question, answer in pairs:
+            key = normalize_text(question)
+            # Never served from the cache, so not worth a call
+            if is_time_sensitive([{"sender": "user", "text": question}]):
+                continue
+            if key not in seen:
+                seen.add(key)
+                unique.append((question, answer))
+        return unique
+
+    def warming(self):
+        """True while warming and within the budget; /health reports unhealthy meanwhile"""
+        return self.state == "warming" and time.monotonic() - self.started < self.budget
+
+    def _wait_turn(self, deadline):
+        """Sleep until this call may start under the rate limit; False if that's past the deadline"""
+        with self._lock:
+            now = time.monotonic()
+            start_at = max(now, self._next_at)
+            self._next_at = start_at + 1 / self.rate if self.rate > 0 else start_at
+        if start_at >= deadline:
+            return False
+        time.sleep(start_at - now)
+        return True
+
+    def _warm_one(self, question, answer, deadline):
+        if time.monotonic() >= deadline or (answer is None and not self._wait_turn(deadline)):
+            outcome = "over_budget"
+        else:
+            try:
+                outcome = self.warm(question, answer)
+            except Exception as e:
+                print(f"⚠️ Prewarm failed for {question[:60]!r}: {str(e)[:200]}")
+                outcome = "failed"
+        with self._lock:
+            self.outcomes[outcome] += 1
+
+    def run(self):
+        """Warm every question (blocking) and return stats()"""
+        self.state = "warming"
+        self.started = time.monotonic()
+        deadline = self.started + self.budget
+        pairs = self.questions()
+        self.total = len(pairs)
+        with ThreadPoolExecutor(max(1, self.concurrency), thread_name_prefix="prewarm") as pool:
+            for question, answer in pairs:
+                pool.submit(self._warm_one, question, answer, deadline)
+        self.finished = time.monotonic()
+        self.state = "done"
+        stats = self.stats()
+        print(f"🔥 Cache prewarmed in {stats['elapsed_s']}s: {dict(self.outcomes)}")
+        return stats
+
+    def start_in_background(self):
+        """Start run() in a thread so the worker can accept /health checks while it warms"""
+        self.state = "warming"
+        self.started = time.monotonic()
+        thread = threading.Thread(target=self.run, name="prewarm", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        with self._lock:
+            end = self.finished if self.finished is not None else time.monotonic()
+            return {
+                "state": self.state,
+                "questions": self.total,
+                "elapsed_s": round(end - self.started, 1) if self.started is not None else None,
+                "budget_s": self.budget,
+                **self.outcomes,
+            }
+
+
+def create_cache_warmer(warm, prompt_version):
+    """Build from PREWARM_* settings; returns None when there is nothing to warm
+
+    The transcripts default to the app's own (TRANSCRIPT_BACKEND/TRANSCRIPT_PATH).
+    """
+    questions_path = os.getenv("PREWARM_QUESTIONS") or None
+    top = int(os.getenv("PREWARM_TOP", 0))
+    transcripts_path = os.getenv("PREWARM_TRANSCRIPTS") or None
+    backend = os.getenv("TRANSCRIPT_BACKEND", "off").lower()
+    if transcripts_path is None and backend in ("jsonl", "sqlite"):
+        transcripts_path = os.getenv("TRANSCRIPT_PATH") or default_path(backend)
+    if questions_path is None and not (top > 0 and transcripts_path):
+        return None
+    return CacheWarmer(
+        warm,
+        prompt_version,
+        questions_path=questions_path,
+        transcripts_path=transcripts_path,
+        top=top,
+        rate=float(os.getenv("PREWARM_RATE", 2)),
+        concurrency=int(os.getenv("PREWARM_CONCURRENCY", 2)),
+        budget=float(os.getenv("PREWARM_BUDGET", 60)),
+    )
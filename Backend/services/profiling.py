@@ -0,0 +1,314 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from services.shared_file import read_json, write_json_atomic
+
+# The trace of the request this thread or task is serving, if any
+_current = ContextVar("gptbro_request_trace", default=None)
+
+
+def default_directory():
+    # Per parent process, so the workers of one gunicorn master share it
+    return os.path.join(tempfile.gettempdir(), f"gptbro_profiles_{os.getppid()}")
+
+
+def prune(directory, prefix, capacity):
+    """Keep only the `capacity` newest files starting with `prefix`; the directory is the ring buffer"""
+    paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.startswith(prefix)]
+    if len(paths) <= capacity:
+        return
+    paths.sort(key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0)
+    for path in paths[:len(paths) - capacity]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def frame_label(code):
+    filename = code.co_filename
+    marker = "site-packages" + os.sep
+    filename = filename.split(marker, 1)[1] if marker in filename else os.path.basename(filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def fold(frame):
+    """A frame's stack, outermost first, as `a;b;c`"""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class SamplingProfiler:
+    """Samples every thread's stack for a window of time, on request of an admin
+
+    open_window() records the window in `<directory>/window.json`; every
+    worker picks it up on its next request through poll() (checked at most
+    once a second) and samples its own threads every `interval` seconds
+    until the window ends. Each worker then writes its stacks, with their
+    sample counts, to `profile-<window>-<pid>.folded`, the format flamegraph.pl,
+    speedscope and inferno read. The newest `capacity` files are kept.
+    """
+
+    def __init__(self, directory=None, capacity=20, max_seconds=300.0, min_interval=0.001):
+        self.directory = directory
+        self.capacity = capacity
+        self.max_seconds = max_seconds
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._window = None
+
+    def _directory(self):
+        if self.directory is None:
+            self.directory = default_directory()
+        os.makedirs(self.directory, exist_ok=True)
+        return self.directory
+
+    def open_window(self, seconds, interval=0.01):
+        """Start profiling every worker for `seconds`; returns the window"""
+        window = {
+            "id": time.strftime("%Y%m%d-%H%M%S"),
+            "until": time.time() + min(max(seconds, 1.0), self.max_seconds),
+            "interval": max(interval, self.min_interval),
+        }
+        write_json_atomic(os.path.join(self._directory(), "window.json"), window)
+        self._checked_at = 0.0
+        self.poll()
+        return window
+
+    def poll(self):
+        """Start sampling in this worker if a window is open; cheap enough to call on every request"""
+        now = time.monotonic()
+        if now - self._checked_at < 1.0:
+            return
+        self._checked_at = now
+        window = read_json(os.path.join(self._directory(), "window.json"))
+        if window is None or window["until"] <= time.time():
+            return
+        with self._lock:
+            if self._window is not None and self._window["id"] == window["id"]:
+                return
+            self._window = window
+        threading.Thread(target=self._sample, args=(window,), name="profiler", daemon=True).start()
+
+    def active(self):
+        window = read_json(os.path.join(self._directory(), "window.json"))
+        if window is None or window["until"] <= time.time():
+            return None
+        return window
+
+    def _sample(self, window):
+        own = threading.get_ident()
+        stacks = Counter()
+        while time.time() < window["until"]:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    stacks[f"{names.get(ident, ident)};{fold(frame)}"] += 1
+            time.sleep(window["interval"])
+        directory = self._directory()
+        path = os.path.join(directory, f"profile-{window['id']}-{os.getpid()}.folded")
+        with open(path, "w") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in stacks.most_common())
+        prune(directory, "profile-", self.capacity)
+
+    def windows(self):
+        """Finished windows that have profiles, newest first, with the workers that wrote them"""
+        found = {}
+        for name in os.listdir(self._directory()):
+            if name.startswith("profile-") and name.endswith(".folded"):
+                window, _, pid = name[len("profile-"):-len(".folded")].rpartition("-")
+                found.setdefault(window, []).append(int(pid))
+        return [{"id": window, "workers": sorted(pids)} for window, pids in sorted(found.items(), reverse=True)]
+
+    def folded(self, window_id):
+        """All workers' stacks for one window, merged; None if there are none"""
+        stacks = Counter()
+        directory = self._directory()
+        for name in os.listdir(directory):
+            if name.startswith(f"profile-{window_id}-") and name.endswith(".folded"):
+                with open(os.path.join(directory, name)) as f:
+                    for line in f:
+                        stack, _, count = line.rstrip("\n").rpartition(" ")
+                        if stack:
+                            stacks[stack] += int(count)
+        if not stacks:
+            return None
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class RequestTrace:
+    """The timeline of one request: its stages, upstream attempts and retries, relative to its start"""
+
+    def __init__(self, method, route):
+        self.method = method
+        self.route = route
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.events = []
+        self.details = {}
+        self.token = None
+
+    def offset(self, at=None):
+        return round(((at if at is not None else time.perf_counter()) - self.started) * 1000, 1)
+
+
+class SlowRequestLog:
+    """Keeps the full timeline of every request slower than `threshold` seconds
+
+    begin() and end() bracket a request; a threshold of 0 traces nothing.
+    The stage, attempt and retry hooks record into the request's trace
+    through a context variable and do nothing outside a traced request. A
+    request that took `threshold` seconds or more is written to
+    `<directory>/slow-<id>.json` when it ends. The newest `capacity`
+    captures are kept, shared by all workers.
+    """
+
+    def __init__(self, threshold=10.0, capacity=100, directory=None):
+        self.threshold = threshold
+        self.capacity = capacity
+        self.directory = directory
+        self._lock = threading.Lock()
+        self.traced = 0
+        self.captured = 0
+
+    def _directory(self):
+        if self.directory is None:
+            self.directory = default_directory()
+        os.makedirs(self.directory, exist_ok=True)
+        return self.directory
+
+    def begin(self, method, route):
+        """Start tracing the current request; pass the returned trace to end()"""
+        if self.threshold <= 0:
+            return None
+        trace = RequestTrace(method, route)
+        trace.token = _current.set(trace)
+        return trace
+
+    def record_stage(self, name, started, elapsed):
+        trace = _current.get()
+        if trace is not None:
+            trace.events.append({"at_ms": trace.offset(started), "stage": name, "ms": round(elapsed * 1000, 1)})
+
+    def record_attempt(self, model_name, outcome, started, elapsed, error=None):
+        trace = _current.get()
+        if trace is not None:
+            event = {"at_ms": trace.offset(started), "stage": "upstream", "ms": round(elapsed * 1000, 1),
+                     "model": model_name, "outcome": outcome}
+            if error is not None:
+                event["error"] = str(error)[:200]
+            trace.events.append(event)
+
+    def record_retry(self, delay, fallback):
+        trace = _current.get()
+        if trace is not None:
+            trace.events.append({"at_ms": trace.offset(), "stage": "retry_backoff", "ms": round(delay * 1000, 1),
+                                 "fallback": fallback})
+
+    def annotate(self, **details):
+        """Attach request details (cache status, message count, ...) to the current trace"""
+        trace = _current.get()
+        if trace is not None:
+            trace.details.update(details)
+
+    def end(self, trace, status):
+        """Finish a trace; returns the capture if the request was slow"""
+        if trace is None:
+            return None
+        try:
+            _current.reset(trace.token)
+        except ValueError:
+            # Ended from another context, e.g. once a stream has been sent
+            pass
+        total = time.perf_counter() - trace.started
+        with self._lock:
+            self.traced += 1
+        if total < self.threshold:
+            return None
+        capture_id = f"{int(trace.started_at * 1000)}-{os.getpid()}"
+        capture = {
+            "id": capture_id,
+            "method": trace.method,
+            "route": trace.route,
+            "status": status,
+            "started_at": trace.started_at,
+            "total_ms": round(total * 1000, 1),
+            "pid": os.getpid(),
+            "details": trace.details,
+            "timeline": sorted(trace.events, key=lambda event: event["at_ms"]),
+        }
+        directory = self._directory()
+        try:
+            write_json_atomic(os.path.join(directory, f"slow-{capture_id}.json"), capture)
+            prune(directory, "slow-", self.capacity)
+        except OSError:
+            return None
+        with self._lock:
+            self.captured += 1
+        return capture
+
+    def captures(self):
+        """Summaries of the kept captures, newest first"""
+        summaries = []
+        directory = self._directory()
+        for name in os.listdir(directory):
+            if name.startswith("slow-") and name.endswith(".json"):
+                capture = read_json(os.path.join(directory, name))
+                if capture is not None:
+                    summaries.append({key: capture[key] for key in ("id", "method", "route", "status", "started_at",
+                                                                      "total_ms")})
+        return sorted(summaries, key=lambda summary: summary["started_at"], reverse=True)
+
+    def get(self, capture_id):
+        if not capture_id.replace("-", "").isdigit():
+            return None
+        return read_json(os.path.join(self._directory(), f"slow-{capture_id}.json"))
+
+    def stats(self):
+        with self._lock:
+            return {"threshold_s": self.threshold, "traced": self.traced, "captured": self.captured}
+
+
+def folded_timeline(capture):
+    """A slow-request capture as folded stacks weighted in milliseconds, for a flame graph of where its time went"""
+    root = f"{capture['method']} {capture['route']}"
+    lines = Counter()
+    accounted = 0.0
+    for event in capture["timeline"]:
+        frames = [root, event["stage"]]
+        if event.get("model"):
+            frames += [event["model"], event["outcome"]]
+        lines[";".join(frames)] += event["ms"]
+        accounted += event["ms"]
+    # Time no stage accounts for: routing, middleware, streaming to the client
+    rest = capture["total_ms"] - accounted
+    if rest > 0:
+        lines[f"{root};other"] += rest
+    return "".join(f"{stack} {max(1, round(ms))}\n" for stack, ms in lines.items())
+
+
+def create_profiler():
+    """Build from PROFILE_* settings"""
+    return SamplingProfiler(
+        directory=os.getenv("PROFILE_DIR") or None,
+        capacity=int(os.getenv("PROFILE_CAPACITY", 20)),
+        max_seconds=float(os.getenv("PROFILE_MAX_SECONDS", 300)),
+    )
+
+
+def create_slow_request_log():
+    """Build from SLOW_REQUEST_* settings; SLOW_REQUEST_THRESHOLD=0 turns capture off"""
+    return SlowRequestLog(
+        threshold=float(os.getenv("SLOW_REQUEST_THRESHOLD", 10)),
+        capacity=int(os.getenv("SLOW_REQUEST_CAPACITY", 100)),
+        directory=os.getenv("PROFILE_DIR") or None,
+    )
@@ -0,0 +1,134 @@
+import hashlib
+from datetime import datetime
+
+# Usman Ghani's CV Knowledge Base
+CV_KNOWLEDGE = """
+ABOUT USMAN GHANI (The Creator):
+Usman Ghani is a versatile Backend Developer, Machine Learning Engineer, and Full-Stack Developer from Islamabad, Pakistan.
+
+CONTACT:
+Email: iamusmanbro@gmail.com
+Phone: +92 321 6593094
+LinkedIn: linkedin.com/in/iamusmanbro
+GitHub: github.com/thisisusmanghani
+Portfolio: usmanghani.dev
+
+PROFESSIONAL SUMMARY:
+Usman is a versatile software developer with expertise in backend systems, machine learning, and full-stack development. He has a proven track record of delivering production-ready applications for international clients across Germany, Bangladesh, and Pakistan. He specializes in rapid prototyping and AI-assisted development, with experience in mobile app publishing (Play Store and App Store), payment gateway integration, and cloud deployment.
+
+WORK EXPERIENCE:
+1. Project Manager/Team Lead at Richi Billings (2024-Present)
+2. Software Developer at Anylead (2023-2024)
+3. Freelance Developer for International Clients (2022-Present)
+
+KEY PROJECTS:
+CrowdWave: Flutter mobile app for crowd-sourced logistics (Germany client, on App Store and Play Store)
+CodeBypass: Temporary phone numbers platform (Bangladesh client)
+FindMyUni: University data scraper with AI chatbot (Azure deployed)
+Restaurant QR Ordering System
+GreenMan Products: Construction machinery e-commerce
+
+TECHNICAL SKILLS:
+Languages: Python, JavaScript/TypeScript, SQL, Dart, HTML/CSS
+Frameworks: React, Next.js, Node.js, Express.js, Flutter, FastAPI, TailwindCSS
+Databases: MongoDB, Firebase, PostgreSQL, MySQL
+AI/ML: Scikit-learn, Pandas, NumPy, Beautiful Soup, Selenium, LangChain
+DevOps: Docker, Azure, Vercel, Netlify, Heroku
+Tools: Stripe, Cryptomus, REST APIs, GitHub Copilot
+
+EDUCATION:
+Bachelor of Science in Information Technology from Quaid-i-Azam University, Islamabad (Nov 2021 - June 2025)
+CGPA: 3.0/4.0
+
+CERTIFICATIONS:
+Supervised Machine Learning (DeepLearning.AI/Stanford)
+AI For Everyone (DeepLearning.AI)
+Introduction to Docker (Google Cloud)
+Data Analysis with Spreadsheets and SQL (Meta)
+And more from Coursera
+
+DEVELOPMENT PHILOSOPHY:
+Usman specializes in "vibe coding" which means leveraging AI tools like GitHub Copilot to rapidly prototype, iterate, and deliver high-quality solutions.
+
+ACHIEVEMENTS:
+Published Flutter app on iOS App Store and Google Play Store
+Integrated multiple payment gateways (Stripe, Cryptomus)
+Managed international clients across 3 plus countries
+Deployed 10 plus production applications
+
+AVAILABILITY:
+Open to full-time remote positions, contract work, or freelance projects worldwide or in Islamabad/Kashmir, Pakistan.
+
+LANGUAGES: English (Professional), Urdu (Native)
+"""
+
+# Who Usman is and how to reach him; always in the prompt, even when the rest of the CV is retrieved
+CORE_PROFILE = CV_KNOWLEDGE.split("WORK EXPERIENCE:")[0].strip()
+
+# Persona and CV, sent as the model's system_instruction. It is built once per process and
+# never contains per-request data, so Gemini can serve it from its prompt/context cache.
+SYSTEM_INSTRUCTION_TEMPLATE = """IMPORTANT CONTEXT - You have knowledge about your creator Usman Ghani (Ghani bhai):
+
+{cv_knowledge}
+
+When asked about dates, time, current events, or "today", always use the CURRENT DATE & TIME from the context note attached to the latest message. When asked about Usman, Ghani bhai, your creator, or questions related to his experience, projects, skills, or background, use this knowledge confidently. Speak about him with pride and in your signature dramatic style!
+"""
+
+# Volatile per-request context, attached after the latest user message so everything before it stays byte-identical
+CONTEXT_NOTE_TEMPLATE = "[Context note - CURRENT DATE & TIME: {current_datetime}{excerpts}]"
+
+SUMMARY_NOTE_TEMPLATE = "[Summary of the earlier conversation: {summary}]"
+
+# How the notes above start, so later stages can tell them apart from the visitor's own text
+NOTE_PREFIXES = ("[Context note", "[Summary of the earlier conversation")
+
+def build_system_instruction(retriever=None):
+    """The immutable prompt prefix: persona plus the CV material that is the same for every request"""
+    return SYSTEM_INSTRUCTION_TEMPLATE.format(cv_knowledge=CORE_PROFILE if retriever is not None else CV_KNOWLEDGE)
+
+def prompt_version(system_instruction, retriever=None):
+    """Changes whenever the persona or CV changes, so cached replies from an older prompt are never served"""
+    material = system_instruction + CONTEXT_NOTE_TEMPLATE
+    if retriever is not None:
+        material += retriever.version
+    return hashlib.sha256(material.encode()).hexdigest()[:12]
+
+def context_note(messages, retriever=None):
+    """Current date/time plus the CV excerpts retrieved for this question"""
+    current_datetime = datetime.now().strftime("%A, %B %d, %Y at %I:%M %p")
+    excerpts = retriever.context_for(messages) if retriever is not None else ""
+    if excerpts:
+        excerpts = f"\n\nRELEVANT CV EXCERPTS:\n{excerpts}"
+    return CONTEXT_NOTE_TEMPLATE.format(current_datetime=current_datetime, excerpts=excerpts)
+
+def build_contents(messages, retriever=None, summary=None):
+    """Turn the client's message list into Gemini contents; the persona and CV travel in system_instruction
+
+    `summary` stands in for older turns that were compacted away and goes in front of the first remaining message.
+    """
+    contents = []
+    
+    for msg in messages:
+        role = "user" if msg.get("sender") == "user" else "model"
+        text = msg.get("text", "")
+
+        # Strictly filter out unsupported roles
+        if role not in ["user", "model"]:
+            continue  # Skip system or invalid roles
+
+        contents.append({"role": role, "parts": [{"text": text}]})
+
+    if summary:
+        summary_part = {"text": SUMMARY_NOTE_TEMPLATE.format(summary=summary)}
+        if contents and contents[0]["role"] == "user":
+            contents[0]["parts"].insert(0, summary_part)
+        else:
+            contents.insert(0, {"role": "user", "parts": [summary_part]})
+
+    note = {"text": context_note(messages, retriever)}
+    if contents and contents[-1]["role"] == "user":
+        contents[-1]["parts"].append(note)
+    else:
+        contents.append({"role": "user", "parts": [note]})
+
+    return contents
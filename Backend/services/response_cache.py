@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from services.shared_file import thread_connection
+
+# The system prompt embeds the current date/time, so questions about it must never be served from cache
+TIME_SENSITIVE = re.compile(
+    r"\b(time|date|today|tonight|tomorrow|yesterday|now|current|currently|latest|news|day|week|month|year|clock)\b",
+    re.IGNORECASE,
+)
+
+
+def normalize_text(text):
+    """Lowercase and collapse whitespace so trivial differences share one cache entry"""
+    return " ".join(str(text).lower().split())
+
+
+def is_time_sensitive(messages):
+    """True when the latest user message asks about dates, time or current events"""
+    for msg in reversed(messages):
+        if msg.get("sender") == "user":
+            return bool(TIME_SENSITIVE.search(str(msg.get("text", ""))))
+    return False
+
+
+def bypass_requested(messages, headers):
+    """Client opt-out header or a time-sensitive question skip every cache"""
+    if headers.get("X-Cache-Bypass") or "no-cache" in headers.get("Cache-Control", ""):
+        return True
+    return is_time_sensitive(messages)
+
+
+class MemoryBackend:
+    """Per-process LRU dict"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class SQLiteBackend:
+    """SQLite file shared by every gunicorn worker on the machine"""
+
+    def __init__(self, max_entries, path, table="response_cache"):
+        self.max_entries = max_entries
+        self.path = path
+        self.table = table
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, last_access REAL NOT NULL)"
+        )
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_lru ON {self.table} (last_access)")
+        conn.commit()
+
+    def _conn(self):
+        return thread_connection(self._local, self.path)
+
+    def get(self, key):
+        conn = self._conn()
+        row = conn.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute(f"UPDATE {self.table} SET last_access = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def set(self, key, entry):
+        conn = self._conn()
+        conn.execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, value, last_access) VALUES (?, ?, ?)",
+            (key, json.dumps(entry), time.time()),
+        )
+        conn.execute(
+            f"DELETE FROM {self.table} WHERE key IN ("
+            f"SELECT key FROM {self.table} ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def delete(self, key):
+        self._conn().execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def __len__(self):
+        return self._conn().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+
+class ResponseCache:
+    """Exact-match reply cache keyed on the normalized conversation and prompt version
+
+    The model isn't part of the key: which model answers depends on the
+    router's breaker state and on fallbacks, and every model gets the same
+    prompt. Entries record the model that produced them.
+    """
+
+    def __init__(self, backend, ttl, prompt_version):
+        self.backend = backend
+        self.ttl = ttl
+        self.prompt_version = prompt_version
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+
+    def key(self, messages):
+        normalized = [
+            [msg.get("sender") == "user", normalize_text(msg.get("text", ""))]
+            for msg in messages
+        ]
+        # The day is part of the key because the system prompt carries today's date
+        payload = json.dumps([self.prompt_version, datetime.now().strftime("%Y-%m-%d"), normalized])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def should_bypass(self, messages, headers):
+        if bypass_requested(messages, headers):
+            self._count("bypasses")
+            return True
+        return False
+
+    def get(self, key):
+        entry = self.backend.get(key)
+        if entry is not None and time.time() - entry["created_at"] > self.ttl:
+            self.backend.delete(key)
+            entry = None
+        self._count("hits" if entry is not None else "misses")
+        return entry
+
+    def contains(self, key):
+        """Whether a fresh entry exists, without counting a hit or miss"""
+        entry = self.backend.get(key)
+        return entry is not None and time.time() - entry["created_at"] <= self.ttl
+
+    def set(self, key, reply, model_name):
+        if reply:
+            self.backend.set(key, {"reply": reply, "model": model_name, "created_at": time.time()})
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": type(self.backend).__name__,
+                "entries": len(self.backend),
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypasses": self.bypasses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+def create_response_cache(prompt_version):
+    """Build the cache from RESPONSE_CACHE_* settings; returns None when disabled"""
+    kind = os.getenv("RESPONSE_CACHE_BACKEND", "memory").lower()
+    if kind in ("off", "none", ""):
+        return None
+    max_entries = int(os.getenv("RESPONSE_CACHE_SIZE", 1000))
+    ttl = float(os.getenv("RESPONSE_CACHE_TTL", 60 * 60))
+    if kind == "sqlite":
+        path = os.getenv("RESPONSE_CACHE_PATH", os.path.join(tempfile.gettempdir(), "gptbro_responses.sqlite3"))
+        backend = SQLiteBackend(max_entries, path)
+    else:
+        backend = MemoryBackend(max_entries)
+    return ResponseCache(backend, ttl, prompt_version)
@@ -0,0 +1,178 @@
+import glob
+import hashlib
+import math
+import os
+import re
+from collections import Counter
+
+from services.settings import env_flag
+from services.tokens import estimate_tokens
+
+TOKEN = re.compile(r"[a-z0-9]+")
+HEADING = re.compile(r"^(#{1,3})\s+(.*)$")
+
+STOPWORDS = frozenset("""
+a an the is are was were be been am do does did can could would should will
+i me my you your he him his she her it its we our they their them this that
+what which who whom how about tell please bro of to in on at for with from by
+as and or but if so any some has have had
+usman usmans ghani bhai
+""".split())
+
+# Sections longer than this are split on blank lines so one chunk never swamps the budget
+MAX_CHUNK_CHARS = 1200
+
+
+def tokenize(text):
+    return [t for t in TOKEN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def _clean_heading(text):
+    # Drop emoji and markdown decoration from headings like "## 🚀 KEY PROJECTS"
+    return re.sub(r"[^\w\s|&/().,+-]", "", text).strip()
+
+
+def chunk_markdown(text, source):
+    """Split a CV markdown file into heading-scoped chunks
+
+    Each chunk carries its heading path ("Backend Developer CV > KEY PROJECTS > CodeBypass | ...")
+    so it still makes sense on its own inside the prompt. The top-level name
+    heading is replaced by the CV's role, taken from the file name.
+    """
+    cv_name = re.sub(r"^Usman_Ghani_CV_", "", os.path.splitext(source)[0]).replace("_", " ") + " CV"
+    chunks = []
+    path = []
+    lines = []
+
+    def flush():
+        body = "\n".join(lines).strip().strip("-").strip()
+        if not body:
+            return
+        title = " > ".join([cv_name] + path[1:])
+        paragraphs = re.split(r"\n\s*\n", body) if len(body) > MAX_CHUNK_CHARS else [body]
+        part = []
+        for paragraph in paragraphs:
+            if part and len("\n\n".join(part + [paragraph])) > MAX_CHUNK_CHARS:
+                chunks.append({"source": source, "title": title, "text": "\n\n".join(part)})
+                part = []
+            part.append(paragraph)
+        if part:
+            chunks.append({"source": source, "title": title, "text": "\n\n".join(part)})
+
+    for line in text.splitlines():
+        match = HEADING.match(line)
+        if match:
+            flush()
+            lines = []
+            level = len(match.group(1))
+            path = path[:level - 1] + [_clean_heading(match.group(2))]
+            continue
+        lines.append(line)
+    flush()
+    return chunks
+
+
+class BM25Index:
+    """Okapi BM25 over CV chunks; small enough to build at startup in a few milliseconds"""
+
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        # Headings are indexed with the body so "projects" finds project sections
+        self.doc_terms = [Counter(tokenize(c["title"] + " " + c["text"])) for c in chunks]
+        doc_lengths = [sum(terms.values()) for terms in self.doc_terms]
+        avg_length = sum(doc_lengths) / len(doc_lengths) if chunks else 0.0
+        self.length_norms = [k1 * (1 - b + b * length / avg_length) for length in doc_lengths]
+        document_frequency = Counter(term for terms in self.doc_terms for term in terms)
+        n = len(chunks)
+        self.idf = {
+            term: math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for term, df in document_frequency.items()
+        }
+
+    def search(self, query, k):
+        """Return up to k (score, chunk index) pairs with a positive score, best first"""
+        terms = [t for t in set(tokenize(query)) if t in self.idf]
+        if not terms:
+            return []
+        scored = []
+        for index, doc in enumerate(self.doc_terms):
+            length_norm = self.length_norms[index]
+            score = 0.0
+            for term in terms:
+                tf = doc.get(term)
+                if tf:
+                    score += self.idf[term] * tf * (self.k1 + 1) / (tf + length_norm)
+            if score > 0:
+                scored.append((score, index))
+        scored.sort(reverse=True)
+        return scored[:k]
+
+
+class CVRetriever:
+    """Picks the CV chunks relevant to the current question within a token budget"""
+
+    def __init__(self, chunks, top_k=4, token_budget=350):
+        self.index = BM25Index(chunks)
+        self.chunk_words = [set(tokenize(c["text"])) for c in chunks]
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.version = hashlib.sha256(
+            "".join(c["title"] + c["text"] for c in chunks).encode()
+        ).hexdigest()[:12]
+
+    @classmethod
+    def from_directory(cls, cv_dir, **kwargs):
+        chunks = []
+        for path in sorted(glob.glob(os.path.join(cv_dir, "*.md"))):
+            with open(path, encoding="utf-8") as f:
+                chunks.extend(chunk_markdown(f.read(), os.path.basename(path)))
+        return cls(chunks, **kwargs)
+
+    def __len__(self):
+        return len(self.index.chunks)
+
+    def query_for(self, messages):
+        """The latest user question, plus the one before it so follow-ups ("tell me more") keep their topic"""
+        user_texts = [str(m.get("text", "")) for m in messages if m.get("sender") == "user"]
+        return " ".join(user_texts[-2:])
+
+    def retrieve(self, query):
+        """Top chunks for a query, skipping near-duplicates, until the token budget is used up"""
+        selected = []
+        seen = []
+        used = 0
+        # Ask for extra candidates since the four CVs repeat many sections
+        for _, index in self.index.search(query, self.top_k * 3):
+            chunk = self.index.chunks[index]
+            words = self.chunk_words[index]
+            if any(len(words & other) / max(1, len(words | other)) > 0.6 for other in seen):
+                continue
+            cost = estimate_tokens(chunk["text"]) + estimate_tokens(chunk["title"])
+            if used + cost > self.token_budget:
+                continue
+            selected.append(chunk)
+            seen.append(words)
+            used += cost
+            if len(selected) >= self.top_k:
+                break
+        return selected
+
+    def context_for(self, messages):
+        """Relevant CV excerpts formatted for the system prompt ("" when nothing matches)"""
+        chunks = self.retrieve(self.query_for(messages))
+        return "\n\n".join(f"[{c['title']}]\n{c['text']}" for c in chunks)
+
+
+def create_retriever(default_cv_dir):
+    """Build the CV index from RETRIEVAL_* settings; returns None when disabled or no CVs are found"""
+    if not env_flag("RETRIEVAL_ENABLED", True):
+        return None
+    cv_dir = os.getenv("CV_DIR", default_cv_dir)
+    retriever = CVRetriever.from_directory(
+        cv_dir,
+        top_k=int(os.getenv("RETRIEVAL_TOP_K", 4)),
+        token_budget=int(os.getenv("RETRIEVAL_TOKEN_BUDGET", 350)),
+    )
+    return retriever if len(retriever) else None
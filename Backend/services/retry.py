@@ -0,0 +1,208 @@
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+
+# Standard library only: the Vercel handlers import this module too
+
+# Transient upstream trouble: the same model may succeed after a backoff
+RETRYABLE = "retryable"
+# This model can't serve the request right now (quota, gone): another model might
+FALLBACK = "fallback"
+# The request itself is at fault (bad argument, bad key): no attempt will succeed
+FATAL = "fatal"
+
+RETRYABLE_STATUSES = {408, 500, 502, 503, 504}
+FALLBACK_STATUSES = {404, 429}
+FATAL_STATUSES = {400, 401, 403}
+
+_RETRY_IN = re.compile(r"retry in ([\d.]+)\s*s", re.IGNORECASE)
+_RETRY_DELAY = re.compile(r"retry_?delay\W+(?:seconds:\s*)?([\d.]+)", re.IGNORECASE)
+
+
+def error_status(error):
+    """Best-effort HTTP status for an upstream error (google.api_core errors carry `.code`)"""
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code
+    message = str(error).lower()
+    if "429" in message or "resource exhausted" in message or "quota" in message:
+        return 429
+    if "not found" in message or "not supported" in message:
+        return 404
+    if "503" in message or "unavailable" in message:
+        return 503
+    if "504" in message or "deadline exceeded" in message:
+        return 504
+    if "api key not valid" in message or "permission denied" in message:
+        return 403
+    if "400 " in message or "invalid argument" in message:
+        return 400
+    return None
+
+
+def server_retry_delay(error):
+    """Seconds the upstream asked us to wait (RetryInfo, Retry-After or the error text), None if it didn't say"""
+    for detail in getattr(error, "details", None) or ():
+        # gRPC errors carry a RetryInfo message, REST errors its JSON form
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None:
+            return delay.seconds + delay.nanos / 1e9
+        if isinstance(detail, dict) and detail.get("retryDelay"):
+            try:
+                return float(str(detail["retryDelay"]).rstrip("s"))
+            except ValueError:
+                pass
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("Retry-After"):
+            return float(headers["Retry-After"])
+    except (TypeError, ValueError):
+        pass
+    match = _RETRY_IN.search(str(error)) or _RETRY_DELAY.search(str(error))
+    return float(match.group(1)) if match else None
+
+
+def classify(error):
+    """RETRYABLE, FALLBACK or FATAL for an upstream error"""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return RETRYABLE
+    status = error_status(error)
+    if status in RETRYABLE_STATUSES:
+        return RETRYABLE
+    if status in FATAL_STATUSES:
+        return FATAL
+    if status in FALLBACK_STATUSES:
+        return FALLBACK
+    # Unknown errors keep the old behaviour of trying another model
+    return FALLBACK
+
+
+class RetryDecision:
+    """What to do after a failed attempt: wait `delay` seconds, then retry (on another model if `fallback`)"""
+
+    def __init__(self, kind, delay):
+        self.kind = kind
+        self.delay = delay
+
+    @property
+    def fallback(self):
+        return self.kind == FALLBACK
+
+
+class RetryState:
+    """Retries of one request; ask next(error) after each failed attempt"""
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.failures = 0
+
+    def next(self, error, time_left=None):
+        """Return a RetryDecision, or None when the request should give up"""
+        self.failures += 1
+        return self.policy._decide(error, self.failures, time_left)
+
+
+class RetryPolicy:
+    """Backoff, server retry delays and a process-wide retry budget for upstream calls
+
+    Errors are classified as retryable (same model after exponential
+    backoff with full jitter), fallback (another model, no wait) or fatal
+    (give up). A delay the upstream asks for is always honoured. Retries
+    across the process are capped at `budget_ratio` of the requests seen in
+    the last `budget_window` seconds (plus `budget_min`), so an upstream
+    outage doesn't turn every request into several.
+    """
+
+    def __init__(self, max_attempts=3, base_delay=0.25, max_delay=4.0, budget_ratio=0.1, budget_min=3,
+                 budget_window=60.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget_ratio = budget_ratio
+        self.budget_min = budget_min
+        self.budget_window = budget_window
+
+        self._lock = threading.Lock()
+        self._requests = deque()
+        self._retries = deque()
+        self.counts = {RETRYABLE: 0, FALLBACK: 0, FATAL: 0}
+        self.retried = 0
+        self.budget_exhausted = 0
+        self.gave_up = 0
+
+    def begin(self):
+        """Start a request; returns its RetryState"""
+        now = time.monotonic()
+        with self._lock:
+            self._requests.append(now)
+            self._trim(now)
+        return RetryState(self)
+
+    def _trim(self, now):
+        for window in (self._requests, self._retries):
+            while window and window[0] < now - self.budget_window:
+                window.popleft()
+
+    def backoff(self, failures):
+        """Full-jitter exponential backoff for the n-th failure"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (failures - 1)))
+
+    def _decide(self, error, failures, time_left):
+        kind = classify(error)
+        with self._lock:
+            self.counts[kind] += 1
+        if kind == FATAL or failures >= self.max_attempts:
+            return self._give_up()
+
+        server_delay = server_retry_delay(error)
+        if kind == FALLBACK:
+            # Another model has its own quota; a 429's delay applies to the model that sent it
+            delay = 0.0
+        else:
+            delay = max(self.backoff(failures), server_delay or 0.0)
+        if time_left is not None and delay >= time_left:
+            return self._give_up()
+
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            if len(self._retries) >= self.budget_min + self.budget_ratio * len(self._requests):
+                self.budget_exhausted += 1
+                return None
+            self._retries.append(now)
+            self.retried += 1
+        return RetryDecision(kind, delay)
+
+    def _give_up(self):
+        with self._lock:
+            self.gave_up += 1
+        return None
+
+    def stats(self):
+        with self._lock:
+            self._trim(time.monotonic())
+            return {
+                "max_attempts": self.max_attempts,
+                "budget_ratio": self.budget_ratio,
+                "requests_in_window": len(self._requests),
+                "retries_in_window": len(self._retries),
+                "retried": self.retried,
+                "budget_exhausted": self.budget_exhausted,
+                "gave_up": self.gave_up,
+                "errors": dict(self.counts),
+            }
+
+
+def create_retry_policy():
+    """Build from RETRY_* settings"""
+    return RetryPolicy(
+        max_attempts=int(os.getenv("RETRY_MAX_ATTEMPTS", 3)),
+        base_delay=float(os.getenv("RETRY_BASE_DELAY", 0.25)),
+        max_delay=float(os.getenv("RETRY_MAX_DELAY", 4)),
+        budget_ratio=float(os.getenv("RETRY_BUDGET_RATIO", 0.1)),
+        budget_min=int(os.getenv("RETRY_BUDGET_MIN", 3)),
+        budget_window=float(os.getenv("RETRY_BUDGET_WINDOW", 60)),
+    )
@@ -0,0 +1,145 @@
+import os
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from services.settings import env_flag
+
+TOKEN = re.compile(r"[a-z0-9]+")
+
+# Filler words that make unrelated questions look alike ("what are his skills" vs "what are his hobbies")
+STOPWORDS = frozenset("""
+a an the is are was were be been am do does did can could would should will shall may might
+i me my you your he him his she her it its we our they their them this that these those
+what which whom whose when why how about tell say please bro yo hey hi hello
+of to in on at for with from by as and or but if so than then there here just any some
+know give show explain describe also really very much many more most
+""".split())
+
+
+# Almost every question names Usman, so his name says nothing about what is being asked
+LOW_WEIGHT_TERMS = {"usman": 0.2, "usmans": 0.2, "ghani": 0.2, "bhai": 0.2}
+
+
+class HashingVectorizer:
+    """Dependency-free text embedding: hashed word and word-bigram counts plus character trigrams"""
+
+    def __init__(self, dim=4096, term_weights=None):
+        self.dim = dim
+        self.term_weights = LOW_WEIGHT_TERMS if term_weights is None else term_weights
+
+    def features(self, text):
+        """(feature, weight) pairs for a piece of text"""
+        words = [w for w in TOKEN.findall(str(text).lower()) if w not in STOPWORDS]
+        features = []
+        for word in words:
+            weight = self.term_weights.get(word, 1.0)
+            features.append((word, weight))
+            padded = f"#{word}#"
+            features += [(f"#3{padded[i:i + 3]}", weight) for i in range(len(padded) - 2)]
+        for a, b in zip(words, words[1:]):
+            features.append((f"{a} {b}", min(self.term_weights.get(a, 1.0), self.term_weights.get(b, 1.0))))
+        return features
+
+    def transform(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, weight in self.features(text):
+            h = zlib.crc32(feature.encode())
+            # The sign bit keeps hash collisions from always adding up
+            vector[h % self.dim] += weight if h & 0x80000000 else -weight
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class SemanticCache:
+    """Answers first-turn questions that are close paraphrases of ones already answered
+
+    Vectors live in one preallocated matrix so a lookup is a single
+    matrix-vector product. When full, the least recently used slot is reused.
+    """
+
+    def __init__(self, threshold=0.6, max_entries=500, ttl=24 * 60 * 60, vectorizer=None):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.vectorizer = vectorizer or HashingVectorizer()
+
+        self._lock = threading.Lock()
+        self._vectors = np.zeros((max_entries, self.vectorizer.dim), dtype=np.float32)
+        self._entries = [None] * max_entries
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, question):
+        """Return (entry, similarity) for the closest cached question above the threshold, else (None, best)"""
+        vector = self.vectorizer.transform(question)
+        now = time.time()
+        with self._lock:
+            scores = self._vectors @ vector
+            best = int(np.argmax(scores))
+            score = float(scores[best])
+            entry = self._entries[best]
+            if entry is not None and now - entry["created_at"] > self.ttl:
+                self._evict(best)
+                entry = None
+            if entry is None or score < self.threshold:
+                self.misses += 1
+                return None, score
+            self._last_used[best] = now
+            self.hits += 1
+            return entry, score
+
+    def add(self, question, reply, model_name=None):
+        if not reply or not question.strip():
+            return
+        vector = self.vectorizer.transform(question)
+        if not vector.any():
+            return
+        now = time.time()
+        with self._lock:
+            scores = self._vectors @ vector
+            slot = int(np.argmax(scores))
+            # Refresh a near-duplicate in place instead of filling the cache with copies
+            if self._entries[slot] is None or scores[slot] < 0.99:
+                slot = int(np.argmin(self._last_used))
+            self._vectors[slot] = vector
+            self._entries[slot] = {"question": question, "reply": reply, "model": model_name, "created_at": now}
+            self._last_used[slot] = now
+
+    def _evict(self, slot):
+        self._vectors[slot] = 0
+        self._entries[slot] = None
+        self._last_used[slot] = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": sum(entry is not None for entry in self._entries),
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+def first_turn_question(messages):
+    """The question text when this is the opening user message of a conversation, else None"""
+    if len(messages) == 1 and messages[0].get("sender") == "user":
+        return str(messages[0].get("text", ""))
+    return None
+
+
+def create_semantic_cache():
+    """Build the cache from SEMANTIC_CACHE_* settings; returns None when disabled"""
+    if not env_flag("SEMANTIC_CACHE_ENABLED", True):
+        return None
+    return SemanticCache(
+        threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.6)),
+        max_entries=int(os.getenv("SEMANTIC_CACHE_SIZE", 500)),
+        ttl=float(os.getenv("SEMANTIC_CACHE_TTL", 24 * 60 * 60)),
+    )
@@ -0,0 +1,109 @@
+import importlib
+import os
+import threading
+import time
+
+# Standard library only: the Vercel handlers import this module on every cold start
+
+LOG_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+
+
+def log(level, message):
+    """Print `message` if LOG_LEVEL (default info) lets `level` through; per-request detail is debug"""
+    threshold = LOG_LEVELS.get(os.getenv("LOG_LEVEL", "info").lower(), LOG_LEVELS["info"])
+    if LOG_LEVELS[level] >= threshold:
+        print(message)
+
+
+class WarmRuntime:
+    """Gemini client state that outlives one invocation on a warm serverless instance
+
+    google.generativeai is imported on the first call that needs it rather
+    than at module load, so GET/OPTIONS requests and cold starts that fail
+    before reaching Gemini don't pay for it. `genai.configure` runs once per
+    API key and each GenerativeModel is built once and reused by later
+    invocations of the same instance, over the pooled keep-alive connections
+    of services.upstream when UPSTREAM_POOL_SIZE is set. `model_kwargs` (e.g. the system instruction) are
+    fixed per handler.
+    """
+
+    def __init__(self, **model_kwargs):
+        self.model_kwargs = model_kwargs
+        self._lock = threading.Lock()
+        self._genai = None
+        self._api_key = None
+        self._models = {}
+        self.upstream = None
+        self.loaded_at = time.monotonic()
+        self.invocations = 0
+        self.sdk_import_ms = None
+
+    def begin(self):
+        """Count an invocation; True for the first one on this instance (the cold start)"""
+        with self._lock:
+            self.invocations += 1
+            return self.invocations == 1
+
+    def genai(self):
+        """The google.generativeai module, imported on first use"""
+        if self._genai is None:
+            started = time.monotonic()
+            try:
+                module = importlib.import_module("google.generativeai")
+            except ImportError as e:
+                log("error", f"❌ Import error: {e}")
+                raise Exception("Google GenerativeAI library not available")
+            with self._lock:
+                if self._genai is None:
+                    self._genai = module
+                    self.sdk_import_ms = round((time.monotonic() - started) * 1000)
+                    log("info", f"✅ Google GenerativeAI imported in {self.sdk_import_ms}ms")
+        return self._genai
+
+    def configure(self):
+        """Configure the SDK with GEMINI_API_KEY unless this instance already did for the same key"""
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            log("error", "❌ GEMINI_API_KEY environment variable is not set!")
+            raise Exception("GEMINI_API_KEY environment variable is not set!")
+        genai = self.genai()
+        with self._lock:
+            if api_key != self._api_key:
+                genai.configure(api_key=api_key)
+                self._install_upstream(api_key)
+                # Models hold a client bound to the old key
+                self._models.clear()
+                self._api_key = api_key
+                log("info", "✅ Genai configured")
+        return genai
+
+    def _install_upstream(self, api_key):
+        # Imported here so a cold start that never reaches Gemini doesn't load grpc
+        from services.upstream import create_upstream_pool
+
+        if self.upstream is None:
+            self.upstream = create_upstream_pool()
+        if self.upstream is not None:
+            self.upstream.install(api_key)
+
+    def model(self, model_name):
+        """A cached GenerativeModel for `model_name`"""
+        genai = self.configure()
+        with self._lock:
+            model = self._models.get(model_name)
+            if model is None:
+                model = genai.GenerativeModel(model_name, **self.model_kwargs)
+                self._models[model_name] = model
+                log("info", f"✅ Initialized model: {model_name}")
+            return model
+
+    def stats(self):
+        with self._lock:
+            return {
+                "invocations": self.invocations,
+                "instance_age_s": round(time.monotonic() - self.loaded_at, 1),
+                "sdk_loaded": self._genai is not None,
+                "sdk_import_ms": self.sdk_import_ms,
+                "models": sorted(self._models),
+                "upstream": self.upstream.stats() if self.upstream is not None else None,
+            }
@@ -0,0 +1,83 @@
+import os
+import re
+import secrets
+import tempfile
+import threading
+import time
+
+from services.response_cache import MemoryBackend, SQLiteBackend
+
+SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+
+class SessionStore:
+    """Conversation history kept server-side so clients only upload the newest message
+
+    Sessions expire after `ttl` seconds without a turn, the backend evicts the
+    least recently used ones beyond its size, and each history is capped at
+    `max_messages` so a runaway conversation can't grow without bound.
+    """
+
+    def __init__(self, backend, ttl, max_messages):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+        self.created = 0
+        self.resumed = 0
+        self.expired = 0
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def new_id(self):
+        self._count("created")
+        return secrets.token_urlsafe(16)
+
+    def get(self, session_id):
+        """Stored messages for a session, or None when it is unknown or expired"""
+        if not isinstance(session_id, str) or not SESSION_ID.match(session_id):
+            self._count("expired")
+            return None
+        entry = self.backend.get(session_id)
+        if entry is not None and time.time() - entry["updated_at"] > self.ttl:
+            self.backend.delete(session_id)
+            entry = None
+        self._count("resumed" if entry is not None else "expired")
+        return entry["messages"] if entry is not None else None
+
+    def save(self, session_id, messages):
+        messages = [{"sender": m.get("sender"), "text": str(m.get("text", ""))} for m in messages]
+        self.backend.set(session_id, {"messages": messages[-self.max_messages:], "updated_at": time.time()})
+
+    def delete(self, session_id):
+        self.backend.delete(session_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": type(self.backend).__name__,
+                "sessions": len(self.backend),
+                "created": self.created,
+                "resumed": self.resumed,
+                "expired": self.expired,
+            }
+
+
+def create_session_store():
+    """Build the store from SESSION_* settings; returns None when disabled"""
+    kind = os.getenv("SESSION_BACKEND", "memory").lower()
+    if kind in ("off", "none", ""):
+        return None
+    max_sessions = int(os.getenv("SESSION_MAX_SESSIONS", 1000))
+    if kind == "sqlite":
+        path = os.getenv("SESSION_PATH", os.path.join(tempfile.gettempdir(), "gptbro_sessions.sqlite3"))
+        backend = SQLiteBackend(max_sessions, path, table="sessions")
+    else:
+        backend = MemoryBackend(max_sessions)
+    return SessionStore(
+        backend,
+        ttl=float(os.getenv("SESSION_TTL", 2 * 60 * 60)),
+        max_messages=int(os.getenv("SESSION_MAX_MESSAGES", 200)),
+    )
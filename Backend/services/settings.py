@@ -0,0 +1,16 @@
+import os
+
+# Standard library only: the Vercel handlers import the services too
+
+TRUE_VALUES = ("1", "true", "on", "yes")
+FALSE_VALUES = ("0", "false", "off", "no")
+
+
+def env_flag(name, default):
+    """An on/off setting: 1/true/on/yes or 0/false/off/no in any case; unset or anything else is `default`"""
+    value = os.getenv(name, "").strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    return default
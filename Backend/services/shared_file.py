@@ -0,0 +1,36 @@
+import json
+import os
+import sqlite3
+
+
+def read_json(path):
+    """Load a JSON file shared between workers, or None if it's missing or half-written"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json_atomic(path, payload):
+    """Write to a temp file and rename so readers never see a half-written file"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, path)
+
+
+def connect_sqlite(path):
+    """Open a SQLite file shared between workers: autocommit, WAL, and a 5s wait on a locked database"""
+    conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def thread_connection(local, path):
+    """This thread's connection to `path`, kept on the threading.local `local`; a connection can't cross threads"""
+    conn = getattr(local, "conn", None)
+    if conn is None:
+        conn = local.conn = connect_sqlite(path)
+    return conn
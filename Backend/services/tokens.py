@@ -0,0 +1,180 @@
+import math
+import os
+import threading
+
+from services.prompt import NOTE_PREFIXES
+
+# tokens ~= per_char * chars + per_word * words + per_non_ascii * extra UTF-8 bytes.
+# Uncalibrated placeholders picked by hand, not fitted against the real count_tokens yet: run
+# scripts/calibrate_tokens.py with a GEMINI_API_KEY and set TOKEN_ESTIMATOR_COEFFS to what it prints.
+DEFAULT_COEFFS = (0.18, 0.3, 0.5)
+
+# Role and part framing Gemini adds around every message
+PER_PART_OVERHEAD = 3
+
+TRUNCATION_MARKER = " [...message truncated]"
+
+
+class TokenEstimator:
+    """Token count estimate built only from C-level string operations, so it costs microseconds"""
+
+    def __init__(self, coeffs=DEFAULT_COEFFS):
+        self.per_char, self.per_word, self.per_non_ascii = coeffs
+
+    def estimate_text(self, text):
+        if not text:
+            return 0
+        chars = len(text)
+        words = text.count(" ") + text.count("\n") + 1
+        non_ascii = len(text.encode("utf-8", "ignore")) - chars
+        return max(1, math.ceil(self.per_char * chars + self.per_word * words + self.per_non_ascii * non_ascii))
+
+    def estimate_contents(self, contents):
+        return sum(
+            self.estimate_text(part.get("text", "")) + PER_PART_OVERHEAD
+            for item in contents
+            for part in item["parts"]
+        )
+
+
+def parse_coeffs(spec):
+    """"0.18,0.3,0.5" -> (0.18, 0.3, 0.5); empty or malformed falls back to the defaults"""
+    try:
+        coeffs = tuple(float(x) for x in spec.split(","))
+    except ValueError:
+        return DEFAULT_COEFFS
+    return coeffs if len(coeffs) == 3 else DEFAULT_COEFFS
+
+
+_default_estimator = TokenEstimator(parse_coeffs(os.getenv("TOKEN_ESTIMATOR_COEFFS", "")))
+
+
+def estimate_tokens(text):
+    """Estimated Gemini token count for a piece of text"""
+    return _default_estimator.estimate_text(text)
+
+
+class TokenBudget:
+    """Per-request input limit and per-route output limits, plus estimated-vs-actual bookkeeping
+
+    Oversized inputs are either rejected or trimmed from the end of the
+    latest user message (`overflow` = "reject" | "trim"). The fixed
+    system_instruction counts against the input limit too.
+    """
+
+    def __init__(self, estimator=None, max_input_tokens=8000, overflow="trim", max_output_tokens=None,
+                 route_output_tokens=None, system_tokens=0):
+        self.estimator = estimator or _default_estimator
+        self.max_input_tokens = max_input_tokens
+        self.overflow = overflow
+        self.max_output_tokens = max_output_tokens
+        self.route_output_tokens = route_output_tokens or {}
+        self.system_tokens = system_tokens
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.rejected = 0
+        self.trimmed = 0
+        self.measured = 0
+        self.estimated_input_total = 0
+        self.actual_input_total = 0
+        self.abs_error_total = 0
+        self.output_total = 0
+
+    def output_limit(self, route):
+        """The route's output token cap, or None to leave it to the model"""
+        return self.route_output_tokens.get(route, self.max_output_tokens)
+
+    def generation_config(self, route):
+        limit = self.output_limit(route)
+        return {"max_output_tokens": limit} if limit else {}
+
+    def estimate(self, contents):
+        return self.system_tokens + self.estimator.estimate_contents(contents)
+
+    def enforce(self, contents):
+        """Return (contents, estimated input tokens, rejected); trims in place when the policy allows"""
+        estimated = self.estimate(contents)
+        with self._lock:
+            self.requests += 1
+        if estimated <= self.max_input_tokens:
+            return contents, estimated, False
+        if self.overflow != "trim" or not self._trim(contents, estimated - self.max_input_tokens):
+            with self._lock:
+                self.rejected += 1
+            return contents, estimated, True
+        with self._lock:
+            self.trimmed += 1
+        return contents, self.estimate(contents), False
+
+    def _trim(self, contents, excess):
+        """Cut the tail of the visitor's text in the latest user message; False if that can't free enough"""
+        for item in reversed(contents):
+            if item["role"] != "user":
+                continue
+            parts = [p for p in item["parts"] if not p.get("text", "").startswith(NOTE_PREFIXES)]
+            if not parts:
+                return False
+            part = max(parts, key=lambda p: len(p.get("text", "")))
+            text = part.get("text", "")
+            target = self.estimator.estimate_text(text) - excess - self.estimator.estimate_text(TRUNCATION_MARKER)
+            if target <= 0:
+                return False
+            for _ in range(4):
+                tokens = self.estimator.estimate_text(text)
+                if tokens <= target:
+                    part["text"] = text + TRUNCATION_MARKER
+                    return True
+                # The estimate is close to linear in length, so cut proportionally with a little slack
+                text = text[:int(len(text) * target / tokens * 0.98)]
+            return False
+        return False
+
+    def record(self, estimated, usage):
+        """Compare an estimate with the usage dict reported by Gemini"""
+        if not usage:
+            return
+        actual = usage.get("prompt_tokens") or 0
+        with self._lock:
+            self.output_total += usage.get("output_tokens") or 0
+            if actual:
+                self.measured += 1
+                self.estimated_input_total += estimated
+                self.actual_input_total += actual
+                self.abs_error_total += abs(estimated - actual)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_input_tokens": self.max_input_tokens,
+                "max_output_tokens": self.max_output_tokens,
+                "overflow": self.overflow,
+                "requests": self.requests,
+                "rejected": self.rejected,
+                "trimmed": self.trimmed,
+                "measured": self.measured,
+                "estimated_input_tokens": self.estimated_input_total,
+                "actual_input_tokens": self.actual_input_total,
+                "estimate_error_rate": (
+                    round(self.abs_error_total / self.actual_input_total, 3) if self.actual_input_total else None
+                ),
+                "output_tokens": self.output_total,
+            }
+
+
+def create_token_budget(system_instruction=""):
+    """Build from TOKEN_* / MAX_*_TOKENS settings"""
+    route_output_tokens = {}
+    for name, value in os.environ.items():
+        # MAX_OUTPUT_TOKENS_CHAT=512 limits the "chat" route
+        if name.startswith("MAX_OUTPUT_TOKENS_") and value.strip():
+            route_output_tokens[name[len("MAX_OUTPUT_TOKENS_"):].lower()] = int(value)
+    # Unset leaves replies to the model's own limit
+    max_output_tokens = os.getenv("MAX_OUTPUT_TOKENS", "").strip()
+    return TokenBudget(
+        max_input_tokens=int(os.getenv("MAX_INPUT_TOKENS", 8000)),
+        overflow=os.getenv("INPUT_OVERFLOW", "trim").lower(),
+        max_output_tokens=int(max_output_tokens) if max_output_tokens else None,
+        route_output_tokens=route_output_tokens,
+        system_tokens=estimate_tokens(system_instruction),
+    )
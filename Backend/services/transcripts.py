@@ -0,0 +1,318 @@
+import atexit
+import gzip
+import json
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+
+from services.shared_file import connect_sqlite
+
+# Standard library only (shared_file too), so scripts can read transcripts without the app's dependencies
+
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+# Put on the queue by close() to wake the writer thread from waiting for entries
+_WAKE = object()
+
+
+class JsonlWriter:
+    """Appends batches to gzip-compressed JSONL files, starting a new file once one reaches `max_bytes`
+
+    Each worker writes its own `transcripts-<time>-<pid>.jsonl.gz`. Every
+    batch is a gzip member of its own, so a file cut short by a crash reads
+    fine up to its last complete batch. Only the newest `max_files` files in
+    the directory are kept.
+    """
+
+    def __init__(self, directory, max_bytes=50 * 2 ** 20, max_files=50, compress=True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.compress = compress
+        self._path = None
+
+    def _rotate(self):
+        os.makedirs(self.directory, exist_ok=True)
+        extension = ".jsonl.gz" if self.compress else ".jsonl"
+        self._path = os.path.join(self.directory, f"transcripts-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}{extension}")
+        files = sorted(name for name in os.listdir(self.directory) if name.startswith("transcripts-"))
+        for name in files[:max(0, len(files) - self.max_files + 1)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def write(self, entries):
+        if self._path is None or not os.path.exists(self._path) or os.path.getsize(self._path) >= self.max_bytes:
+            self._rotate()
+        data = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries).encode()
+        with open(self._path, "ab") as f:
+            f.write(gzip.compress(data) if self.compress else data)
+
+    def close(self):
+        self._path = None
+
+
+class SQLiteWriter:
+    """Inserts batches into a SQLite table in WAL mode, one transaction per batch; every worker shares the file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+
+    def _connect(self):
+        # Created by the thread that writes, since a connection belongs to the thread that opened it
+        if self._conn is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            conn = connect_sqlite(self.path)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS transcripts ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL NOT NULL, entry TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS transcripts_ts ON transcripts (ts)")
+            self._conn = conn
+        return self._conn
+
+    def write(self, entries):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO transcripts (ts, entry) VALUES (?, ?)",
+                [(entry.get("ts", time.time()), json.dumps(entry, ensure_ascii=False)) for entry in entries],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class TranscriptSink:
+    """Records chat exchanges without holding up the request that produced them
+
+    record() puts an entry on a queue of `capacity` entries and returns at
+    once. When the queue is full the entry is dropped and counted rather than
+    making the request wait for the disk. A background thread takes up to
+    `batch_size` entries at a time, waiting at most `flush_interval` seconds
+    to fill a batch, and hands them to the writer. At interpreter exit
+    (a gunicorn or uvicorn worker shutting down) whatever is still queued is
+    written before the process ends.
+    """
+
+    def __init__(self, writer, capacity=10000, batch_size=200, flush_interval=1.0):
+        self.writer = writer
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._reset()
+        # A worker forked from a process that already recorded (gunicorn --preload) starts with an empty queue
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+        atexit.register(self.close)
+
+    def _reset(self):
+        self._queue = queue.Queue(self.capacity)
+        self._lock = threading.Lock()
+        self._closing = threading.Event()
+        self._thread = None
+        self.recorded = 0
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+
+    def _start(self):
+        # Threads don't survive a fork, so each process starts its own writer thread on first use
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="transcripts", daemon=True)
+        self._thread.start()
+
+    def record(self, entry):
+        """Queue one entry; False if it was dropped because the queue is full or the sink is closed"""
+        if self._closing.is_set():
+            return False
+        self._start()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.recorded += 1
+        return True
+
+    def _take(self):
+        """Up to batch_size entries; fewer after flush_interval seconds, or at once when closing"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = 0 if self._closing.is_set() else max(deadline - time.monotonic(), 0)
+            try:
+                entry = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if entry is _WAKE:
+                self._queue.task_done()
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            if batch:
+                self._write(batch)
+            elif self._closing.is_set() and self._queue.empty():
+                break
+        try:
+            self.writer.close()
+        except Exception:
+            pass
+
+    def _write(self, batch):
+        try:
+            self.writer.write(batch)
+            with self._lock:
+                self.written += len(batch)
+                self.batches += 1
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            print(f"⚠️ Transcript batch of {len(batch)} lost: {str(e)[:200]}")
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def flush(self, timeout=5.0):
+        """Wait until everything queued so far has been written; False if that took longer than `timeout`"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return not self._queue.unfinished_tasks
+
+    def close(self, timeout=10.0):
+        """Write what is still queued and stop the writer thread; later records are dropped"""
+        self._closing.set()
+        if self._thread is not None:
+            try:
+                self._queue.put(_WAKE, timeout=timeout)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": type(self.writer).__name__,
+                "queued": self._queue.qsize(),
+                "recorded": self.recorded,
+                "written": self.written,
+                "batches": self.batches,
+                "dropped": self.dropped,
+                "errors": self.errors,
+            }
+
+
+def _jsonl_lines(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    try:
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                yield line
+    except (EOFError, gzip.BadGzipFile):
+        # The file's last batch was cut short or is still being written
+        return
+
+
+def read_transcripts(path, since=None):
+    """Yield logged entries from a transcript directory, a .jsonl(.gz) file or a SQLite file
+
+    Directories are read file by file, oldest first. `since` (a Unix time)
+    skips earlier entries. Lines that aren't JSON objects are skipped.
+    """
+    if os.path.isdir(path):
+        names = sorted(name for name in os.listdir(path) if name.startswith("transcripts-"))
+        for name in names:
+            yield from read_transcripts(os.path.join(path, name), since)
+        return
+
+    with open(path, "rb") as f:
+        is_sqlite = f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+    if is_sqlite:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            rows = conn.execute("SELECT entry FROM transcripts WHERE ts >= ? ORDER BY id", (since or 0,))
+            for (entry,) in rows:
+                yield json.loads(entry)
+        finally:
+            conn.close()
+        return
+
+    for line in _jsonl_lines(path):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(entry, dict) and (since is None or entry.get("ts", since) >= since):
+            yield entry
+
+
+def conversations(entries, unique=True, limit=None):
+    """The /api/chat request bodies (`{"messages": [...]}`) of logged entries, optionally without repeats"""
+    seen = set()
+    count = 0
+    for entry in entries:
+        messages = entry.get("messages")
+        if not isinstance(messages, list) or not messages:
+            continue
+        if unique:
+            key = json.dumps(messages, sort_keys=True)
+            if key in seen:
+                continue
+            seen.add(key)
+        yield {"messages": messages}
+        count += 1
+        if limit is not None and count >= limit:
+            return
+
+
+def default_path(backend):
+    if backend == "sqlite":
+        return os.path.join(tempfile.gettempdir(), "gptbro_transcripts.sqlite3")
+    return os.path.join(tempfile.gettempdir(), "gptbro_transcripts")
+
+
+def create_transcript_sink():
+    """Build from TRANSCRIPT_* settings; returns None unless TRANSCRIPT_BACKEND is jsonl or sqlite"""
+    backend = os.getenv("TRANSCRIPT_BACKEND", "off").lower()
+    if backend not in ("jsonl", "sqlite"):
+        return None
+    path = os.getenv("TRANSCRIPT_PATH") or default_path(backend)
+    if backend == "sqlite":
+        writer = SQLiteWriter(path)
+    else:
+        writer = JsonlWriter(
+            path,
+            max_bytes=int(float(os.getenv("TRANSCRIPT_MAX_FILE_MB", 50)) * 2 ** 20),
+            max_files=int(os.getenv("TRANSCRIPT_MAX_FILES", 50)),
+        )
+    return TranscriptSink(
+        writer,
+        capacity=int(os.getenv("TRANSCRIPT_QUEUE_SIZE", 10000)),
+        batch_size=int(os.getenv("TRANSCRIPT_BATCH_SIZE", 200)),
+        flush_interval=float(os.getenv("TRANSCRIPT_FLUSH_INTERVAL", 1)),
+    )
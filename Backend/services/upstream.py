@@ -0,0 +1,434 @@
+import itertools
+import os
+import threading
+import time
+
+import grpc
+from google.api_core import grpc_helpers, grpc_helpers_async
+from google.auth import api_key as api_key_credentials
+
+DEFAULT_ENDPOINT = "generativelanguage.googleapis.com:443"
+
+# Loopback endpoints (a local mock) are reached in plaintext; the API key still goes in the metadata
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "[::1]")
+
+READY = grpc.ChannelConnectivity.READY
+CONNECTING = grpc.ChannelConnectivity.CONNECTING
+
+# SDK clients the pool builds; every other service (files, caching) keeps the SDK's own transport
+POOLED_CLIENTS = ("generative", "model", "generative_async")
+
+# genai.configure() only takes a transport *name* and client_options (endpoint, key), so there is no public way to
+# hand the SDK a pooled channel. install() relies on these private google-generativeai / grpc internals instead:
+#   google.generativeai.client._client_manager.make_client and .clients (where the SDK builds and caches clients)
+#   grpc.aio.Channel._unary_unary_interceptors (where the SDK's aio transport adds its logging interceptor)
+# and is only installed on the releases it was checked against.
+SUPPORTED_SDK_VERSIONS = ("0.7.", "0.8.")
+
+
+class UpstreamStats:
+    """What each call found on its channel: an open connection, one being opened, or none"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.reused = 0
+        self.opened = 0
+        self.waited = 0
+        self.waiting = 0
+        self.connect_timeouts = 0
+
+    def record_call(self, state):
+        with self._lock:
+            self.calls += 1
+            if state == READY:
+                self.reused += 1
+            else:
+                self.waited += 1
+
+    def record_connected(self):
+        with self._lock:
+            self.opened += 1
+
+    def start_waiting(self):
+        with self._lock:
+            self.waiting += 1
+
+    def stop_waiting(self, timed_out):
+        with self._lock:
+            self.waiting -= 1
+            if timed_out:
+                self.connect_timeouts += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "connections_opened": self.opened,
+                "reused": self.reused,
+                "waited_for_connection": self.waited,
+                "waiting": self.waiting,
+                "connect_timeouts": self.connect_timeouts,
+                # Each call on an already open connection skipped a TCP + TLS handshake
+                "handshakes_saved_per_request": round(self.reused / self.calls, 3) if self.calls else 0.0,
+            }
+
+
+class _PooledCallable:
+    """One RPC method over every channel of a pool; each call goes to the next channel"""
+
+    def __init__(self, pool, callables):
+        self.pool = pool
+        self.callables = callables
+
+    def _pick(self, timeout):
+        index, timeout = self.pool._begin_call(timeout)
+        return self.callables[index], timeout
+
+    def __call__(self, request, timeout=None, **kwargs):
+        callable_, timeout = self._pick(timeout)
+        return callable_(request, timeout=timeout, **kwargs)
+
+    def with_call(self, request, timeout=None, **kwargs):
+        callable_, timeout = self._pick(timeout)
+        return callable_.with_call(request, timeout=timeout, **kwargs)
+
+    def future(self, request, timeout=None, **kwargs):
+        callable_, timeout = self._pick(timeout)
+        return callable_.future(request, timeout=timeout, **kwargs)
+
+
+# api_core picks its error wrapping (unary or stream) by the multicallable's grpc base class
+SYNC_CALLABLES = {
+    kind: type(f"Pooled{base.__name__}", (_PooledCallable, base), {})
+    for kind, base in (
+        ("unary_unary", grpc.UnaryUnaryMultiCallable),
+        ("unary_stream", grpc.UnaryStreamMultiCallable),
+        ("stream_unary", grpc.StreamUnaryMultiCallable),
+        ("stream_stream", grpc.StreamStreamMultiCallable),
+    )
+}
+ASYNC_CALLABLES = {
+    kind: type(f"PooledAio{base.__name__}", (_PooledCallable, base), {})
+    for kind, base in (
+        ("unary_unary", grpc.aio.UnaryUnaryMultiCallable),
+        ("unary_stream", grpc.aio.UnaryStreamMultiCallable),
+        ("stream_unary", grpc.aio.StreamUnaryMultiCallable),
+        ("stream_stream", grpc.aio.StreamStreamMultiCallable),
+    )
+}
+
+
+class _PoolBase:
+    callable_types = SYNC_CALLABLES
+
+    def __init__(self, channels, stats, connect_timeout, read_timeout):
+        self._channels = channels
+        self._stats = stats
+        self._connect_timeout = connect_timeout
+        self._read_timeout = read_timeout
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+        self._callables = {}
+
+    def _capped(self, timeout):
+        return self._read_timeout if timeout is None else min(timeout, self._read_timeout)
+
+    def _multicallable(self, kind, method, *args, **kwargs):
+        with self._lock:
+            key = (kind, method)
+            if key not in self._callables:
+                self._callables[key] = self.callable_types[kind](
+                    self, [getattr(channel, kind)(method, *args, **kwargs) for channel in self._channels]
+                )
+            return self._callables[key]
+
+    def unary_unary(self, method, *args, **kwargs):
+        return self._multicallable("unary_unary", method, *args, **kwargs)
+
+    def unary_stream(self, method, *args, **kwargs):
+        return self._multicallable("unary_stream", method, *args, **kwargs)
+
+    def stream_unary(self, method, *args, **kwargs):
+        return self._multicallable("stream_unary", method, *args, **kwargs)
+
+    def stream_stream(self, method, *args, **kwargs):
+        return self._multicallable("stream_stream", method, *args, **kwargs)
+
+
+class PooledChannel(_PoolBase, grpc.Channel):
+    """A grpc.Channel over `size` keep-alive connections, safe to share between threads
+
+    Calls are spread round-robin. A call whose connection isn't open yet
+    waits at most `connect_timeout` for it (raising TimeoutError, which the
+    retry policy treats as retryable); every call's deadline is capped at
+    `read_timeout`.
+    """
+
+    def __init__(self, channels, stats, connect_timeout, read_timeout):
+        super().__init__(channels, stats, connect_timeout, read_timeout)
+        self._states = [None] * len(channels)
+        for index, channel in enumerate(channels):
+            channel.subscribe(lambda state, index=index: self._on_state(index, state))
+
+    def _on_state(self, index, state):
+        if state == READY and self._states[index] != READY:
+            self._stats.record_connected()
+        self._states[index] = state
+
+    def _begin_call(self, timeout):
+        index = next(self._next) % len(self._channels)
+        state = self._states[index]
+        self._stats.record_call(state)
+        timeout = self._capped(timeout)
+        if state == READY:
+            return index, timeout
+
+        started = time.monotonic()
+        self._stats.start_waiting()
+        timed_out = False
+        try:
+            grpc.channel_ready_future(self._channels[index]).result(timeout=min(self._connect_timeout, timeout))
+        except grpc.FutureTimeoutError:
+            timed_out = True
+            raise TimeoutError(f"Could not connect to Gemini within {self._connect_timeout:g}s")
+        finally:
+            self._stats.stop_waiting(timed_out)
+        return index, max(0.0, timeout - (time.monotonic() - started))
+
+    def subscribe(self, callback, try_to_connect=False):
+        for channel in self._channels:
+            channel.subscribe(callback, try_to_connect=try_to_connect)
+
+    def unsubscribe(self, callback):
+        for channel in self._channels:
+            channel.unsubscribe(callback)
+
+    def close(self):
+        for channel in self._channels:
+            channel.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class _SharedInterceptors(list):
+    """An interceptor list whose additions reach every channel of an aio pool"""
+
+    def __init__(self, channels):
+        super().__init__()
+        self.channels = channels
+
+    def append(self, interceptor):
+        super().append(interceptor)
+        for channel in self.channels:
+            channel._unary_unary_interceptors.append(interceptor)
+
+
+class AsyncPooledChannel(_PoolBase, grpc.aio.Channel):
+    """grpc.aio twin of PooledChannel for the ASGI app
+
+    aio calls open their connection within their own deadline, so there is
+    no separate connect wait; the stats still show which calls found an open
+    connection.
+    """
+
+    callable_types = ASYNC_CALLABLES
+
+    def __init__(self, channels, stats, connect_timeout, read_timeout):
+        super().__init__(channels, stats, connect_timeout, read_timeout)
+        # Channels with a connection attempt under way; aio channels have no state callbacks
+        self._connecting = [False] * len(channels)
+        # The SDK's aio transport adds its logging interceptor to this private list
+        self._unary_unary_interceptors = _SharedInterceptors(channels)
+
+    def _begin_call(self, timeout):
+        index = next(self._next) % len(self._channels)
+        state = self._channels[index].get_state(try_to_connect=False)
+        self._stats.record_call(state)
+        if state == READY:
+            self._connecting[index] = False
+        elif not self._connecting[index] and state != CONNECTING:
+            self._connecting[index] = True
+            self._stats.record_connected()
+        return index, self._capped(timeout)
+
+    def get_state(self, try_to_connect=False):
+        states = [channel.get_state(try_to_connect) for channel in self._channels]
+        return READY if READY in states else states[0]
+
+    async def wait_for_state_change(self, last_observed_state):
+        await self._channels[0].wait_for_state_change(last_observed_state)
+
+    async def channel_ready(self):
+        for channel in self._channels:
+            await channel.channel_ready()
+
+    async def close(self, grace=None):
+        for channel in self._channels:
+            await channel.close(grace)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+class UpstreamPool:
+    """Process-wide gRPC connections to Gemini, reused by every request, thread and retry
+
+    `install` makes the SDK build its generative, model and async clients on
+    pooled channels instead of the transport it would set up implicitly.
+    Channels are created on first use, so gunicorn workers open their own
+    connections after the fork and the async pool belongs to the event loop
+    that first uses it. Calls in progress are kept alive with HTTP/2 pings
+    every `keepalive` seconds; idle connections send none, so the server may
+    close them and the next call reconnects.
+    """
+
+    def __init__(self, endpoint=DEFAULT_ENDPOINT, size=2, connect_timeout=5.0, read_timeout=60.0, keepalive=300.0):
+        self.endpoint = endpoint
+        self.size = size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keepalive = keepalive
+        self.is_production = os.getenv("FLASK_ENV") == "production"
+
+        self._lock = threading.Lock()
+        self._api_key = None
+        self._channel = None
+        self._async_channel = None
+        self._stats = UpstreamStats()
+        self._async_stats = UpstreamStats()
+
+    def _log(self, message):
+        if not self.is_production:
+            print(message)
+
+    def _options(self):
+        return [
+            ("grpc.max_send_message_length", -1),
+            ("grpc.max_receive_message_length", -1),
+            # Google's front ends answer frequent pings on idle connections with GOAWAY (too_many_pings)
+            ("grpc.keepalive_time_ms", int(self.keepalive * 1000)),
+            ("grpc.keepalive_timeout_ms", 10000),
+            # Without this, channels with identical settings share one connection
+            ("grpc.use_local_subchannel_pool", 1),
+        ]
+
+    def _open(self, helpers):
+        local = self.endpoint.rsplit(":", 1)[0] in LOCAL_HOSTS
+        return helpers.create_channel(
+            self.endpoint,
+            credentials=api_key_credentials.Credentials(self._api_key),
+            ssl_credentials=grpc.local_channel_credentials() if local else None,
+            options=self._options(),
+        )
+
+    def channel(self):
+        with self._lock:
+            if self._channel is None:
+                channels = [self._open(grpc_helpers) for _ in range(self.size)]
+                self._channel = PooledChannel(channels, self._stats, self.connect_timeout, self.read_timeout)
+            return self._channel
+
+    def async_channel(self):
+        with self._lock:
+            if self._async_channel is None:
+                channels = [self._open(grpc_helpers_async) for _ in range(self.size)]
+                self._async_channel = AsyncPooledChannel(channels, self._async_stats, self.connect_timeout, self.read_timeout)
+            return self._async_channel
+
+    def _build_client(self, name, client_info):
+        from google.ai.generativelanguage_v1beta.services.generative_service import (
+            GenerativeServiceAsyncClient, GenerativeServiceClient,
+        )
+        from google.ai.generativelanguage_v1beta.services.generative_service.transports import (
+            GenerativeServiceGrpcAsyncIOTransport, GenerativeServiceGrpcTransport,
+        )
+        from google.ai.generativelanguage_v1beta.services.model_service import ModelServiceClient
+        from google.ai.generativelanguage_v1beta.services.model_service.transports import ModelServiceGrpcTransport
+
+        host = self.endpoint
+        if name == "generative":
+            transport = GenerativeServiceGrpcTransport(host=host, channel=self.channel(), client_info=client_info)
+            return GenerativeServiceClient(transport=transport)
+        if name == "model":
+            transport = ModelServiceGrpcTransport(host=host, channel=self.channel(), client_info=client_info)
+            return ModelServiceClient(transport=transport)
+        transport = GenerativeServiceGrpcAsyncIOTransport(host=host, channel=self.async_channel(), client_info=client_info)
+        return GenerativeServiceAsyncClient(transport=transport)
+
+    def install(self, api_key):
+        """Route the SDK's clients through this pool; call after genai.configure, which drops them
+
+        This replaces a private hook of google-generativeai, so it is only done
+        on the SDK versions it was written against. Anywhere else, or if a
+        pooled client can't be built, the SDK's own transport is kept.
+        Returns whether the pool is in use.
+        """
+        import google.generativeai as genai
+        from google.generativeai import client as genai_client
+
+        # Logged in production too: UPSTREAM_POOL_SIZE was set, and it is silently doing nothing
+        version = getattr(genai, "__version__", "")
+        if not version.startswith(SUPPORTED_SDK_VERSIONS):
+            print(f"⚠️ UPSTREAM_POOL_SIZE ignored: google.generativeai {version or '(unknown)'} isn't one of the "
+                  f"versions the upstream pool supports ({', '.join(v + 'x' for v in SUPPORTED_SDK_VERSIONS)}), "
+                  "keeping the SDK's own transport")
+            return False
+        manager = getattr(genai_client, "_client_manager", None)
+        if manager is None or not hasattr(manager, "make_client") or not isinstance(getattr(manager, "clients", None), dict):
+            print(f"⚠️ UPSTREAM_POOL_SIZE ignored: unknown google.generativeai {version} client layout, "
+                  "keeping the SDK's own transport")
+            return False
+
+        with self._lock:
+            if api_key != self._api_key:
+                # Channels carry the key they were opened with
+                self._channel = None
+                self._async_channel = None
+                self._api_key = api_key
+        sdk_make_client = type(manager).make_client.__get__(manager)
+
+        def make_client(name):
+            if name in POOLED_CLIENTS:
+                try:
+                    return self._build_client(name, manager.client_config.get("client_info"))
+                except Exception as e:
+                    self._log(f"⚠️ Pooled {name} client failed ({str(e)[:200]}), using the SDK's own transport")
+            return sdk_make_client(name)
+
+        manager.make_client = make_client
+        for name in POOLED_CLIENTS:
+            manager.clients.pop(name, None)
+        return True
+
+    def stats(self):
+        return {
+            "endpoint": self.endpoint,
+            "pool_size": self.size,
+            "connect_timeout": self.connect_timeout,
+            "read_timeout": self.read_timeout,
+            "sync": self._stats.stats(),
+            "async": self._async_stats.stats(),
+        }
+
+
+def create_upstream_pool():
+    """Build from UPSTREAM_* settings; returns None unless UPSTREAM_POOL_SIZE is set (the SDK's implicit transport)"""
+    size = int(os.getenv("UPSTREAM_POOL_SIZE", 0))
+    if size <= 0:
+        return None
+    return UpstreamPool(
+        endpoint=os.getenv("UPSTREAM_ENDPOINT", DEFAULT_ENDPOINT),
+        size=size,
+        connect_timeout=float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", 5)),
+        read_timeout=float(os.getenv("UPSTREAM_READ_TIMEOUT", 60)),
+        keepalive=float(os.getenv("UPSTREAM_KEEPALIVE", 300)),
+    )
@@ -0,0 +1,116 @@
+"""Shared fixtures: the Flask app imported once against an in-process fake of the Gemini SDK
+
+Nothing here reaches the network. Every file the app would write goes to a
+temporary directory, and the fake model answers "hello bro from <model>"
+unless a test makes it fail.
+"""
+import os
+import sys
+import tempfile
+import time
+import types
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+STATE_DIR = tempfile.mkdtemp(prefix="gptbro-tests-")
+os.environ.update({
+    "GEMINI_API_KEY": "test-key",
+    "FLASK_ENV": "test",
+    "MODEL_CACHE_PATH": os.path.join(STATE_DIR, "models.json"),
+    "COALESCE_PATH": os.path.join(STATE_DIR, "flights.sqlite3"),
+    "UPSTREAM_POOL_SIZE": "0",
+    "PREWARM_ON_STARTUP": "false",
+    "TRANSCRIPT_BACKEND": "off",
+    "RETRY_BASE_DELAY": "0",
+    # Every test client shares one address; rate limiting gets its own tests
+    "RATE_LIMIT_PER_MINUTE": "100000",
+    "RATE_LIMIT_BURST": "100000",
+    # Paraphrase matching would answer one test with another's reply
+    "SEMANTIC_CACHE_ENABLED": "false",
+})
+
+import google.generativeai as genai  # noqa: E402
+
+
+class FakeResponse:
+    def __init__(self, text, finish_reason="STOP"):
+        self._text = text
+        self.usage_metadata = types.SimpleNamespace(
+            prompt_token_count=100, candidates_token_count=5, total_token_count=105
+        )
+        self.candidates = [types.SimpleNamespace(finish_reason=types.SimpleNamespace(name=finish_reason))]
+
+    @property
+    def text(self):
+        if not self._text:
+            raise ValueError("The `response.text` quick accessor requires the response to contain a valid `Part`")
+        return self._text
+
+    def __iter__(self):
+        for word in self._text.split(" ") if self._text else []:
+            yield types.SimpleNamespace(text=word + " ")
+
+
+class FakeModel:
+    """Stands in for genai.GenerativeModel
+
+    `fail` holds model names that raise, `calls` records every call,
+    `delay` is how long each call takes, and `reply` / `finish_reason`
+    override what the next replies look like.
+    """
+
+    fail = set()
+    calls = []
+    delay = 0.0
+    reply = None
+    finish_reason = "STOP"
+
+    def __init__(self, model_name="gemini-2.5-flash", **kwargs):
+        self.model_name = model_name if model_name.startswith("models/") else "models/" + model_name
+        self.kwargs = kwargs
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        FakeModel.calls.append((self.model_name, contents, kwargs))
+        time.sleep(FakeModel.delay)
+        if self.model_name in FakeModel.fail:
+            raise Exception("503 Service Unavailable")
+        text = FakeModel.reply if FakeModel.reply is not None else "hello bro from " + self.model_name
+        return FakeResponse(text, FakeModel.finish_reason)
+
+    def count_tokens(self, contents):
+        return types.SimpleNamespace(total_tokens=42)
+
+
+genai.GenerativeModel = FakeModel
+genai.configure = lambda **kwargs: None
+genai.get_model = lambda name, request_options=None: types.SimpleNamespace(
+    supported_generation_methods=["generateContent"]
+)
+
+import app as core_app  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fake_model():
+    """The fake SDK model class, reset before every test along with the router's circuit breakers"""
+    core_app.model_router._health.clear()
+    FakeModel.fail = set()
+    FakeModel.calls = []
+    FakeModel.delay = 0.0
+    FakeModel.reply = None
+    FakeModel.finish_reason = "STOP"
+    yield FakeModel
+
+
+@pytest.fixture
+def core():
+    """The imported app module (Backend/app.py)"""
+    return core_app
+
+
+@pytest.fixture
+def client():
+    return core_app.app.test_client()
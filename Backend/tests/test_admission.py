@@ -0,0 +1,42 @@
+from services.admission import AdmissionController, ConcurrencyGate, MemoryBuckets
+
+
+def test_rate_limit_key_is_the_address_our_proxy_appended(core, monkeypatch):
+    monkeypatch.delenv("TRUSTED_PROXY_HOPS", raising=False)
+    headers = {"X-Forwarded-For": "6.6.6.6, 203.0.113.7"}
+    assert core.client_key({}, headers, "10.0.0.1") == "ip:203.0.113.7"
+
+
+def test_rate_limit_key_counts_trusted_hops_from_the_right(core, monkeypatch):
+    monkeypatch.setenv("TRUSTED_PROXY_HOPS", "2")
+    headers = {"X-Forwarded-For": "6.6.6.6, 203.0.113.7, 10.0.0.2"}
+    assert core.client_key({}, headers, "10.0.0.1") == "ip:203.0.113.7"
+
+
+def test_rate_limit_key_falls_back_to_the_socket_address(core, monkeypatch):
+    monkeypatch.setenv("TRUSTED_PROXY_HOPS", "2")
+    assert core.client_key({}, {"X-Forwarded-For": "203.0.113.7"}, "10.0.0.1") == "ip:10.0.0.1"
+    monkeypatch.setenv("TRUSTED_PROXY_HOPS", "0")
+    assert core.client_key({}, {"X-Forwarded-For": "203.0.113.7"}, "10.0.0.1") == "ip:10.0.0.1"
+    assert core.client_key({}, {}, None) == "ip:unknown"
+
+
+def test_rate_limit_key_by_session(core, monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_KEY", "session")
+    assert core.client_key({"session_id": "abc"}, {"X-Forwarded-For": "203.0.113.7"}, None) == "session:abc"
+    assert core.client_key({}, {"X-Forwarded-For": "203.0.113.7"}, None) == "ip:203.0.113.7"
+
+
+def test_spoofed_forwarded_for_does_not_get_a_fresh_bucket(core, client, monkeypatch, tmp_path):
+    gate = ConcurrencyGate(lock_dir=str(tmp_path))
+    limited = AdmissionController(MemoryBuckets(), gate, rate_per_minute=1, burst=2)
+    monkeypatch.setattr(core, "admission", limited)
+    statuses = [
+        client.post(
+            "/api/chat",
+            json={"message": f"spoof check {i}"},
+            headers={"X-Forwarded-For": f"198.51.100.{i}, 203.0.113.9"},
+        ).status_code
+        for i in range(3)
+    ]
+    assert statuses == [200, 200, 429]
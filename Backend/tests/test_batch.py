@@ -0,0 +1,44 @@
+import json
+
+import pytest
+from starlette.testclient import TestClient
+
+BODY = {"conversations": [{"id": "one", "message": "batch question one"}, {"id": "two", "message": "batch question two"}]}
+
+
+@pytest.fixture
+def asgi_client(core):
+    """The batch endpoint is only on the ASGI app"""
+    import asgi
+
+    return TestClient(asgi.app)
+
+
+def test_flask_app_does_not_serve_batches(client, monkeypatch):
+    monkeypatch.setenv("BATCH_TOKEN", "batch-secret")
+    response = client.post("/api/chat/batch", json=BODY, headers={"Authorization": "Bearer batch-secret"})
+    assert response.status_code == 404
+
+
+def test_batch_endpoint_is_off_without_a_token(asgi_client, monkeypatch):
+    monkeypatch.delenv("BATCH_TOKEN", raising=False)
+    monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    assert asgi_client.post("/api/chat/batch", json=BODY).status_code == 404
+
+
+def test_batch_endpoint_rejects_a_wrong_token(asgi_client, monkeypatch):
+    monkeypatch.setenv("BATCH_TOKEN", "batch-secret")
+    assert asgi_client.post("/api/chat/batch", json=BODY).status_code == 401
+    response = asgi_client.post("/api/chat/batch", json=BODY, headers={"Authorization": "Bearer nope"})
+    assert response.status_code == 401
+
+
+def test_batch_endpoint_accepts_the_batch_or_admin_token(asgi_client, monkeypatch):
+    monkeypatch.setenv("BATCH_TOKEN", "batch-secret")
+    monkeypatch.setenv("ADMIN_TOKEN", "admin-secret")
+    for token in ("batch-secret", "admin-secret"):
+        response = asgi_client.post("/api/chat/batch", json=BODY, headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200
+        lines = [json.loads(line) for line in response.text.splitlines() if line.strip()]
+        assert sorted(line["id"] for line in lines if not line.get("done")) == ["one", "two"]
+        assert lines[-1]["done"] is True
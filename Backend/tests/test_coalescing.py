@@ -0,0 +1,60 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from services.coalescing import MemoryFlightStore, create_coalescer
+
+
+def post_together(core, bodies, headers=None):
+    """POST every body at once, each from its own client; returns the responses in order"""
+    def post(body):
+        return core.app.test_client().post("/api/chat", json=body, headers=headers or {})
+
+    with ThreadPoolExecutor(len(bodies)) as pool:
+        return list(pool.map(post, bodies))
+
+
+def test_flights_are_per_worker_by_default(monkeypatch):
+    monkeypatch.delenv("COALESCE_BACKEND", raising=False)
+    assert isinstance(create_coalescer().store, MemoryFlightStore)
+
+
+def test_identical_concurrent_requests_share_one_call(core, fake_model):
+    fake_model.delay = 0.3
+    responses = post_together(core, [{"message": "coalesce me please"}] * 3)
+    assert [r.status_code for r in responses] == [200, 200, 200]
+    assert len(fake_model.calls) == 1
+    assert sorted(r.headers["X-Cache"] for r in responses) == ["COALESCED", "COALESCED", "MISS"]
+
+
+def test_cache_bypass_is_never_coalesced(core, fake_model):
+    fake_model.delay = 0.3
+    responses = post_together(core, [{"message": "give me a fresh one"}] * 2, headers={"X-Cache-Bypass": "1"})
+    assert [r.status_code for r in responses] == [200, 200]
+    assert len(fake_model.calls) == 2
+    assert {r.headers["X-Cache"] for r in responses} == {"BYPASS"}
+
+
+def test_time_sensitive_questions_are_never_coalesced(core, fake_model):
+    fake_model.delay = 0.3
+    responses = post_together(core, [{"message": "what is today's date?"}] * 2)
+    assert len(fake_model.calls) == 2
+    assert {r.headers["X-Cache"] for r in responses} == {"BYPASS"}
+
+
+def test_idempotency_key_replays_the_first_reply(client, fake_model):
+    headers = {"Idempotency-Key": "retry-1"}
+    first = client.post("/api/chat", json={"message": "idempotent question"}, headers=headers)
+    fake_model.reply = "a different answer"
+    again = client.post("/api/chat", json={"message": "idempotent question"}, headers=headers)
+    assert first.status_code == again.status_code == 200
+    assert again.headers["X-Cache"] == "REPLAY"
+    assert again.json["reply"] == first.json["reply"]
+    assert len(fake_model.calls) == 1
+
+
+def test_idempotency_key_reused_for_another_body_is_rejected(client, fake_model):
+    headers = {"Idempotency-Key": "retry-2"}
+    assert client.post("/api/chat", json={"message": "first body"}, headers=headers).status_code == 200
+    response = client.post("/api/chat", json={"message": "second body"}, headers=headers)
+    assert response.status_code == 422
+    assert response.json["code"] == "idempotency_key_reused"
+    assert len(fake_model.calls) == 1
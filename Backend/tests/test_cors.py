@@ -0,0 +1,35 @@
+ORIGIN = "https://gptbro.vercel.app"
+
+
+def exposed(response):
+    return {name.strip() for name in response.headers.get("Access-Control-Expose-Headers", "").split(",")}
+
+
+def test_chat_exposes_response_headers_cross_origin(client):
+    response = client.post("/api/chat", json={"message": "cors check one"}, headers={"Origin": ORIGIN})
+    assert response.status_code == 200
+    assert response.headers["Access-Control-Allow-Origin"] == ORIGIN
+    assert {"X-Cache", "X-Session-Id", "Retry-After"} <= exposed(response)
+
+
+def test_chat_preflight_allows_request_headers(client):
+    response = client.options("/api/chat", headers={
+        "Origin": ORIGIN,
+        "Access-Control-Request-Method": "POST",
+        "Access-Control-Request-Headers": "Content-Type, Idempotency-Key, X-Cache-Bypass",
+    })
+    allowed = response.headers.get("Access-Control-Allow-Headers", "").lower()
+    assert response.headers["Access-Control-Allow-Origin"] == ORIGIN
+    assert "idempotency-key" in allowed and "x-cache-bypass" in allowed
+
+
+def test_chat_accepts_the_render_and_netlify_frontends(client):
+    for origin in ("https://gpt-bro.onrender.com", "https://gptbro.netlify.app"):
+        response = client.post("/api/chat", json={"message": f"cors check {origin}"}, headers={"Origin": origin})
+        assert response.headers["Access-Control-Allow-Origin"] in (origin, "*")
+        assert "X-Session-Id" in exposed(response)
+
+
+def test_other_routes_only_allow_the_configured_origins(client):
+    assert "Access-Control-Allow-Origin" not in client.get("/health", headers={"Origin": "https://evil.example"}).headers
+    assert client.get("/health", headers={"Origin": ORIGIN}).headers["Access-Control-Allow-Origin"] == ORIGIN
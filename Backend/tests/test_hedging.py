@@ -0,0 +1,87 @@
+import threading
+import time
+
+from services.hedging import HedgePolicy, Hedger
+
+
+class Stream:
+    """A streamed response whose underlying call can be cancelled, like the SDK's gRPC stream"""
+
+    def __init__(self, chunks):
+        self._iterator = self
+        self._chunks = iter(chunks)
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._chunks)
+
+
+class SlowModel:
+    def __init__(self, delay):
+        self.delay = delay
+        self.streams = []
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        time.sleep(self.delay)
+        response = Stream(["first", "second"])
+        self.streams.append(response)
+        return response
+
+
+class Router:
+    def __init__(self, models):
+        self.models = models
+        self.cancelled = []
+        self.failures = []
+
+    def choose(self, exclude=()):
+        name = next(name for name in self.models if name not in exclude)
+        return name, self.models[name]
+
+    def record_cancelled(self, model_name):
+        self.cancelled.append(model_name)
+
+    def record_failure(self, model_name, error):
+        self.failures.append(model_name)
+
+
+def test_budget_allows_a_hedge_at_low_traffic():
+    policy = HedgePolicy(max_extra_ratio=0.1, min_hedges=1)
+    policy.record_request()
+    assert policy.try_fire()
+    assert not policy.try_fire()
+
+
+def test_budget_scales_with_traffic():
+    policy = HedgePolicy(max_extra_ratio=0.1, min_hedges=1)
+    for _ in range(30):
+        policy.record_request()
+    assert [policy.try_fire() for _ in range(4)] == [True, True, True, False]
+
+
+def test_sync_loser_stream_is_cancelled_when_it_arrives():
+    primary, secondary = SlowModel(0.3), SlowModel(0.0)
+    router = Router({"primary": primary, "secondary": secondary})
+    hedger = Hedger(router, HedgePolicy(default_delay=0.05, min_delay=0.01, min_hedges=1))
+
+    start = hedger.start("primary", primary, [])
+    assert start.model_name == "secondary"
+    assert list(start) == ["first", "second"]
+    assert router.cancelled == ["primary"]
+    assert wait_for(lambda: primary.streams and primary.streams[0].cancelled.is_set())
+    assert not secondary.streams[0].cancelled.is_set()
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
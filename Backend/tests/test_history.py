@@ -0,0 +1,82 @@
+import time
+
+from services.history import HistoryCompactor
+from services.response_cache import MemoryBackend
+
+
+def conversation(opening, turns):
+    messages = [{"sender": "user", "text": opening}, {"sender": "bot", "text": "hey bro"}]
+    for i in range(turns):
+        messages += [
+            {"sender": "user", "text": f"question {i} " + "word " * 40},
+            {"sender": "bot", "text": f"answer {i} " + "word " * 40},
+        ]
+    return messages + [{"sender": "user", "text": "latest question"}]
+
+
+def summarizing_compactor():
+    def summarize(previous, messages):
+        return (previous + " | " if previous else "") + "; ".join(m["text"][:12] for m in messages)
+
+    return HistoryCompactor(summarize, MemoryBackend(100), token_budget=300, keep_turns=2)
+
+
+def wait_for_summaries(compactor, count, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while compactor.stats()["summaries_built"] < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_summary_is_reused_for_the_same_session():
+    compactor = summarizing_compactor()
+    messages = conversation("hi", 6)
+    _, summary, _ = compactor.compact(messages, "gemini-2.5-flash", "session-a")
+    assert summary is None
+    wait_for_summaries(compactor, 1)
+    _, summary, saved = compactor.compact(messages, "gemini-2.5-flash", "session-a")
+    assert summary is not None and saved > 0
+
+
+def test_summary_is_not_shared_between_sessions_with_the_same_opening():
+    compactor = summarizing_compactor()
+    compactor.compact(conversation("hi", 6), "gemini-2.5-flash", "session-a")
+    wait_for_summaries(compactor, 1)
+    _, summary, _ = compactor.compact(conversation("hi", 6), "gemini-2.5-flash", "session-b")
+    assert summary is None
+
+
+def test_stateless_summary_needs_the_whole_covered_history_to_match():
+    compactor = summarizing_compactor()
+    compactor.compact(conversation("hi", 6), "gemini-2.5-flash")
+    wait_for_summaries(compactor, 1)
+    other = conversation("hi", 6)
+    other[3]["text"] = "something only the other visitor said " + "word " * 40
+    _, summary, _ = compactor.compact(other, "gemini-2.5-flash")
+    assert summary is None
+
+
+def test_summary_extends_as_the_conversation_grows():
+    compactor = summarizing_compactor()
+    messages = conversation("hi", 6)
+    compactor.compact(messages, "gemini-2.5-flash", "session-a")
+    wait_for_summaries(compactor, 1)
+    longer = messages + [{"sender": "bot", "text": "reply " + "word " * 40}, {"sender": "user", "text": "and then?"}]
+    _, summary, _ = compactor.compact(longer, "gemini-2.5-flash", "session-a")
+    assert summary is not None
+    wait_for_summaries(compactor, 2)
+    _, extended, _ = compactor.compact(longer, "gemini-2.5-flash", "session-a")
+    assert extended.startswith(summary + " | ")
+
+
+def test_stateless_client_reuses_the_summary_for_the_same_history(core, client, fake_model, monkeypatch):
+    compactor = summarizing_compactor()
+    monkeypatch.setattr(core, "history_compactor", compactor)
+    messages = conversation("stateless reuse", 6)
+    headers = {"X-Cache-Bypass": "1"}
+    assert client.post("/api/chat", json={"messages": messages}, headers=headers).status_code == 200
+    wait_for_summaries(compactor, 1)
+    assert client.post("/api/chat", json={"messages": messages}, headers=headers).status_code == 200
+    time.sleep(0.05)
+    assert compactor.stats()["summaries_built"] == 1
+    sent = [part["text"] for turn in fake_model.calls[-1][1] for part in turn["parts"]]
+    assert any(text.startswith("[Summary of the earlier conversation:") for text in sent)
@@ -0,0 +1,91 @@
+import threading
+import time
+import types
+
+import services.model_registry as model_registry
+from services.model_registry import ModelRegistry
+
+
+def failing_probe(probes):
+    def get_model(name, request_options=None):
+        probes.append(name)
+        raise Exception("503 Service Unavailable")
+
+    return get_model
+
+
+def working_probe(name, request_options=None):
+    return types.SimpleNamespace(supported_generation_methods=["generateContent"])
+
+
+def test_failed_discovery_falls_back_and_is_not_retried_on_every_request(tmp_path, monkeypatch):
+    probes = []
+    monkeypatch.setattr(model_registry.genai, "get_model", failing_probe(probes))
+    registry = ModelRegistry(["model-a", "model-b"], cache_path=str(tmp_path / "models.json"), retry_interval=60)
+
+    assert registry.available_models() == ["model-a"]
+    assert registry.available_models() == ["model-a"]
+    assert len(probes) == 2
+
+
+def test_discovery_is_retried_after_the_interval(tmp_path, monkeypatch):
+    probes = []
+    monkeypatch.setattr(model_registry.genai, "get_model", failing_probe(probes))
+    registry = ModelRegistry(["model-a", "model-b"], cache_path=str(tmp_path / "models.json"), retry_interval=0)
+    assert registry.available_models() == ["model-a"]
+
+    monkeypatch.setattr(model_registry.genai, "get_model", working_probe)
+    assert registry.available_models() == ["model-a", "model-b"]
+
+
+def test_configured_default_model_is_used_while_nothing_is_known(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_registry.genai, "get_model", lambda name, request_options=None: 1 / 0)
+    registry = ModelRegistry(["model-a", "model-b"], cache_path=str(tmp_path / "models.json"), default_model="model-b")
+    assert registry.available_models() == ["model-b"]
+
+
+def test_discovery_does_not_block_known_models(tmp_path, monkeypatch):
+    release = threading.Event()
+
+    def slow_probe(name, request_options=None):
+        release.wait(5)
+        return working_probe(name)
+
+    monkeypatch.setattr(model_registry.genai, "get_model", slow_probe)
+    registry = ModelRegistry(["model-a", "model-b"], cache_path=str(tmp_path / "models.json"), probe_timeout=5)
+    discovering = threading.Thread(target=registry.available_models)
+    discovering.start()
+    try:
+        # /health reads this through the router's snapshot while discovery is still probing
+        assert registry.known_models() is None
+        assert registry.model_for("model-a") is registry.model_for("model-a")
+    finally:
+        release.set()
+        discovering.join(5)
+    assert registry.known_models() == ["model-a", "model-b"]
+
+
+def test_stale_list_is_served_while_another_thread_rediscovers(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_registry.genai, "get_model", working_probe)
+    registry = ModelRegistry(["model-a", "model-b"], cache_path=str(tmp_path / "models.json"), ttl=0)
+    assert registry.available_models() == ["model-a", "model-b"]
+
+    release = threading.Event()
+    probing = threading.Event()
+
+    def slow_probe(name, request_options=None):
+        probing.set()
+        release.wait(5)
+        return working_probe(name)
+
+    monkeypatch.setattr(model_registry.genai, "get_model", slow_probe)
+    discovering = threading.Thread(target=registry.available_models)
+    discovering.start()
+    try:
+        assert probing.wait(2)
+        started = time.monotonic()
+        assert registry.available_models() == ["model-a", "model-b"]
+        assert time.monotonic() - started < 1
+    finally:
+        release.set()
+        discovering.join(5)
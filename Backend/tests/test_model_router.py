@@ -0,0 +1,102 @@
+import time
+
+import pytest
+
+from services.model_router import CLOSED, HALF_OPEN, OPEN, ModelRouter
+
+
+class Registry:
+    def __init__(self, models):
+        self.models = models
+        self.unavailable = []
+
+    def available_models(self):
+        return [name for name in self.models if name not in self.unavailable]
+
+    def known_models(self):
+        return self.available_models()
+
+    def model_for(self, model_name):
+        return model_name
+
+    def mark_unavailable(self, model_name):
+        self.unavailable.append(model_name)
+
+
+def make_router(models=("primary",)):
+    return ModelRouter(Registry(list(models)), failure_threshold=2, cooldown=0.05, rate_limit_cooldown=60)
+
+
+def trip(router, model_name):
+    for _ in range(router.failure_threshold):
+        router.record_failure(model_name, Exception("503 Service Unavailable"))
+
+
+def state(router, model_name):
+    return router._health[model_name].state
+
+
+def test_circuit_opens_after_consecutive_failures():
+    router = make_router()
+    router.record_failure("primary", Exception("503 Service Unavailable"))
+    assert state(router, "primary") == CLOSED
+    assert router.choose()[0] == "primary"
+    router.record_failure("primary", Exception("503 Service Unavailable"))
+    assert state(router, "primary") == OPEN
+    with pytest.raises(Exception, match="No healthy Gemini model"):
+        router.choose()
+
+
+def test_requests_go_around_an_open_circuit():
+    router = make_router(("primary", "secondary"))
+    assert router.choose()[0] == "primary"
+    trip(router, "primary")
+    assert router.choose()[0] == "secondary"
+
+
+def test_half_open_trial_closes_the_circuit_on_success():
+    router = make_router()
+    trip(router, "primary")
+    time.sleep(0.06)
+    assert router.choose()[0] == "primary"
+    assert state(router, "primary") == HALF_OPEN
+    # Only one trial at a time
+    with pytest.raises(Exception, match="No healthy Gemini model"):
+        router.choose()
+    router.record_success("primary", 0.1)
+    assert state(router, "primary") == CLOSED
+    assert router.choose()[0] == "primary"
+
+
+def test_half_open_trial_reopens_the_circuit_on_failure():
+    router = make_router()
+    trip(router, "primary")
+    time.sleep(0.06)
+    assert router.choose()[0] == "primary"
+    router.record_failure("primary", Exception("503 Service Unavailable"))
+    assert state(router, "primary") == OPEN
+    assert router._health["primary"].open_until > time.time()
+
+
+def test_rate_limit_opens_at_once_for_the_delay_the_upstream_asked():
+    router = make_router()
+    router.record_failure("primary", Exception("429 Resource exhausted. Please retry in 7s."))
+    assert state(router, "primary") == OPEN
+    assert 6 < router._health["primary"].open_until - time.time() <= 7
+
+
+def test_cancelled_trial_frees_the_half_open_slot():
+    router = make_router()
+    trip(router, "primary")
+    time.sleep(0.06)
+    assert router.choose()[0] == "primary"
+    router.record_cancelled("primary")
+    assert state(router, "primary") == HALF_OPEN
+    assert router.choose()[0] == "primary"
+
+
+def test_missing_model_is_dropped_from_the_registry():
+    router = make_router(("primary", "secondary"))
+    router.record_failure("primary", Exception("404 models/primary is not found"))
+    assert router.registry.unavailable == ["primary"]
+    assert router.choose()[0] == "secondary"
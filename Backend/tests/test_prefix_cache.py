@@ -0,0 +1,71 @@
+import threading
+import time
+import types
+
+from services import prefix_cache
+from services.prefix_cache import PrefixModels
+
+
+class SlowCachedContent:
+    """Stands in for caching.CachedContent; create() blocks until `release` is set"""
+
+    created = []
+    release = threading.Event()
+
+    @classmethod
+    def create(cls, model, display_name, system_instruction, ttl):
+        cls.created.append(model)
+        cls.release.wait(5)
+        return types.SimpleNamespace(name=f"cachedContents/{len(cls.created)}", model=model)
+
+    @classmethod
+    def get(cls, name):
+        raise LookupError(name)
+
+
+def test_cache_creation_does_not_hold_the_lock(monkeypatch, tmp_path):
+    SlowCachedContent.created = []
+    SlowCachedContent.release = threading.Event()
+    monkeypatch.setattr(prefix_cache.caching, "CachedContent", SlowCachedContent)
+    monkeypatch.setattr(
+        prefix_cache.genai.GenerativeModel, "from_cached_content",
+        classmethod(lambda cls, cached: types.SimpleNamespace(cached=cached)), raising=False,
+    )
+    models = PrefixModels("prefix", "v1", use_context_cache=True, state_path=str(tmp_path / "state.json"))
+
+    creating = threading.Thread(target=models.model_for, args=("gemini-2.5-flash",))
+    creating.start()
+    try:
+        assert wait_for(lambda: SlowCachedContent.created)
+        # While that create is in flight, the same model falls back to the plain prefix and nothing waits on it
+        plain = models.model_for("gemini-2.5-flash")
+        assert plain.kwargs["system_instruction"] == "prefix"
+        assert models.stats()["cached_models"] == {}
+        assert SlowCachedContent.created == ["models/gemini-2.5-flash"]
+    finally:
+        SlowCachedContent.release.set()
+        creating.join(5)
+
+    cached = models.model_for("gemini-2.5-flash")
+    assert cached.cached.name == "cachedContents/1"
+    assert list(models.stats()["cached_models"]) == ["gemini-2.5-flash"]
+
+
+def test_failed_creation_falls_back_to_the_plain_prefix(monkeypatch, tmp_path):
+    def create(**kwargs):
+        raise Exception("400 Cached content is too small")
+
+    monkeypatch.setattr(prefix_cache.caching, "CachedContent", types.SimpleNamespace(create=create, get=None))
+    models = PrefixModels("prefix", "v1", use_context_cache=True, state_path=str(tmp_path / "state.json"))
+    assert models.model_for("gemini-2.5-flash").kwargs["system_instruction"] == "prefix"
+    assert models._in_flight == set()
+    assert models.stats()["cached_models"] == {}
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
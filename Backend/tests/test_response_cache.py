@@ -0,0 +1,14 @@
+def test_fallback_reply_is_served_from_the_cache_whichever_model_is_preferred(core, client, fake_model):
+    primary = core.model_router.preferred_model()
+    fake_model.fail = {"models/" + primary}
+    first = client.post("/api/chat", json={"messages": [{"sender": "user", "text": "cache check fallback"}]})
+    assert first.headers["X-Cache"] == "MISS"
+    assert primary not in first.json["reply"]
+
+    # The primary recovers and the router prefers it again
+    fake_model.fail = set()
+    core.model_router._health.clear()
+    assert core.model_router.preferred_model() == primary
+    again = client.post("/api/chat", json={"messages": [{"sender": "user", "text": "Cache check   FALLBACK"}]})
+    assert again.headers["X-Cache"] == "HIT"
+    assert again.json["reply"] == first.json["reply"]
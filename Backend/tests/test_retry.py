@@ -0,0 +1,46 @@
+from services.retry import FALLBACK, RETRYABLE, RetryPolicy, classify
+
+
+class Unavailable(Exception):
+    code = 503
+
+
+def test_errors_are_classified_by_status():
+    assert classify(Unavailable("unavailable")) == RETRYABLE
+    assert classify(Exception("429 Resource exhausted")) == FALLBACK
+    assert classify(TimeoutError()) == RETRYABLE
+    assert classify(Exception("400 Invalid argument")) != RETRYABLE
+
+
+def test_retries_stop_at_max_attempts():
+    policy = RetryPolicy(max_attempts=3, base_delay=0, budget_min=100)
+    retry = policy.begin()
+    assert retry.next(Unavailable("unavailable")) is not None
+    assert retry.next(Unavailable("unavailable")) is not None
+    assert retry.next(Unavailable("unavailable")) is None
+    assert policy.stats()["gave_up"] == 1
+
+
+def test_fatal_errors_are_not_retried():
+    policy = RetryPolicy(base_delay=0)
+    assert policy.begin().next(Exception("403 API key not valid")) is None
+
+
+def test_retry_budget_caps_retries_across_requests():
+    policy = RetryPolicy(max_attempts=5, base_delay=0, budget_ratio=0.1, budget_min=2)
+    decisions = [policy.begin().next(Unavailable("unavailable")) for _ in range(10)]
+    # 2 + 10% of 10 requests
+    assert sum(decision is not None for decision in decisions) == 3
+    assert policy.stats()["budget_exhausted"] == 7
+
+
+def test_server_delay_is_honoured_unless_past_the_deadline():
+    policy = RetryPolicy(base_delay=0)
+    error = Unavailable("503 unavailable, retry in 2s")
+    assert policy.begin().next(error).delay == 2.0
+    assert policy.begin().next(error, time_left=1.0) is None
+
+
+def test_fallback_does_not_wait():
+    decision = RetryPolicy(base_delay=1).begin().next(Exception("429 quota exceeded, retry in 30s"))
+    assert decision.fallback and decision.delay == 0.0
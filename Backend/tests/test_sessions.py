@@ -0,0 +1,32 @@
+from test_cors import ORIGIN, exposed
+
+
+def sent_texts(fake_model):
+    """The text of every turn in the last call to Gemini"""
+    contents = fake_model.calls[-1][1]
+    return [part["text"] for turn in contents for part in turn["parts"]]
+
+
+def test_session_turn_only_uploads_the_new_message(client, fake_model):
+    first = client.post("/api/chat", json={"message": "session check: who is usman"})
+    assert first.status_code == 200
+    session_id = first.json["session_id"]
+    assert first.headers["X-Session-Id"] == session_id
+
+    second = client.post("/api/chat", json={"message": "session check: and his projects", "session_id": session_id})
+    assert second.status_code == 200
+    assert second.headers["X-Session-Id"] == session_id
+    sent = "\n".join(sent_texts(fake_model))
+    assert "who is usman" in sent and first.json["reply"].strip() in sent and "and his projects" in sent
+
+
+def test_unknown_session_asks_for_the_full_history(client):
+    response = client.post("/api/chat", json={"message": "session check: hi", "session_id": "x" * 22})
+    assert response.status_code == 404
+    assert response.json["code"] == "session_expired"
+
+
+def test_session_id_is_readable_cross_origin(client):
+    response = client.post("/api/chat", json={"message": "session check: cors"}, headers={"Origin": ORIGIN})
+    assert response.headers["X-Session-Id"] == response.json["session_id"]
+    assert "X-Session-Id" in exposed(response)
@@ -0,0 +1,25 @@
+import threading
+
+from services.settings import env_flag
+from services.shared_file import thread_connection
+
+
+def test_env_flag_falls_back_to_the_default_on_unknown_values(monkeypatch):
+    monkeypatch.delenv("SOME_FLAG", raising=False)
+    assert env_flag("SOME_FLAG", True) is True
+    for value, expected in (("Off", False), (" yes ", True), ("0", False), ("maybe", None)):
+        monkeypatch.setenv("SOME_FLAG", value)
+        assert env_flag("SOME_FLAG", None) is expected
+
+
+def test_each_thread_gets_its_own_wal_connection(tmp_path):
+    local = threading.local()
+    path = str(tmp_path / "shared.sqlite3")
+    conn = thread_connection(local, path)
+    assert thread_connection(local, path) is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    other = []
+    thread = threading.Thread(target=lambda: other.append(thread_connection(local, path)))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
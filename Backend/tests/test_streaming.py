@@ -0,0 +1,24 @@
+from test_tokens import sse_events
+
+
+def test_reply_streams_as_token_events_then_done(client):
+    response = client.post("/api/chat", json={"message": "stream check one", "stream": True})
+    events = sse_events(response)
+    assert response.mimetype == "text/event-stream"
+    assert "".join(data["text"] for event, data in events if event == "token").strip().startswith("hello bro")
+    assert events[-1][0] == "done"
+
+
+def test_empty_stream_is_retried_and_never_stored(core, client, fake_model):
+    fake_model.reply = ""
+    response = client.post("/api/chat", json={"message": "stream check empty", "stream": True})
+    events = sse_events(response)
+    assert events[-1] == ("error", core.SERVICE_UNAVAILABLE)
+    assert len(fake_model.calls) > 1
+    session_id = response.headers["X-Session-Id"]
+    assert core.session_store.get(session_id) is None
+
+    fake_model.reply = None
+    again = client.post("/api/chat", json={"message": "stream check empty"})
+    assert again.headers["X-Cache"] == "MISS"
+    assert again.json["reply"].startswith("hello bro")
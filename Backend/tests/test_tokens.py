@@ -0,0 +1,53 @@
+import json
+
+from services.tokens import TokenBudget, create_token_budget
+
+
+def sse_events(response):
+    events = []
+    for block in response.get_data(as_text=True).strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_output_tokens_are_uncapped_unless_configured(monkeypatch):
+    monkeypatch.delenv("MAX_OUTPUT_TOKENS", raising=False)
+    assert create_token_budget().generation_config("chat") == {}
+    monkeypatch.setenv("MAX_OUTPUT_TOKENS", "256")
+    assert create_token_budget().generation_config("chat") == {"max_output_tokens": 256}
+
+
+def test_route_output_limit_overrides_the_default():
+    budget = TokenBudget(route_output_tokens={"chat": 512})
+    assert budget.generation_config("chat") == {"max_output_tokens": 512}
+    assert budget.generation_config("summary") == {}
+
+
+def test_reply_cut_at_the_limit_is_served_as_truncated(client, fake_model):
+    fake_model.reply = "a partial answer"
+    fake_model.finish_reason = "MAX_TOKENS"
+    response = client.post("/api/chat", json={"message": "tell me everything, limit one"})
+    assert response.status_code == 200
+    assert response.json["reply"] == "a partial answer"
+    assert response.json["truncated"] is True
+
+
+def test_empty_reply_at_the_limit_is_not_retried_or_held_against_the_model(core, client, fake_model):
+    fake_model.reply = ""
+    fake_model.finish_reason = "MAX_TOKENS"
+    response = client.post("/api/chat", json={"message": "tell me everything, limit two"})
+    assert response.status_code == 502
+    assert response.json["code"] == "output_limit_reached"
+    assert len(fake_model.calls) == 1
+    models = core.model_router.snapshot()["models"]
+    assert models and all(health["error_rate"] == 0 for health in models.values())
+
+
+def test_streamed_empty_reply_at_the_limit_ends_with_an_error_event(client, fake_model):
+    fake_model.reply = ""
+    fake_model.finish_reason = "MAX_TOKENS"
+    response = client.post("/api/chat", json={"message": "tell me everything, limit three", "stream": True})
+    event, data = sse_events(response)[-1]
+    assert event == "error" and data["code"] == "output_limit_reached"
+    assert len(fake_model.calls) == 1
@@ -0,0 +1,41 @@
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+
+from services.upstream import UpstreamPool, create_upstream_pool
+
+
+def test_pool_is_off_unless_configured(monkeypatch):
+    monkeypatch.delenv("UPSTREAM_POOL_SIZE", raising=False)
+    assert create_upstream_pool() is None
+    monkeypatch.setenv("UPSTREAM_POOL_SIZE", "2")
+    assert create_upstream_pool().size == 2
+
+
+def test_idle_connections_are_not_pinged():
+    options = dict(UpstreamPool()._options())
+    assert "grpc.keepalive_permit_without_calls" not in options
+    assert options["grpc.keepalive_time_ms"] > 60000
+
+
+def test_unsupported_sdk_keeps_its_own_transport(monkeypatch, capsys):
+    monkeypatch.setenv("FLASK_ENV", "production")
+    manager = genai_client._client_manager
+    make_client = manager.make_client
+    monkeypatch.setattr(genai, "__version__", "9.0.0")
+    assert UpstreamPool().install("test-key") is False
+    assert manager.make_client == make_client
+    assert "UPSTREAM_POOL_SIZE ignored: google.generativeai 9.0.0" in capsys.readouterr().out
+
+
+def test_pooled_client_failure_falls_back_to_the_sdk(monkeypatch):
+    manager = genai_client._client_manager
+    monkeypatch.setattr(manager, "make_client", manager.make_client)
+    monkeypatch.setattr(manager, "clients", dict(manager.clients))
+    pool = UpstreamPool()
+
+    def broken(name, client_info):
+        raise RuntimeError("no such transport")
+
+    monkeypatch.setattr(pool, "_build_client", broken)
+    assert pool.install("test-key") is True
+    assert type(manager.make_client("generative")).__name__ == "GenerativeServiceClient"
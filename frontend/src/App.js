@@ -94,6 +94,32 @@ const formatMarkdown = (text) => {
   return text;
 };
 
+// Read a Server-Sent Events body and hand each event to onEvent(name, data)
+const readEventStream = async (response, onEvent) => {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let name = "message";
+      let data = "";
+      rawEvent.split("\n").forEach((line) => {
+        if (line.startsWith("event:")) name = line.slice(6).trim();
+        else if (line.startsWith("data:")) data += line.slice(5).trim();
+      });
+      if (data) onEvent(name, JSON.parse(data));
+    }
+  }
+};
+
 function App() {
   const [message, setMessage] = useState("");
   const [chatLog, setChatLog] = useState(() => {
@@ -123,6 +149,14 @@ function App() {
   const botReplyAddedRef = useRef(false);
   const messageInputRef = useRef(null);
   const isScrolledUpRef = useRef(false);
+  // Server-side conversation id; while set only the new message is uploaded each turn
+  const sessionIdRef = useRef(localStorage.getItem("sessionId"));
+
+  const setSessionId = useCallback((id) => {
+    sessionIdRef.current = id || null;
+    if (id) localStorage.setItem("sessionId", id);
+    else localStorage.removeItem("sessionId");
+  }, []);
 
   useEffect(() => {
     if (messageInputRef.current) messageInputRef.current.focus();
@@ -203,6 +237,8 @@ function App() {
       abortControllerRef.current.abort();
       abortControllerRef.current = null;
     }
+    // The local log now holds a cut-off reply, so the next turn re-sends the full history
+    setSessionId(null);
     if (botTypingText.trim() !== "" && !botReplyAddedRef.current) {
       setChatLog((prev) => [...prev, { sender: "bot", text: botTypingText, timestamp: new Date() }]);
       botReplyAddedRef.current = true;
@@ -210,7 +246,7 @@ function App() {
     setLoading(false);
     setBotTypingText("");
     botReplyAddedRef.current = false;
-  }, [botTypingText]);
+  }, [botTypingText, setSessionId]);
 
   const sendMessage = useCallback(async () => {
     const messageToSend = message.trim();
@@ -229,15 +265,60 @@ function App() {
     try {
       const backendUrl = process.env.REACT_APP_BACKEND_URL;
       const apiUrl = backendUrl ? `${backendUrl}/api/chat` : '/api/chat';
-      const messages = chatLog.map(msg => ({ sender: msg.sender, text: msg.text }));
-      messages.push({ sender: 'user', text: messageToSend });
-
-      const response = await fetch(apiUrl, {
+      const postChat = (payload) => fetch(apiUrl, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ messages }),
+        body: JSON.stringify({ ...payload, stream: true }),
         signal,
       });
+      const fullHistory = () => {
+        const messages = chatLog.map(msg => ({ sender: msg.sender, text: msg.text }));
+        messages.push({ sender: 'user', text: messageToSend });
+        return { messages };
+      };
+
+      let response;
+      if (sessionIdRef.current) {
+        response = await postChat({ session_id: sessionIdRef.current, message: messageToSend });
+        // The session expired or lives on another instance: start a new one from the local log
+        if (response.status === 404) {
+          setSessionId(null);
+          response = await postChat(fullHistory());
+        }
+      } else {
+        response = await postChat(fullHistory());
+      }
+      // Stateless deployments never send an id, so they keep getting the full history
+      setSessionId(response.ok ? response.headers.get("X-Session-Id") : null);
+
+      // Streaming backends send tokens as they are generated; older ones still reply with JSON
+      const contentType = response.headers.get("Content-Type") || "";
+      if (response.ok && contentType.includes("text/event-stream")) {
+        let streamedText = "";
+        let streamError = null;
+        await readEventStream(response, (event, data) => {
+          if (event === "token") {
+            streamedText += data.text;
+            setBotTypingText(streamedText);
+          } else if (event === "error") {
+            streamError = data.error;
+          }
+        });
+
+        if (streamError) {
+          // The server only stores completed turns, so resync from the local log next time
+          setSessionId(null);
+          if (!streamedText) throw new Error(streamError);
+        }
+        if (!signal.aborted && !botReplyAddedRef.current) {
+          setChatLog((prev) => [...prev, { sender: "bot", text: streamedText || "Sorry, couldn't get a response. Try again?", timestamp: new Date() }]);
+          botReplyAddedRef.current = true;
+          setTimeout(() => {
+            if (messageInputRef.current) messageInputRef.current.focus();
+          }, 100);
+        }
+        return;
+      }
 
       let result;
       const responseText = await response.text();
@@ -262,6 +343,7 @@ function App() {
         setBotTypingText("");
       }
     } catch (error) {
+      setSessionId(null);
       if (error.name !== "AbortError") {
         let errorMsg;
         if (error.message.includes("invalid response") || error.message.includes("Unexpected token")) {
@@ -284,11 +366,12 @@ function App() {
       typingIntervalRef.current = null;
       botReplyAddedRef.current = false;
     }
-  }, [message, loading, chatLog, typeEffect, botTypingText]);
+  }, [message, loading, chatLog, typeEffect, botTypingText, setSessionId]);
 
   const handleNewChat = () => {
     if (window.confirm("Start a new chat? This will clear the current conversation.")) {
       setChatLog([]);
+      setSessionId(null);
       setMessage("");
       setBotTypingText("");
       setLoading(false);